@@ -1,65 +1,378 @@
 import http.server
-import socketserver
+import socket
+import gzip
 import json
 import urllib.parse
 import os
 import sys
+import argparse
 from datetime import datetime
 
 # 将当前目录加入路径以便导入我们的模块
 sys.path.append(os.getcwd())
 
+import candle_pyramid
+import cross_market
+import dataset_catalog
 import find_similar_patterns
-from repair_chart import regenerate_html
+import live_feed
+import ohlc_store
+import parallel_search
+import result_cache
+import search_metrics
+import standing_queries
+from chunked_search import CHUNKED_METRICS
+from mass_engine import METRICS
+from multivariate import MULTIVARIATE_METRICS, parse_channels
+from repair_chart import render_app_page
+from search_jobs import JobManager
 
 PORT = 8000
+# /api/ohlc 单次返回的默认与最大 K 线根数
+OHLC_PAGE = 2000
+OHLC_MAX = 10000
+# 小于该字节数的响应不压缩
+GZIP_MIN_BYTES = 1024
 
 class SearchHandler(http.server.SimpleHTTPRequestHandler):
+    def _send_json(self, status, payload):
+        body = payload if isinstance(payload, bytes) else json.dumps(payload).encode()
+        self._send_body(status, body, 'application/json')
+
+    def _send_body(self, status, body, content_type):
+        """客户端接受 gzip 且响应足够大时压缩发送"""
+        encoding = None
+        if len(body) >= GZIP_MIN_BYTES and 'gzip' in self.headers.get('Accept-Encoding', ''):
+            body = gzip.compress(body, compresslevel=5)
+            encoding = 'gzip'
+        self.send_response(status)
+        self.send_header('Content-type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Vary', 'Accept-Encoding')
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self):
+        content_length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(content_length) or b'{}')
+
     def do_POST(self):
+        if self.path == '/api/queries':
+            return self._register_query(self._read_json())
+        if self.path == '/api/cross_search':
+            return self._cross_search(self._read_json())
         if self.path == '/api/search':
             content_length = int(self.headers['Content-Length'])
             post_data = self.rfile.read(content_length)
             params = json.loads(post_data)
-            
+
             start_time = params.get('startTime')
             length = params.get('length', 24)
-            
+            metric = params.get('metric', 'dtw')
+            if metric not in ('dtw',) + METRICS + MULTIVARIATE_METRICS:
+                return self._send_json(400, {"status": "error", "error": f"未知的距离度量: {metric}"})
+            channels = params.get('channels')
+            if metric in MULTIVARIATE_METRICS:
+                try:
+                    parse_channels(channels)
+                except (ValueError, AttributeError) as e:
+                    return self._send_json(400, {"status": "error", "error": str(e)})
+
             # 转换时间为字符串格式 YYYY-MM-DD HH:MM
             dt = datetime.fromtimestamp(start_time)
             start_str = dt.strftime('%Y-%m-%d %H:%M')
-            
-            print(f"🚀 收到前端请求: 起点 {start_str}, 长度 {length}h")
-            
-            try:
-                # 执行搜索
-                stats = find_similar_patterns.do_search(start_str=start_str, length=length)
-                
-                # 返回成功
-                self.send_response(200)
-                self.send_header('Content-type', 'application/json')
-                self.end_headers()
-                response = {
-                    "status": "success",
-                    "stats": stats
-                }
-                self.wfile.write(json.dumps(response).encode())
-            except Exception as e:
-                print(f"❌ 搜索失败: {e}")
-                self.send_response(500)
-                self.end_headers()
-                self.wfile.write(str(e).encode())
+
+            print(f"🚀 收到前端请求: 起点 {start_str}, 长度 {length}h, 度量 {metric}")
+
+            # 登记任务后立即返回，搜索由后台线程池执行
+            job = self.server.jobs.submit(start_str, length=length, metric=metric, channels=channels)
+            self._send_json(202, {"status": "queued", "job_id": job.id})
         else:
             self.send_response(404)
             self.end_headers()
 
+    def do_DELETE(self):
+        path = urllib.parse.urlparse(self.path).path
+        if not path.startswith('/api/queries/'):
+            return self._send_json(404, {"status": "error", "error": "not found"})
+        if not standing_queries.unregister(path[len('/api/queries/'):], self.server.queries_path):
+            return self._send_json(404, {"status": "error", "error": "query not found"})
+        self.server.reload_queries()
+        return self._send_json(200, {"status": "success"})
+
     def do_GET(self):
-        # 默认返回图表页面
-        if self.path == '/' or self.path == '/index.html':
-            self.path = '/tradingview_1h_chart.html'
+        parsed = urllib.parse.urlparse(self.path)
+        path = parsed.path
+        if path.startswith('/api/jobs/'):
+            return self._handle_job(path[len('/api/jobs/'):])
+        if path == '/api/stream':
+            return self._handle_stream(dict(urllib.parse.parse_qsl(parsed.query)))
+        if path == '/api/queries':
+            queries = standing_queries.load_queries(self.server.queries_path)
+            payload = {'queries': [{k: v for k, v in q.items() if k != 'pattern'} for q in queries]}
+            if self.server.standing is not None:
+                payload['stats'] = {**self.server.standing.stats, **self.server.standing.latency_summary()}
+            return self._send_json(200, payload)
+        if path == '/api/ohlc':
+            return self._handle_ohlc(dict(urllib.parse.parse_qsl(parsed.query)))
+        if path == '/api/datasets':
+            return self._send_json(200, {'datasets': dataset_catalog.datasets()})
+        if path.startswith('/api/results/'):
+            return self._handle_results(path[len('/api/results/'):])
+        if path == '/metrics':
+            # 搜索各阶段耗时等直方图（Prometheus 文本格式）
+            return self._send_body(200, search_metrics.registry.render().encode(),
+                                   'text/plain; version=0.0.4; charset=utf-8')
+        # 默认返回图表页面：静态模板，数据由页面通过 API 获取
+        if path == '/' or path == '/index.html':
+            return self._send_body(200, self.server.page, 'text/html; charset=utf-8')
         return http.server.SimpleHTTPRequestHandler.do_GET(self)
 
-print(f"📡 交互式服务器正在启动: http://localhost:{PORT}")
-print(f"👉 请在浏览器打开以上地址，并在图表上【点击选择】开始对比")
+    def _handle_ohlc(self, params):
+        """
+        GET /api/ohlc?from=&to=&limit=&points=&interval= 按时间范围（秒）返回 K 线，列式 JSON：
+        {"interval": 周期, "t": [...], "o": [...], "h": [...], "l": [...], "c": [...], ...}
+
+        - 给出 points：在金字塔中选出范围内不超过 points 根的最细分辨率
+        - 给出 interval：使用指定分辨率
+        - 都不给：使用基础分辨率
+        """
+        try:
+            start = int(params['from']) if 'from' in params else None
+            end = int(params['to']) if 'to' in params else None
+            limit = min(int(params.get('limit', OHLC_PAGE)), OHLC_MAX)
+            points = min(int(params['points']), OHLC_MAX) if 'points' in params else None
+        except ValueError:
+            return self._send_json(400, {"status": "error", "error": "from / to / limit / points 必须是整数"})
+        if limit <= 0 or (points is not None and points <= 0):
+            return self._send_json(400, {"status": "error", "error": "limit / points 必须为正数"})
+
+        levels = candle_pyramid.open_pyramid()
+        if 'interval' in params:
+            series = dict(levels).get(params['interval'])
+            if series is None:
+                return self._send_json(400, {"status": "error", "error": f"不支持的分辨率: {params['interval']}"})
+        elif points is not None:
+            _, series = candle_pyramid.choose_level(levels, start, end, points)
+            limit = points
+        else:
+            series = levels[0][1]
+
+        lo, hi = series.locate(start, end, limit)
+        payload = {
+            'symbol': series.meta['symbol'],
+            'interval': series.meta['interval'],
+            'levels': {interval: ohlc_store.interval_seconds(interval) for interval, _ in levels},
+            'total': len(series),
+            'first': int(series.time[0]) if len(series) else None,
+            'last': int(series.time[-1]) if len(series) else None,
+            't': series.time[lo:hi].tolist(),
+            'o': series.open[lo:hi].tolist(),
+            'h': series.high[lo:hi].tolist(),
+            'l': series.low[lo:hi].tolist(),
+            'c': series.close[lo:hi].tolist(),
+        }
+        return self._send_json(200, payload)
+
+    def _handle_stream(self, params):
+        """
+        GET /api/stream?since= 实时 K 线（Server-Sent Events）
+        先补发时间 ≥ Last-Event-ID（重连时）或 since 的 K 线与正在形成的一根，之后只推送新增或变化的 K 线；
+        回完响应头后连接交给 StreamHub，本处理线程随即结束，空闲连接不占线程
+        """
+        feed = self.server.feed
+        if feed is None:
+            # 204 让浏览器的 EventSource 停止重连
+            self.send_response(204)
+            self.end_headers()
+            return
+        try:
+            since = self.headers.get('Last-Event-ID') or params.get('since')
+            since = int(since) if since else None
+        except ValueError:
+            return self._send_json(400, {"status": "error", "error": "since 必须是整数"})
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream; charset=utf-8')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('X-Accel-Buffering', 'no')
+        self.end_headers()
+        self.wfile.flush()
+        # 取走文件描述符：之后服务器对这个请求的 shutdown / close 都不再作用于该连接
+        sock = socket.socket(fileno=self.connection.detach())
+        self.close_connection = True
+        self.server.hub.attach(sock, lambda: feed.snapshot(since))
+
+    def _cross_search(self, params):
+        """
+        POST /api/cross_search 跨市场搜索，登记任务后立即返回 job id（结果见 /api/results/<id>）：
+        {"target": "BTCUSDT:1h", "startTime": 秒（省略为最近的 length 根）, "length": 24,
+         "markets": ["ETHUSDT:1h", "SOLUSDT:1h"]（省略为同周期的全部数据集）, "top_n": 50, "metric": "dtw"}
+        """
+        metric = params.get('metric', 'dtw')
+        if metric not in CHUNKED_METRICS:
+            return self._send_json(400, {"status": "error", "error": f"跨市场搜索不支持的距离度量: {metric}"})
+        try:
+            target = dataset_catalog.parse_dataset(params.get('target') or dataset_catalog.dataset_name(
+                ohlc_store.DEFAULT_SYMBOL, ohlc_store.DEFAULT_INTERVAL))
+            markets = params.get('markets')
+            if markets is not None:
+                markets = [dataset_catalog.parse_dataset(m, target[1]) for m in markets]
+            length = int(params.get('length', 24))
+            top_n = int(params.get('top_n', cross_market.DEFAULT_TOP_N))
+            start = int(params['startTime']) if params.get('startTime') is not None else None
+        except (ValueError, TypeError, AttributeError) as e:
+            return self._send_json(400, {"status": "error", "error": str(e)})
+        if length <= 0 or top_n <= 0:
+            return self._send_json(400, {"status": "error", "error": "length / top_n 必须为正数"})
+        job_params = {'target': dataset_catalog.dataset_name(*target), 'start': start, 'length': length,
+                      'markets': markets and [dataset_catalog.dataset_name(*m) for m in markets],
+                      'top_n': top_n, 'metric': metric}
+        print(f"🌐 跨市场搜索: {job_params['target']} 长度 {length} -> {job_params['markets'] or '同周期全部'}")
+        job = self.server.jobs.submit_task(job_params, lambda report, progress: cross_market.run_cross_search(
+            target, start, length, markets, top_n, metric, report=report, progress=progress))
+        return self._send_json(202, {"status": "queued", "job_id": job.id})
+
+    def _register_query(self, params):
+        """
+        POST /api/queries 登记常驻查询：{"startTime": 形态起点（秒）, "length", "metric", "threshold"?, "name"?,
+        "band"?, "cooldown"?}
+        不给 threshold 时按历史距离分位数校准；band / cooldown 非法时返回 400，不写入查询文件
+        """
+        metric = params.get('metric', 'dtw')
+        if metric not in standing_queries.QUERY_METRICS:
+            return self._send_json(400, {"status": "error", "error": f"未知的距离度量: {metric}"})
+        try:
+            series = ohlc_store.open_store()
+            pattern = standing_queries.pattern_at(series, int(params['startTime']), int(params.get('length', 24)))
+            query = standing_queries.register(pattern, self.server.queries_path, metric=metric,
+                                              threshold=params.get('threshold'), name=params.get('name'),
+                                              band=params.get('band'), cooldown=params.get('cooldown'),
+                                              closes=series.close, source_time=int(params['startTime']))
+        except (KeyError, TypeError, ValueError) as e:
+            return self._send_json(400, {"status": "error", "error": str(e)})
+        self.server.reload_queries()
+        return self._send_json(201, {k: v for k, v in query.items() if k != 'pattern'})
+
+    def _handle_results(self, job_id):
+        """
+        GET /api/results/<id> 返回某个任务的搜索结果（不含各结果的 OHLC 片段）；
+        GET /api/results/latest 返回最近一次写入 similarity_results.json 的结果
+        """
+        if job_id == 'latest':
+            try:
+                with open('similarity_results.json', 'rb') as f:
+                    payload = f.read()
+            except FileNotFoundError:
+                return self._send_json(404, {"status": "error", "error": "no results yet"})
+            return self._send_json(200, find_similar_patterns.strip_segments(payload))
+        job = self.server.jobs.get(job_id)
+        if job is None:
+            return self._send_json(404, {"status": "error", "error": "job not found"})
+        if job.status == 'error':
+            return self._send_json(500, {"status": "error", "error": job.error})
+        if job.status != 'done':
+            return self._send_json(202, job.to_dict())
+        return self._send_json(200, job.payload)
+
+    def _handle_job(self, rest):
+        """GET /api/jobs/<id> 查询进度，GET /api/jobs/<id>/result 获取结果"""
+        job_id, _, action = rest.partition('/')
+        job = self.server.jobs.get(job_id)
+        if job is None:
+            return self._send_json(404, {"status": "error", "error": "job not found"})
+        if action == '':
+            return self._send_json(200, job.to_dict())
+        if action != 'result':
+            return self._send_json(404, {"status": "error", "error": "unknown action"})
+        if job.status == 'done':
+            return self._send_json(200, {"status": "success", **job.result})
+        if job.status == 'error':
+            return self._send_json(500, {"status": "error", "error": job.error})
+        return self._send_json(202, job.to_dict())
+
+class SearchServer(http.server.ThreadingHTTPServer):
+    """每个连接一个线程，搜索在任务线程池中执行，静态请求不会被搜索阻塞"""
+    daemon_threads = True
+    allow_reuse_address = True
+    # 监听队列：服务器重启后大量实时连接会同时重连
+    request_queue_size = 128
+
+    def __init__(self, address, handler=SearchHandler, jobs=None, live_source=None, persist=True,
+                 poll_seconds=live_feed.POLL_SECONDS, queries_path=standing_queries.QUERIES_PATH):
+        super().__init__(address, handler)
+        self.jobs = jobs or JobManager()
+        self.page = render_app_page().encode()
+        self.queries_path = queries_path
+        self.match_log = standing_queries.JsonlSink()
+        # 实时数据（可选）：live_source 为 live_feed 中的数据源；开启后每根新收盘 K 线评估常驻查询，
+        # 命中写入 standing_matches.jsonl 并以 match 事件推送给页面
+        self.hub = None
+        self.feed = None
+        self.standing = None
+        if live_source is not None:
+            self.hub = live_feed.StreamHub()
+            self.standing = standing_queries.engine_for_store(standing_queries.load_queries(queries_path),
+                                                              self._on_match)
+            self.feed = live_feed.LiveFeed(live_source, self.hub, poll_seconds=poll_seconds, persist=persist,
+                                           listeners=[self.standing.on_bars]).start()
+
+    def _on_match(self, match):
+        standing_queries.print_sink(match)
+        self.match_log(match)
+        self.hub.publish(live_feed.sse_event('match', match))
+
+    def reload_queries(self):
+        """查询文件变化后更新引擎中的形态（新长度的窗口用存储末尾预热）"""
+        if self.standing is None:
+            return
+        self.standing.load(standing_queries.load_queries(self.queries_path))
+        series = ohlc_store.open_store()
+        tail = slice(max(0, len(series) - self.standing.max_length), len(series))
+        self.standing.warm(series.time[tail], series.close[tail])
+
+    def server_close(self):
+        super().server_close()
+        if self.feed is not None:
+            self.feed.stop()
+            self.hub.close()
+
+def main():
+    parser = argparse.ArgumentParser(description='Bitcoin 智能对比系统 - 交互式服务器')
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--cache-dir', default=None, help='结果缓存的磁盘目录（不指定则只用内存缓存）')
+    parser.add_argument('--live', choices=['binance', 'replay'], default=None,
+                        help='实时 K 线推送：binance 轮询交易所（收盘 K 线写入存储）；replay 本地回放随机 K 线（不写存储）')
+    parser.add_argument('--live-base-url', default=live_feed.BASE_URL, help='binance 数据源的接口地址（可指向 mock_binance）')
+    parser.add_argument('--poll', type=float, default=live_feed.POLL_SECONDS, help='实时数据轮询间隔（秒）')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='多进程分片搜索的工作进程数（0 为 CPU 核数），进程池常驻、启动时预热')
+    args = parser.parse_args()
+
+    if args.cache_dir:
+        result_cache.configure(disk_dir=args.cache_dir)
+    if args.workers != 1:
+        workers = parallel_search.configure(args.workers or None)
+        parallel_search.warm_up()
+        print(f"⚙️ 多进程分片搜索已开启（{workers} 个工作进程）")
+
+    source = None
+    persist = True
+    if args.live == 'binance':
+        meta = ohlc_store.read_meta()
+        source = live_feed.BinanceSource(meta['symbol'], meta['interval'], args.live_base_url)
+    elif args.live == 'replay':
+        source = live_feed.ReplaySource(live_feed.replay_after(ohlc_store.open_store()))
+        persist = False
+    if source is not None:
+        print(f"📶 实时 K 线推送已开启（{args.live}），每 {args.poll:g} 秒更新")
+
+    print(f"📡 交互式服务器正在启动: http://localhost:{args.port}")
+    print(f"👉 请在浏览器打开以上地址，并在图表上【点击选择】开始对比")
+
+    with SearchServer(("", args.port), live_source=source, persist=persist, poll_seconds=args.poll) as httpd:
+        httpd.serve_forever()
 
-with socketserver.TCPServer(("", PORT), SearchHandler) as httpd:
-    httpd.serve_forever()
+if __name__ == "__main__":
+    main()
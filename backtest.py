@@ -0,0 +1,225 @@
+"""
+走势预测的滚动回测（walk-forward）
+逐根回放历史：对每个目标窗口只在"当时已经走完"的历史里搜索相似走势，
+用与 do_search 相同的统计（胜率、平均 / 中位回报）作为预测，再与目标之后实际的涨跌比较，
+汇总方向命中率、胜率校准曲线与实际回报分布。
+
+无未来数据：目标 [t, t+L) 在第 t+L-1 根收盘时做预测，搜索只用截至这根的收盘价；
+候选窗口与目标间隔 ≥ min_gap ≥ max(24, L)，因此每个匹配之后 max(24, L) 根的走势也都已发生。
+多进程并行：归一化窗口矩阵 / FFT 预处理在父进程算好，fork 出的子进程只读共享
+"""
+import os
+import json
+import time
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+
+from mass_engine import METRICS, DistanceProfiler
+from window_matrix import close_array, normalized_windows
+from find_similar_patterns import (load_data, compute_distances, select_top, search_min_gap, match_outcomes,
+                                   prediction_stats, choose_engine)
+
+# 第一个目标之前至少要有的历史 K 线数
+WARMUP = 24 * 90
+# 每个子任务的目标数
+TASK_SIZE = 64
+# 胜率校准分箱（%）
+CALIBRATION_BINS = np.arange(0, 101, 10)
+
+# fork 前设置，子进程只读共享
+_shared = {}
+
+
+def _prepare(closes, length, metric, engine):
+    """与目标无关的预处理（整段历史算一次，各目标截断使用）"""
+    engine = choose_engine(engine, length)
+    _shared.clear()
+    _shared.update(closes=closes, length=length, metric=metric, engine=engine, windows=None, profiler=None)
+    if metric in METRICS:
+        _shared['profiler'] = DistanceProfiler(closes, length, metric)
+    elif engine == 'pruned':
+        _shared['windows'] = normalized_windows(closes, length, 0, max(0, len(closes) - length))
+
+
+def _evaluate(targets, top_n):
+    """对一批目标做预测并取实际结果"""
+    closes = _shared['closes']
+    length = _shared['length']
+    horizon = max(24, length)
+    min_gap = search_min_gap(length)
+    records = []
+    for target in targets:
+        decision = target + length - 1
+        # 截断到预测时刻：之后的 K 线对搜索不可见
+        known = closes[:decision + 1]
+        distances, _, _ = compute_distances(known, target, length, top_n, min_gap, _shared['engine'],
+                                            metric=_shared['metric'], windows=_shared['windows'],
+                                            profiler=_shared['profiler'])
+        kept = select_top(distances, top_n, min_gap)
+        _, future, has_future = match_outcomes(known, kept, length)
+        realized = (closes[decision + horizon] - closes[decision]) / closes[decision] * 100
+        records.append({
+            'target': int(target),
+            'forecast': prediction_stats(future[has_future].tolist()),
+            'realized': float(realized),
+        })
+    return records
+
+
+def walk_forward_targets(count, length, step=1, warmup=WARMUP, start=None):
+    """可回测的目标行号：前面有 warmup 根历史，后面有完整的 max(24, L) 根实际走势"""
+    first = max(warmup, 0 if start is None else start)
+    last = count - length - max(24, length)
+    return list(range(first, last + 1, step))
+
+
+def summarize(records, bins=CALIBRATION_BINS):
+    """
+    命中率、校准与回报分布
+
+    - 方向命中率: 胜率 ≥ 50% 视为看多（与页面一致），看多且实际上涨 / 看空且实际不涨为命中
+    - 校准: 按预测胜率分箱，比较箱内平均预测胜率与实际上涨比例；Brier 分数越低越好
+    - 分布: 实际回报的分位数，按看多 / 看空分组的平均与中位回报
+    """
+    records = [r for r in records if r['forecast']['count'] > 0]
+    if not records:
+        return {'targets': 0}
+    win_rate = np.array([r['forecast']['win_rate'] for r in records])
+    avg_return = np.array([r['forecast']['avg_return'] for r in records])
+    realized = np.array([r['realized'] for r in records])
+    up = realized > 0
+    bullish = win_rate >= 50
+
+    calibration = []
+    which = np.clip(np.digitize(win_rate, bins[1:-1]), 0, len(bins) - 2)
+    for b in range(len(bins) - 1):
+        mask = which == b
+        if mask.any():
+            calibration.append({
+                'bin': f"{bins[b]}-{bins[b + 1]}",
+                'count': int(mask.sum()),
+                'forecast_win_rate': round(float(win_rate[mask].mean()), 2),
+                'realized_up_rate': round(float(up[mask].mean() * 100), 2),
+            })
+
+    def distribution(values):
+        if len(values) == 0:
+            return {'count': 0}
+        q = np.percentile(values, [5, 25, 50, 75, 95])
+        return {'count': int(len(values)), 'mean': round(float(values.mean()), 3),
+                'p5': round(float(q[0]), 3), 'p25': round(float(q[1]), 3), 'median': round(float(q[2]), 3),
+                'p75': round(float(q[3]), 3), 'p95': round(float(q[4]), 3)}
+
+    rank = lambda x: np.argsort(np.argsort(x, kind='stable'), kind='stable')
+    return {
+        'targets': len(records),
+        'hit_rate': round(float(np.mean(bullish == up) * 100), 2),
+        'hit_rate_avg_return': round(float(np.mean((avg_return > 0) == up) * 100), 2),
+        'base_up_rate': round(float(up.mean() * 100), 2),
+        'brier': round(float(np.mean((win_rate / 100 - up) ** 2)), 4),
+        'return_spearman': round(float(np.corrcoef(rank(avg_return), rank(realized))[0, 1]), 4),
+        'return_mae': round(float(np.abs(realized - avg_return).mean()), 3),
+        'calibration': calibration,
+        'realized': distribution(realized),
+        'realized_when_bullish': distribution(realized[bullish]),
+        'realized_when_bearish': distribution(realized[~bullish]),
+    }
+
+
+def run_backtest(length=24, top_n=200, metric='dtw', engine='auto', step=1, years=3, workers=None,
+                 output=None, data=None):
+    """
+    滚动回测最近 years 年（每 step 根一个目标）
+
+    workers: 进程数，默认 CPU 核数；1 为在当前进程中运行
+    output: 可选，逐目标记录写入的 JSON Lines 文件
+
+    返回: summarize() 的结果，附带耗时
+    """
+    data = load_data() if data is None else data
+    closes = np.ascontiguousarray(close_array(data))
+    times = np.asarray(data.time) if hasattr(data, 'time') else np.array([c['time'] for c in data])
+    start = int(np.searchsorted(times, times[-1] - years * 365 * 86400))
+    targets = walk_forward_targets(len(closes), length, step, start=start)
+    workers = workers or os.cpu_count() or 1
+    print(f"🔁 滚动回测: {len(targets)} 个目标 (长度 {length}, {metric}, 每 {step} 根), {workers} 个进程")
+
+    t0 = time.perf_counter()
+    _prepare(closes, length, metric, engine)
+    tasks = [targets[i:i + TASK_SIZE] for i in range(0, len(targets), TASK_SIZE)]
+    records = []
+    if workers == 1:
+        for done, task in enumerate(tasks, 1):
+            records.extend(_evaluate(task, top_n))
+            _report_progress(done, len(tasks), t0)
+    else:
+        # fork：子进程直接继承 _shared 中的只读数组，不经过序列化
+        with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('fork')) as pool:
+            futures = [pool.submit(_evaluate, task, top_n) for task in tasks]
+            for done, future in enumerate(as_completed(futures), 1):
+                records.extend(future.result())
+                _report_progress(done, len(tasks), t0)
+    records.sort(key=lambda r: r['target'])
+    elapsed = time.perf_counter() - t0
+
+    if output:
+        with open(output, 'w') as f:
+            for r in records:
+                f.write(json.dumps({'target_time': int(times[r['target']]), **r}) + '\n')
+    report = summarize(records)
+    report.update({'length': length, 'metric': metric, 'top_n': top_n, 'step': step, 'workers': workers,
+                   'seconds': round(elapsed, 1)})
+    return report
+
+
+def _report_progress(done, total, t0):
+    if done == total or done % max(1, total // 10) == 0:
+        print(f"⏳ {done}/{total} 批, {time.perf_counter() - t0:.0f}s")
+
+
+def print_report(report):
+    if not report.get('targets'):
+        print("❌ 没有可评估的目标")
+        return
+    print(f"✅ {report['targets']} 个目标, 耗时 {report['seconds']}s")
+    print(f"🎯 方向命中率: {report['hit_rate']}% (按平均回报: {report['hit_rate_avg_return']}%, "
+          f"实际上涨比例: {report['base_up_rate']}%)")
+    print(f"📐 Brier: {report['brier']} | 平均回报与实际回报的 Spearman: {report['return_spearman']} | "
+          f"MAE: {report['return_mae']}%")
+    print("📊 胜率校准:")
+    for row in report['calibration']:
+        print(f"   {row['bin']:>7}%: {row['count']:>6} 个 | 预测 {row['forecast_win_rate']:6.2f}% | "
+              f"实际 {row['realized_up_rate']:6.2f}%")
+    for key, label in (('realized', '全部'), ('realized_when_bullish', '看多时'), ('realized_when_bearish', '看空时')):
+        d = report[key]
+        if d['count']:
+            print(f"💰 实际回报 ({label}, {d['count']} 个): 平均 {d['mean']}% | 中位 {d['median']}% | "
+                  f"5%-95%: {d['p5']}% ~ {d['p95']}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='相似走势预测的滚动回测')
+    parser.add_argument('--length', type=int, default=24, help='模式长度 (小时)')
+    parser.add_argument('--top-n', type=int, default=200, help='每个目标的相似结果数')
+    parser.add_argument('--metric', default='dtw', choices=('dtw',) + METRICS, help='距离度量')
+    parser.add_argument('--engine', default='auto', choices=('auto', 'pruned', 'batch'),
+                        help='DTW 引擎（auto 按模式长度选 batch / pruned，结果相同）')
+    parser.add_argument('--step', type=int, default=1, help='每隔几根 K 线取一个目标')
+    parser.add_argument('--years', type=float, default=3, help='回测最近几年')
+    parser.add_argument('--workers', type=int, default=None, help='进程数，默认 CPU 核数')
+    parser.add_argument('--output', default=None, help='逐目标记录输出 (JSON Lines)')
+    parser.add_argument('--report', default=None, help='汇总结果输出 (JSON)')
+    args = parser.parse_args()
+
+    report = run_backtest(args.length, args.top_n, args.metric, args.engine, args.step, args.years,
+                          args.workers, args.output)
+    print_report(report)
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
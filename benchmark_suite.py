@@ -0,0 +1,293 @@
+"""
+性能基准套件
+用随机游走的合成 K 线（26k / 250k / 2M 根）测量各条路径的耗时、峰值内存与吞吐：
+- load: load_data 打开列式存储并读一遍收盘价
+- parse: Binance 原始 K 线数组 -> 列（klines_to_columns）
+- convert: DataFrame -> TradingView 格式（convert_to_tradingview_format）
+- search: find_similar_patterns，各引擎 × 模式长度 6 / 24 / 168（Streamlit 滑块的两端与默认值）
+- render: regenerate_html 生成内嵌全部数据的离线页面
+
+结果写入 JSON；compare 命令与保存的基线对比，耗时或峰值内存超过阈值的用例标为回归。
+每个用例先计时（不开 tracemalloc），再单独跑一次用 tracemalloc 取 Python / NumPy 分配的峰值
+"""
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import tempfile
+import argparse
+import contextlib
+import tracemalloc
+from datetime import datetime
+import numpy as np
+import pandas as pd
+
+import ohlc_store
+import paa_index
+import find_similar_patterns as fsp
+from mass_engine import METRICS
+from mock_binance import random_walk_klines
+from fetch_binance_ohlc import klines_to_columns, convert_to_tradingview_format
+
+SIZES = {'26k': 26_000, '250k': 250_000, '2m': 2_000_000}
+LENGTHS = (6, 24, 168)
+# 搜索引擎；MASS 度量按 metric 名列出
+ENGINES = ('pruned', 'batch', 'paa', 'minmax_euclidean')
+PATHS = ('load', 'parse', 'convert', 'search', 'render')
+TOP_N = 200
+# 精确 DTW 引擎的计算量上限（窗口数 × L²），超过的组合默认跳过
+MAX_DTW_CELLS = 2e9
+# parse / convert 每块的行数（与下载时逐页解析相当，内存不随总行数增长）
+PARSE_CHUNK = 50_000
+DEFAULT_OUTPUT = 'bench_results.json'
+DEFAULT_BASELINE = 'bench_baseline.json'
+# 比基线慢 / 占用多出 20% 以上视为回归
+DEFAULT_THRESHOLD = 0.2
+# 低于该差值的变化视为噪声
+NOISE_SECONDS = 0.005
+NOISE_MB = 1.0
+
+
+def random_walk_columns(count, seed=0, start=1_500_000_000, step=3600, price=20000.0):
+    """随机游走的 OHLCV 列（与 mock_binance.random_walk_klines 同样的生成方式，向量化）"""
+    rng = np.random.default_rng(seed)
+    closes = price * np.exp(np.cumsum(rng.normal(0, 0.005, count)))
+    opens = np.concatenate([[price], closes[:-1]])
+    spread = np.abs(rng.normal(0, 0.003, count)) * closes
+    return {
+        'time': start + np.arange(count, dtype=np.int64) * step,
+        'open': opens,
+        'high': np.maximum(opens, closes) + spread,
+        'low': np.minimum(opens, closes) - spread,
+        'close': closes,
+        'volume': rng.gamma(2.0, 500.0, count),
+    }
+
+
+@contextlib.contextmanager
+def synthetic_workspace(columns):
+    """在临时目录中写入合成数据并切换工作目录，load_data / regenerate_html 读写的都是这份数据"""
+    cwd = os.getcwd()
+    workdir = tempfile.mkdtemp(prefix='bench-')
+    try:
+        os.chdir(workdir)
+        ohlc_store.write_store(ohlc_store.DEFAULT_STORE, columns)
+        yield workdir
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def _quiet(fn):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return fn()
+
+
+def measure(fn, repeat=1, setup=None):
+    """
+    best-of-repeat 耗时与 tracemalloc 峰值（MB）
+
+    setup: 每次运行前调用、不计时（如清空进程内缓存，保证每次都是冷启动）
+    """
+    timings = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        t0 = time.perf_counter()
+        _quiet(fn)
+        timings.append(time.perf_counter() - t0)
+    if setup:
+        setup()
+    tracemalloc.start()
+    try:
+        _quiet(fn)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {'seconds': round(min(timings), 6), 'peak_mb': round(peak / 2 ** 20, 3)}
+
+
+def _case(path, size, bars, result, count, unit, engine=None, length=None):
+    name = '/'.join(str(part) for part in (path, engine, size, length and f'L{length}') if part)
+    return {'case': name, 'path': path, 'engine': engine, 'size': size, 'bars': bars, 'length': length,
+            **result, 'throughput': round(count / max(result['seconds'], 1e-9), 1), 'unit': unit}
+
+
+def _chunks(count):
+    return [PARSE_CHUNK] * (count // PARSE_CHUNK) + ([count % PARSE_CHUNK] if count % PARSE_CHUNK else [])
+
+
+def bench_parse(size, count, repeat):
+    """按 PARSE_CHUNK 行一块解析，各块复用同一份原始数组"""
+    rows = random_walk_klines(min(count, PARSE_CHUNK))
+    chunks = _chunks(count)
+    fn = lambda: [klines_to_columns(rows[:n]) for n in chunks]
+    return _case('parse', size, count, measure(fn, repeat), count, 'rows/s')
+
+
+def bench_convert(size, count, repeat):
+    columns = random_walk_columns(min(count, PARSE_CHUNK))
+    df = pd.DataFrame({name: values for name, values in columns.items() if name != 'time'})
+    df.insert(0, 'datetime', pd.to_datetime(columns['time'], unit='s'))
+    chunks = _chunks(count)
+    fn = lambda: [convert_to_tradingview_format(df.iloc[:n]) for n in chunks]
+    return _case('convert', size, count, measure(fn, repeat), count, 'rows/s')
+
+
+def bench_search(size, data, length, engine, repeat, max_cells=MAX_DTW_CELLS):
+    """以中间一根为目标搜索 top 200；计算量超过 max_cells 的精确 DTW 组合返回 None"""
+    windows = len(data) - length
+    if engine in ('pruned', 'batch') and windows * length ** 2 > max_cells:
+        return None
+    metric = engine if engine in METRICS else 'dtw'
+    target = len(data) // 2
+    min_gap = fsp.search_min_gap(length)
+    fn = lambda: fsp.find_similar_patterns(data, target, length, TOP_N, min_gap,
+                                           engine='pruned' if metric != 'dtw' else engine, metric=metric)
+    # PAA 索引按内容缓存在进程内，每次清空以计入建索引的时间
+    setup = paa_index._cache.clear if engine == 'paa' else None
+    return _case('search', size, len(data), measure(fn, repeat, setup), windows, 'windows/s', engine, length)
+
+
+def bench_render(size, data, repeat):
+    """先写一份真实的搜索结果，再计时离线页面的生成"""
+    output, _ = _quiet(lambda: fsp.build_search_output(data, len(data) // 2, 24, TOP_N, metric='minmax_euclidean',
+                                                       use_index=False))
+    with open('similarity_results.json', 'w') as f:
+        json.dump(output, f)
+    from repair_chart import regenerate_html
+    return _case('render', size, len(data), measure(regenerate_html, repeat), len(data), 'rows/s')
+
+
+def run_suite(sizes=tuple(SIZES), lengths=LENGTHS, engines=ENGINES, paths=PATHS, repeat=1,
+              max_cells=MAX_DTW_CELLS, seed=0):
+    """运行所选的用例，返回 {'meta': 环境信息, 'cases': [...]}"""
+    cases = []
+
+    def record(case):
+        cases.append(case)
+        extra = f" | {case['throughput']:,.0f} {case['unit']}"
+        print(f"⏱️ {case['case']:<34} {case['seconds'] * 1000:10.1f} ms | 峰值 {case['peak_mb']:8.1f} MB{extra}")
+
+    for size in sizes:
+        count = SIZES[size]
+        print(f"📦 {size}: {count:,} 根合成 K 线")
+        if 'parse' in paths:
+            record(bench_parse(size, count, repeat))
+        if 'convert' in paths:
+            record(bench_convert(size, count, repeat))
+        if not {'load', 'search', 'render'} & set(paths):
+            continue
+        with synthetic_workspace(random_walk_columns(count, seed)):
+            if 'load' in paths:
+                record(_case('load', size, count, measure(lambda: float(fsp.load_data().close.sum()), repeat),
+                             count, 'rows/s'))
+            data = _quiet(fsp.load_data)
+            if 'search' in paths:
+                for length in lengths:
+                    for engine in engines:
+                        case = bench_search(size, data, length, engine, repeat, max_cells)
+                        if case is None:
+                            print(f"⏭️ search/{engine}/{size}/L{length}: 超过计算量上限 {max_cells:.0e}，跳过")
+                        else:
+                            record(case)
+            if 'render' in paths:
+                record(bench_render(size, data, repeat))
+            del data
+
+    meta = {
+        'date': datetime.now().strftime('%Y-%m-%d %H:%M'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'cpus': os.cpu_count(),
+        'repeat': repeat,
+        'top_n': TOP_N,
+    }
+    return {'meta': meta, 'cases': cases}
+
+
+def compare(baseline, current, threshold=DEFAULT_THRESHOLD):
+    """
+    按用例名对比两次结果；耗时或峰值内存超过基线 (1 + threshold) 倍且差值超过噪声下限的记为回归
+
+    返回: 回归用例列表
+    """
+    previous = {case['case']: case for case in baseline['cases']}
+    regressions = []
+    print(f"{'用例':<36}{'基线 ms':>11}{'本次 ms':>11}{'耗时比':>8}{'内存比':>8}")
+    for case in current['cases']:
+        base = previous.get(case['case'])
+        if base is None:
+            print(f"{case['case']:<36}{'-':>11}{case['seconds'] * 1000:>11.1f}   (新用例)")
+            continue
+        time_ratio = case['seconds'] / max(base['seconds'], 1e-9)
+        mem_ratio = case['peak_mb'] / max(base['peak_mb'], 1e-9)
+        slower = time_ratio > 1 + threshold and case['seconds'] - base['seconds'] > NOISE_SECONDS
+        bigger = mem_ratio > 1 + threshold and case['peak_mb'] - base['peak_mb'] > NOISE_MB
+        flag = ' ❌ 回归' if slower or bigger else ''
+        print(f"{case['case']:<36}{base['seconds'] * 1000:>11.1f}{case['seconds'] * 1000:>11.1f}"
+              f"{time_ratio:>8.2f}{mem_ratio:>8.2f}{flag}")
+        if flag:
+            regressions.append({'case': case['case'], 'time_ratio': round(time_ratio, 3),
+                                'memory_ratio': round(mem_ratio, 3)})
+    missing = set(previous) - {case['case'] for case in current['cases']}
+    if missing:
+        print(f"⚠️ 本次缺少 {len(missing)} 个基线用例: {', '.join(sorted(missing))}")
+    if regressions:
+        print(f"❌ {len(regressions)} 个用例超过阈值 {threshold:.0%}")
+    else:
+        print(f"✅ 没有超过阈值 {threshold:.0%} 的回归")
+    return regressions
+
+
+def _load(path):
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def _save(path, results):
+    with open(path, 'w') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"💾 结果已保存到 {path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='搜索 / 抓取解析 / 页面渲染的性能基准套件')
+    sub = parser.add_subparsers(dest='command', required=True)
+    run = sub.add_parser('run', help='运行基准并保存结果')
+    run.add_argument('--sizes', nargs='+', choices=list(SIZES), default=list(SIZES), help='合成数据规模')
+    run.add_argument('--lengths', type=int, nargs='+', default=list(LENGTHS), help='模式长度')
+    run.add_argument('--engines', nargs='+', choices=ENGINES, default=list(ENGINES), help='搜索引擎 / 度量')
+    run.add_argument('--paths', nargs='+', choices=PATHS, default=list(PATHS), help='要测量的路径')
+    run.add_argument('--repeat', type=int, default=1, help='每个用例计时几次取最好')
+    run.add_argument('--max-cells', type=float, default=MAX_DTW_CELLS,
+                     help='精确 DTW 的计算量上限（窗口数 × L²），超过的组合跳过')
+    run.add_argument('--output', default=DEFAULT_OUTPUT, help='结果文件')
+    run.add_argument('--save-baseline', action='store_true', help='同时保存为基线')
+    run.add_argument('--baseline', default=DEFAULT_BASELINE, help='基线文件')
+    cmp = sub.add_parser('compare', help='与基线对比，发现回归时退出码为 1')
+    cmp.add_argument('--baseline', default=DEFAULT_BASELINE, help='基线文件')
+    cmp.add_argument('--current', default=DEFAULT_OUTPUT, help='本次结果文件')
+    cmp.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD, help='允许的变慢 / 增长比例')
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        results = run_suite(args.sizes, args.lengths, args.engines, args.paths, args.repeat, args.max_cells)
+        _save(args.output, results)
+        if args.save_baseline:
+            _save(args.baseline, results)
+        return
+    if not os.path.exists(args.baseline):
+        print(f"❌ 找不到基线文件: {args.baseline}（先运行 run --save-baseline）")
+        sys.exit(2)
+    if compare(_load(args.baseline), _load(args.current), args.threshold):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
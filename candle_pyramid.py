@@ -0,0 +1,202 @@
+"""
+多分辨率 K 线金字塔
+由基础序列逐级聚合出更粗的周期（如 1h → 4h → 1d → 1w），每一级都是一个普通的列式存储，
+保存在基础存储目录下的 pyramid/<周期>/ 中。新 K 线到达时每一级只重算最后一根（可能尚未走完）
+及其之后的部分；基础存储被整体重写（回补缺口、重新下载）时金字塔随目录一起删除，下次访问时重建。
+图表接口按请求的时间跨度与点数预算自动选择分辨率
+"""
+import os
+import time
+import json
+import argparse
+import threading
+import numpy as np
+
+import ohlc_store
+
+# 可用的聚合周期，只构建比基础周期更粗且能整除的那些
+LEVEL_CHAIN = ('5m', '15m', '1h', '4h', '1d', '1w')
+# 周线与 Binance 一致从周一 00:00 UTC 开始；1970-01-01 是周四
+WEEK_OFFSET = 4 * 86400
+# 图表默认的点数预算
+DEFAULT_POINTS = 3000
+
+# 同一进程内的并发请求只让一个线程更新金字塔
+_update_lock = threading.Lock()
+
+
+def level_path(base_path, interval):
+    return os.path.join(base_path, 'pyramid', interval)
+
+
+def level_intervals(base_interval):
+    """基础周期之上的各级周期，由细到粗"""
+    base = ohlc_store.interval_seconds(base_interval)
+    return [name for name in LEVEL_CHAIN
+            if ohlc_store.INTERVAL_SECONDS[name] > base and ohlc_store.INTERVAL_SECONDS[name] % base == 0]
+
+
+def bucket_start(times, step):
+    """每根 K 线所属的聚合周期起点（UTC 对齐）"""
+    offset = WEEK_OFFSET if step == ohlc_store.INTERVAL_SECONDS['1w'] else 0
+    return (np.asarray(times) - offset) // step * step + offset
+
+
+def aggregate(columns, step):
+    """
+    把按时间升序的 OHLCV 列聚合为 step 秒一根：
+    open 取第一根，high / low 取极值，close 取最后一根，volume 求和
+    """
+    times = np.asarray(columns['time'])
+    if len(times) == 0:
+        return {name: np.empty(0, dtype=dtype) for name, dtype in ohlc_store.COLUMNS.items()}
+    buckets = bucket_start(times, step)
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    ends = np.r_[starts[1:], len(times)] - 1
+    return {
+        'time': buckets[starts],
+        'open': np.asarray(columns['open'])[starts],
+        'high': np.maximum.reduceat(np.asarray(columns['high']), starts),
+        'low': np.minimum.reduceat(np.asarray(columns['low']), starts),
+        'close': np.asarray(columns['close'])[ends],
+        'volume': np.add.reduceat(np.asarray(columns['volume']), starts),
+    }
+
+
+def _source_meta(source):
+    return {
+        'source_revision': source.meta.get('revision', 0),
+        'source_count': len(source),
+        'source_last': int(source.time[-1]) if len(source) else None,
+    }
+
+
+def _update_level(path, source, interval):
+    """
+    让一级与其上游（基础序列或更细的一级）保持一致
+
+    返回: 'fresh' / 'incremental' / 'rebuild'
+    """
+    step = ohlc_store.interval_seconds(interval)
+    meta = ohlc_store.read_meta(path) if ohlc_store.store_exists(path) else None
+    if meta is not None and meta.get('source_revision') == source.meta.get('revision', 0):
+        return 'fresh'
+
+    # 上游只发生过追加（旧的最后一根之前行数不变）时，从本级最后一根所在周期开始重算
+    if meta is not None and meta['count'] and meta.get('source_last') is not None:
+        _, known = source.locate(end=meta['source_last'])
+        if known == meta['source_count']:
+            level = ohlc_store.open_store(path)
+            lo, _ = source.locate(start=int(level.time[-1]))
+            tail = aggregate({name: values[lo:] for name, values in source.columns.items()}, step)
+            ohlc_store.append_rows(path, tail)
+            ohlc_store.update_meta(path, **_source_meta(source))
+            return 'incremental'
+
+    ohlc_store.write_store(path, aggregate(source.columns, step), source.meta['symbol'], interval,
+                           extra_meta={'known_gaps': [], **_source_meta(source)})
+    return 'rebuild'
+
+
+def update_pyramid(base_path=ohlc_store.DEFAULT_STORE):
+    """
+    逐级更新金字塔（每一级由上一级聚合而来）
+
+    返回: {周期: 'fresh' / 'incremental' / 'rebuild'}
+    """
+    with _update_lock:
+        source = ohlc_store.open_store(base_path)
+        status = {}
+        for interval in level_intervals(source.meta['interval']):
+            path = level_path(base_path, interval)
+            status[interval] = _update_level(path, source, interval)
+            source = ohlc_store.open_store(path)
+        return status
+
+
+def open_pyramid(base_path=ohlc_store.DEFAULT_STORE):
+    """
+    打开基础序列与各级聚合（必要时先更新）
+
+    返回: [(周期, OHLCSeries), ...]，由细到粗
+    """
+    if not ohlc_store.store_exists(base_path):
+        ohlc_store.load_series(base_path)
+    update_pyramid(base_path)
+    base = ohlc_store.open_store(base_path)
+    levels = [(base.meta['interval'], base)]
+    for interval in level_intervals(base.meta['interval']):
+        levels.append((interval, ohlc_store.open_store(level_path(base_path, interval))))
+    return levels
+
+
+def choose_level(levels, start=None, end=None, points=DEFAULT_POINTS):
+    """
+    选出 [start, end] 内 K 线数不超过 points 的最细一级；都超过时用最粗一级
+
+    返回: (周期, OHLCSeries)
+    """
+    for interval, series in levels:
+        lo, hi = series.locate(start, end)
+        if hi - lo <= points:
+            return interval, series
+    return levels[-1]
+
+
+def benchmark(base_path=ohlc_store.DEFAULT_STORE, points=DEFAULT_POINTS):
+    """重建与增量更新的耗时，以及不同缩放跨度下选中的分辨率"""
+    import shutil
+    import tempfile
+
+    base = ohlc_store.load_series(base_path)
+    tmp = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmp, 'base')
+        half = len(base) - 24
+        head = {name: np.array(values[:half]) for name, values in base.columns.items()}
+        ohlc_store.write_store(path, head, base.meta['symbol'], base.meta['interval'])
+
+        t0 = time.perf_counter()
+        update_pyramid(path)
+        rebuild_ms = (time.perf_counter() - t0) * 1000
+
+        # 逐根追加最后 24 根，模拟每小时同步（只计金字塔更新的耗时）
+        elapsed = 0.0
+        for i in range(half, len(base)):
+            ohlc_store.append_rows(path, {name: np.array(values[i:i + 1]) for name, values in base.columns.items()})
+            t0 = time.perf_counter()
+            update_pyramid(path)
+            elapsed += time.perf_counter() - t0
+        incremental_ms = elapsed * 1000 / (len(base) - half)
+        print(f"⏱️ 全量构建: {rebuild_ms:.1f} ms | 每根新 K 线增量更新: {incremental_ms:.2f} ms")
+
+        levels = open_pyramid(path)
+        last = int(base.time[-1])
+        for days in (3, 30, 180, 365, 3 * 365):
+            interval, series = choose_level(levels, last - days * 86400, last, points)
+            lo, hi = series.locate(last - days * 86400, last)
+            print(f"🔍 跨度 {days:>4} 天 -> {interval:>3}，{hi - lo} 根")
+        return {'rebuild_ms': rebuild_ms, 'incremental_ms': incremental_ms}
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='多分辨率 K 线金字塔')
+    parser.add_argument('command', choices=['build', 'info', 'bench'])
+    parser.add_argument('--store', default=ohlc_store.DEFAULT_STORE, help='基础存储目录')
+    parser.add_argument('--points', type=int, default=DEFAULT_POINTS, help='图表点数预算')
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        status = update_pyramid(args.store)
+        print(f"🔺 金字塔已更新: {json.dumps(status, ensure_ascii=False)}")
+    elif args.command == 'info':
+        for interval, series in open_pyramid(args.store):
+            print(f"{interval:>4}: {len(series)} 根, revision {series.meta.get('revision')}")
+    else:
+        benchmark(args.store, args.points)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+"""
+分块（out-of-core）相似走势搜索
+按时间顺序从存储中读出相互重叠 L-1 根的收盘价块，逐块算出窗口距离，只保留一个有界的候选池，
+不再构建整段历史的窗口矩阵与距离数组：峰值内存只取决于块大小、top_n 与 min_gap，与历史长度无关
+
+结果与内存中的搜索完全一致：
+- 贪心选取（按 (距离, 窗口索引) 升序，保留与已选结果间隔 ≥ min_gap 的窗口）每选中一个窗口，
+  最多挡住它两侧 2(min_gap - 1) 个窗口，因此选满 top_n 个之前处理的窗口不超过 top_n (2 min_gap - 1) 个；
+  候选池只需保留键最小的这么多个窗口，在池上贪心与在全部窗口上贪心结果相同
+- 池满之后，池中最大的距离就是后续窗口入池的门槛：DTW 用它做下界剪枝与提前放弃
+- 块内窗口的归一化与 DTW 逐窗口计算，与整段计算逐位相同；欧氏距离的块与 DistanceProfiler 的 FFT 分块对齐，
+  并使用与整段相同的 FFT 长度
+"""
+import time
+import argparse
+import numpy as np
+
+import search_metrics
+from dtw_engine import dtw_batch_bounded, lb_kim, keogh_envelope, lb_keogh, resolve_band
+from mass_engine import METRICS, FFT_BLOCK, DistanceProfiler, fft_size
+from topk_select import greedy_select
+from window_matrix import normalized_windows
+
+# DTW 每块的窗口矩阵元素上限（窗口数 × L），约 32 MB
+CHUNK_CELLS = 1 << 22
+# 块内按下界从小到大每批计算 DTW 的窗口数
+DTW_BLOCK = 2048
+# 超过该根数时 find_similar_patterns 自动使用分块搜索
+OUT_OF_CORE_BARS = 1_000_000
+CHUNKED_METRICS = ('dtw',) + METRICS
+
+
+def pool_capacity(top_n, min_gap):
+    """候选池容量：贪心选满 top_n 个之前最多处理的窗口数"""
+    return top_n * (2 * max(min_gap, 1) - 1)
+
+
+class CandidatePool:
+    """按 (距离, 窗口索引) 保留最小的 capacity 个窗口"""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.indices = np.empty(0, dtype=np.int64)
+        self.distances = np.empty(0)
+
+    @property
+    def threshold(self):
+        """入池门槛：池满时为池中最大距离，否则为 inf（距离大于门槛的窗口不可能入池）"""
+        return float(self.distances[-1]) if len(self.distances) >= self.capacity else np.inf
+
+    def add(self, indices, distances):
+        keep = np.isfinite(distances) & (distances <= self.threshold)
+        if not keep.any():
+            return
+        indices = np.concatenate([self.indices, np.asarray(indices, dtype=np.int64)[keep]])
+        distances = np.concatenate([self.distances, np.asarray(distances, dtype=float)[keep]])
+        if len(distances) > self.capacity:
+            # 先用划分缩小到门槛附近，再对剩下的做稳定排序（并列的距离按索引先后）
+            cut = np.partition(distances, self.capacity - 1)[self.capacity - 1]
+            near = distances <= cut
+            indices, distances = indices[near], distances[near]
+        order = np.lexsort((indices, distances))[:self.capacity]
+        self.indices, self.distances = indices[order], distances[order]
+
+
+def chunk_windows(length, metric):
+    """每块的窗口数：欧氏距离与 FFT 分块对齐；DTW 按窗口矩阵大小限制"""
+    if metric in METRICS:
+        return FFT_BLOCK
+    return max(1024, CHUNK_CELLS // length)
+
+
+def iter_chunks(closes, length, start, stop, size):
+    """
+    按顺序 yield (起始窗口, 收盘价块)，覆盖窗口 [start, stop)；
+    块含 size 个窗口及其后 L-1 根，只从 closes（可为内存映射 / 共享内存）读取这一段
+    """
+    for offset in range(start, stop, size):
+        end = min(stop, offset + size)
+        yield offset, np.array(closes[offset:end + length - 1], dtype=float)
+
+
+def scan_range(metric, length, window_count):
+    """
+    需要扫描的窗口范围上限：欧氏距离的块覆盖到最后一个窗口（与整段计算的 FFT 块内容相同），
+    最后一个窗口本身不作为候选；DTW 只扫描候选窗口
+    """
+    return window_count + 1 if metric in METRICS else window_count
+
+
+def allowed_windows(indices, target_start, min_gap):
+    """可作为候选的窗口：与目标间隔 ≥ min_gap；target_start 为 None（目标来自其他序列）时全部可选"""
+    if target_start is None:
+        return np.ones(len(indices), dtype=bool)
+    return np.abs(indices - target_start) >= min_gap
+
+
+def _dtw_chunk(target, segment, offset, length, target_start, min_gap, band, pool, counts, shared=None):
+    """
+    一块窗口的 DTW：下界超过入池门槛的跳过，其余按下界从小到大分批计算并提前放弃
+    shared: 可选，多个分片共享的门槛（见 parallel_search），与本池的门槛取较小者
+    """
+    windows = normalized_windows(segment, length)
+    indices = np.arange(offset, offset + windows.shape[0])
+    allowed = allowed_windows(indices, target_start, min_gap)
+    windows, indices = windows[allowed], indices[allowed]
+    counts['windows'] += len(indices)
+    if not len(indices):
+        return
+    radius = resolve_band(length, band)
+    upper, lower = keogh_envelope(target, radius)
+    bound = np.maximum(lb_kim(target, windows), lb_keogh(windows, upper, lower))
+    order = np.argsort(bound, kind='stable')
+    computed = 0
+    for start in range(0, len(order), DTW_BLOCK):
+        threshold = pool.threshold if shared is None else min(pool.threshold, shared.get())
+        batch = order[start:start + DTW_BLOCK]
+        batch = batch[bound[batch] <= threshold]
+        if not len(batch):
+            # 已按下界排序，之后的窗口下界只会更大
+            break
+        values, complete = dtw_batch_bounded(target, windows[batch], band,
+                                             None if np.isinf(threshold) else threshold)
+        computed += len(batch)
+        counts['abandoned'] += int((~complete).sum())
+        counts['dtw'] += int(complete.sum())
+        pool.add(indices[batch[complete]], values[complete])
+        if shared is not None:
+            shared.offer(pool.threshold)
+    counts['pruned'] += len(indices) - computed
+
+
+def scan(closes, target_start, length, top_n, min_gap, metric='dtw', band=None, chunk_size=None, start=0,
+         stop=None, progress=None, shared=None, pattern=None):
+    """
+    扫描窗口 [start, stop)（默认全部）并把距离并入候选池
+
+    closes: 完整的收盘价序列（窗口索引为绝对位置），只按块读取
+    pattern: 可选，长度为 length 的目标收盘价（来自其他序列时给出，target_start 为 None，不排除任何窗口）；
+             省略时取 closes[target_start:target_start + length]
+    返回: (CandidatePool, 计数 dict)
+    """
+    if metric not in CHUNKED_METRICS:
+        raise ValueError(f"分块搜索不支持的距离度量: {metric}")
+    total = len(closes)
+    window_count = max(0, total - length)
+    stop = scan_range(metric, length, window_count) if stop is None else stop
+    if pattern is None:
+        pattern = np.array(closes[target_start:target_start + length], dtype=float)
+    pattern = np.asarray(pattern, dtype=float)
+    target = normalized_windows(pattern, length)[0] if metric == 'dtw' else pattern
+    pool = CandidatePool(pool_capacity(top_n, min_gap))
+    size = chunk_size or chunk_windows(length, metric)
+    # 欧氏距离：与整段计算相同的 FFT 长度（整段的窗口数为 total - L + 1）
+    fft_length = fft_size(total - length + 1, length) if metric in METRICS else None
+    counts = {'windows': 0, 'pruned': 0, 'abandoned': 0, 'dtw': 0, 'chunks': 0}
+    for offset, segment in iter_chunks(closes, length, start, stop, size):
+        counts['chunks'] += 1
+        if metric in METRICS:
+            profile = DistanceProfiler(segment, length, metric, size=fft_length).profile(pattern)
+            indices = np.arange(offset, offset + len(segment) - length + 1)
+            allowed = allowed_windows(indices, target_start, min_gap) & (indices < window_count)
+            counts['windows'] += int(allowed.sum())
+            pool.add(indices[allowed], profile[allowed])
+        else:
+            _dtw_chunk(target, segment, offset, length, target_start, min_gap, band, pool, counts, shared)
+        if progress is not None:
+            progress(min(1.0, (offset + size - start) / max(stop - start, 1)))
+    return pool, counts
+
+
+def finish(pool, counts, top_n, min_gap, metric, extra=None):
+    """在候选池上做贪心选取，整理统计；返回 (入选窗口索引, 对应距离, 统计 dict)"""
+    picked = greedy_select(pool.distances, top_n, min_gap, pool.indices)
+    stats = {'windows': counts['windows'], 'chunks': counts['chunks'], 'pool_capacity': pool.capacity, **(extra or {})}
+    if metric == 'dtw':
+        stats.update({name: counts[name] for name in ('pruned', 'abandoned', 'dtw')})
+    search_metrics.count('windows', counts['windows'])
+    return pool.indices[picked], pool.distances[picked], stats
+
+
+def chunked_search(closes, target_start, length, top_n, min_gap, metric='dtw', band=None, chunk_size=None,
+                   progress=None):
+    """
+    分块搜索，结果与 find_similar_patterns 的内存搜索相同
+
+    closes: 收盘价，可以是存储的内存映射列（只按块读取）
+    返回: (入选窗口索引, 对应距离, 统计 dict)，按距离升序
+    """
+    size = chunk_size or chunk_windows(length, metric)
+    pool, counts = scan(closes, target_start, length, top_n, min_gap, metric, band, size, progress=progress)
+    return finish(pool, counts, top_n, min_gap, metric, {'chunk_windows': size})
+
+
+def benchmark(sizes=(250_000, 1_000_000, 4_000_000), length=24, metric='minmax_euclidean', top_n=200,
+              in_memory_max=1_000_000):
+    """
+    随机游走的合成存储上对比分块搜索与内存搜索：结果是否一致、耗时与 tracemalloc 峰值
+    in_memory_max: 超过该根数不再运行内存搜索（只看分块搜索的内存是否保持平稳）
+    """
+    from benchmark_suite import random_walk_columns, synthetic_workspace, measure
+    import ohlc_store
+    from find_similar_patterns import compute_distances, search_min_gap, select_top
+
+    min_gap = search_min_gap(length)
+    rows = []
+    for bars in sizes:
+        with synthetic_workspace(random_walk_columns(bars)):
+            closes = ohlc_store.open_store().close
+            target = bars // 3
+            chunked = measure(lambda: chunked_search(closes, target, length, top_n, min_gap, metric))
+            indices, distances, stats = chunked_search(closes, target, length, top_n, min_gap, metric)
+            row = {'bars': bars, 'chunked_s': chunked['seconds'], 'chunked_mb': chunked['peak_mb']}
+            if bars <= in_memory_max:
+                def in_memory():
+                    full, _, _ = compute_distances(np.asarray(closes, dtype=float), target, length, top_n, min_gap,
+                                                   metric=metric)
+                    kept = select_top(full, top_n, min_gap)
+                    return kept, full[kept]
+                memory = measure(in_memory)
+                kept, expected = in_memory()
+                assert list(indices) == list(kept) and np.array_equal(distances, expected), "分块搜索结果与内存搜索不一致"
+                row.update({'memory_s': memory['seconds'], 'memory_mb': memory['peak_mb'], 'identical': True})
+            rows.append(row)
+            same = '结果一致' if row.get('identical') else '未比对'
+            memory_part = (f" | 内存搜索 {row['memory_s']:.2f}s / {row['memory_mb']:.0f} MB"
+                           if 'memory_s' in row else '')
+            print(f"📏 {bars:,} 根 | 分块 {row['chunked_s']:.2f}s / 峰值 {row['chunked_mb']:.1f} MB{memory_part} | "
+                  f"{stats['chunks']} 块 | {same}")
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description='分块（out-of-core）搜索的一致性与内存基准')
+    parser.add_argument('--sizes', default='250000,1000000,4000000', help='合成数据的根数，逗号分隔')
+    parser.add_argument('--length', type=int, default=24)
+    parser.add_argument('--metric', default='minmax_euclidean', choices=CHUNKED_METRICS)
+    parser.add_argument('--in-memory-max', type=int, default=1_000_000, help='超过该根数不运行内存搜索')
+    args = parser.parse_args()
+    t0 = time.perf_counter()
+    benchmark([int(x) for x in args.sizes.split(',')], args.length, args.metric, in_memory_max=args.in_memory_max)
+    print(f"⏱️ 总耗时 {time.perf_counter() - t0:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
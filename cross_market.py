@@ -0,0 +1,243 @@
+"""
+跨市场相似走势搜索
+以一个数据集（交易对 + 周期）中的一段走势为目标，在选定的一组数据集中搜索相似走势，合并为全局的 top-k，
+回答「ETH 或 SOL 历史上什么时候走出过 BTC 今天的走势」：
+- 周期换算：目标的时长不变，换算为各数据集的根数（BTC 1h 的 24 根对应 4h 周期的 6 根），
+  根数不同时把目标收盘价线性插值重采样到该长度（各度量都先归一化窗口，比较的是形状）
+- 各数据集的扫描切成分片，一起交给 parallel_search 的常驻进程池并行执行；工作进程数为 1 时在本进程依次扫描
+- 不同长度、不同市场的原始距离不能直接比较，排序用相对距离：距离除以目标到该数据集均匀抽样窗口的
+  距离的 BASELINE_QUANTILE 分位数（该数据集上「较近的一段」有多远）；用低分位数而不是中位数，
+  是因为短模式的距离分布左尾更长，中位数会让换算后很短的数据集占满结果。
+  周期相差很大时（换算后只剩几根）短模式仍然更容易贴合，默认只搜索与目标同周期的数据集
+- 各数据集内按自己的 min_gap 去重，不同数据集之间互不影响；相对距离在每个数据集内是距离的单调变换，
+  因此全局贪心选取等于各数据集的贪心选取结果按相对距离归并后的前 top_n 个
+"""
+import json
+import time
+import argparse
+from datetime import datetime
+import numpy as np
+
+import chunked_search
+import dataset_catalog
+import ohlc_store
+import parallel_search
+import search_metrics
+from find_similar_patterns import match_outcomes, resolve_targets, search_min_gap
+from dataset_catalog import dataset_name
+from dtw_engine import dtw_batch
+from topk_select import greedy_select
+from window_matrix import gather_normalized_windows, normalized_windows
+
+# 换算后的模式长度下限，更短的数据集跳过
+MIN_LENGTH = 4
+# 每个数据集估计距离尺度时均匀抽样的窗口数与所取的分位数
+BASELINE_SAMPLE = 2048
+BASELINE_QUANTILE = 0.01
+DEFAULT_TOP_N = 50
+
+
+def market_length(length, source_step, step):
+    """source_step 周期的 length 根换算为 step 周期的根数（时长不变）"""
+    return int(round(length * source_step / step))
+
+
+def resample(pattern, length):
+    """把收盘价序列线性插值到 length 个点（首尾对齐）"""
+    pattern = np.asarray(pattern, dtype=float)
+    if len(pattern) == length:
+        return pattern
+    return np.interp(np.linspace(0, len(pattern) - 1, length), np.arange(len(pattern)), pattern)
+
+
+def _znorm(block):
+    std = block.std(axis=1, keepdims=True)
+    return np.where(std > 0, (block - block.mean(axis=1, keepdims=True)) / np.where(std > 0, std, 1.0), 0.0)
+
+
+def baseline(closes, pattern, length, metric, band=None, sample=BASELINE_SAMPLE):
+    """目标到该数据集均匀抽样的 sample 个窗口的距离的 BASELINE_QUANTILE 分位数，作为相对距离的分母"""
+    positions = np.unique(np.linspace(0, len(closes) - length, sample).astype(int))
+    pattern = np.asarray(pattern, dtype=float)
+    if metric == 'dtw':
+        values = dtw_batch(normalized_windows(pattern, length)[0],
+                           gather_normalized_windows(closes, length, positions), band)
+    else:
+        block = np.asarray(closes, dtype=float)[positions[:, None] + np.arange(length)]
+        if metric == 'znorm_euclidean':
+            windows, target = _znorm(block), _znorm(pattern[None])[0]
+        else:
+            windows = gather_normalized_windows(closes, length, positions)
+            target = normalized_windows(pattern, length)[0]
+        values = np.sqrt(((windows - target) ** 2).sum(axis=1))
+    scale = float(np.quantile(values, BASELINE_QUANTILE))
+    return scale if scale > 0 else 1.0
+
+
+def _plan(target, series, start, length, markets, root):
+    """
+    解析目标与各数据集的扫描参数
+    返回: (目标信息 dict, [(数据集信息 dict, 序列, ScanRequest 参数 dict 或 None), ...])
+    """
+    symbol, interval = target
+    step = ohlc_store.interval_seconds(interval)
+    if start is None:
+        row = len(series) - length
+    else:
+        rows = resolve_targets(series, [start], length)
+        if not rows:
+            raise ValueError(f"目标时间 {start} 放不下 {length} 根的模式")
+        row = rows[0]
+    if row < 0:
+        raise ValueError(f"{dataset_name(symbol, interval)} 不足 {length} 根")
+    pattern = np.array(series.close[row:row + length], dtype=float)
+    info = {'dataset': dataset_name(symbol, interval), 'symbol': symbol, 'interval': interval,
+            'time': int(series.time[row]), 'length': length, 'seconds': length * step}
+    plans = []
+    for market in markets:
+        m_symbol, m_interval = market
+        m_step = ohlc_store.interval_seconds(m_interval)
+        m_length = market_length(length, step, m_step)
+        entry = {'dataset': dataset_name(m_symbol, m_interval), 'symbol': m_symbol, 'interval': m_interval,
+                 'length': m_length}
+        try:
+            m_series = series if market == target else dataset_catalog.open_dataset(m_symbol, m_interval, root)
+        except FileNotFoundError as e:
+            plans.append(({**entry, 'skipped': str(e)}, None, None))
+            continue
+        if m_length < MIN_LENGTH or m_length >= len(m_series):
+            plans.append(({**entry, 'skipped': f'换算后长度 {m_length} 根不可用'}, None, None))
+            continue
+        entry['min_gap'] = search_min_gap(m_length)
+        same = market == target
+        plans.append((entry, m_series, {
+            'target_start': row if same else None,
+            'pattern': None if same else resample(pattern, m_length),
+        }))
+    return info, plans
+
+
+def cross_search(target, start=None, length=24, markets=None, top_n=DEFAULT_TOP_N, metric='dtw', band=None,
+                 workers=None, root=ohlc_store.STORE_ROOT, progress=None, report=None):
+    """
+    跨数据集搜索与目标相似的走势
+
+    target: 目标数据集 'BTCUSDT:1h' 或 (交易对, 周期)
+    start: 目标起始时间（'YYYY-MM-DD HH:MM' 或 Unix 秒），None 为最近的 length 根
+    length: 目标的根数（按目标数据集的周期）
+    markets: 要搜索的数据集列表（写法同 target，省略周期时用目标的周期），
+             None 为目录中与目标同周期的全部已同步数据集；包含目标数据集时跳过目标附近
+    workers: 工作进程数，None 为 parallel_search.default_workers
+    返回: {'target': 目标信息, 'markets': 各数据集的扫描统计, 'results': 按相对距离（score）升序的结果}
+    """
+    if metric not in chunked_search.CHUNKED_METRICS:
+        raise ValueError(f"跨市场搜索不支持的距离度量: {metric}")
+    target = dataset_catalog.parse_dataset(target) if isinstance(target, str) else tuple(target)
+    if markets is None:
+        markets = [(row['symbol'], row['interval']) for row in dataset_catalog.datasets(root)
+                   if row['count'] and row['interval'] == target[1]]
+    markets = [dataset_catalog.parse_dataset(m, target[1]) if isinstance(m, str) else tuple(m) for m in markets]
+    markets = list(dict.fromkeys(markets))
+    workers = workers or parallel_search.default_workers
+
+    series = dataset_catalog.open_dataset(*target, root)
+    info, plans = _plan(target, series, start, length, markets, root)
+    active = [(entry, m_series, extra) for entry, m_series, extra in plans if m_series is not None]
+    requests = [parallel_search.ScanRequest(np.asarray(m_series.close), extra['target_start'], entry['length'],
+                                            top_n, entry['min_gap'], metric, band,
+                                            ohlc_store.dataset_version(m_series), extra['pattern'])
+                for entry, m_series, extra in active]
+    t0 = time.perf_counter()
+    with search_metrics.stage('distances'):
+        if workers > 1:
+            scanned = parallel_search.scan_series(requests, workers, progress=progress)
+        else:
+            scanned = []
+            for i, r in enumerate(requests):
+                pool, counts = chunked_search.scan(r.closes, r.target_start, r.length, r.top_n, r.min_gap, metric,
+                                                   band, pattern=r.pattern)
+                scanned.append((pool, counts, 1))
+                if progress is not None:
+                    progress((i + 1) / len(requests))
+    elapsed = time.perf_counter() - t0
+
+    with search_metrics.stage('select_top'):
+        candidates = []
+        for order, ((entry, m_series, _), (pool, counts, shards)) in enumerate(zip(active, scanned)):
+            picked = greedy_select(pool.distances, top_n, entry['min_gap'], pool.indices)
+            indices, distances = pool.indices[picked], pool.distances[picked]
+            closes = np.asarray(m_series.close)
+            r = requests[order]
+            pattern = closes[r.target_start:r.target_start + r.length] if r.pattern is None else r.pattern
+            entry['baseline'] = baseline(closes, pattern, r.length, metric, band)
+            scores = distances / entry['baseline']
+            change, future, _ = match_outcomes(closes, indices, entry['length'])
+            entry.update({'windows': counts['windows'], 'shards': shards, 'matches': len(indices)})
+            if metric == 'dtw':
+                entry.update({name: counts[name] for name in ('pruned', 'abandoned', 'dtw')})
+            search_metrics.count('windows', counts['windows'])
+            for i, distance, score, c, f in zip(indices.tolist(), distances.tolist(), scores.tolist(),
+                                                change.tolist(), future.tolist()):
+                candidates.append((score, order, i, {
+                    'dataset': entry['dataset'], 'symbol': entry['symbol'], 'interval': entry['interval'],
+                    'index': i, 'time': int(m_series.time[i]),
+                    'date': datetime.fromtimestamp(int(m_series.time[i])).strftime('%Y-%m-%d %H:%M'),
+                    'length': entry['length'], 'distance': distance, 'score': score,
+                    'change': round(c, 4), 'future_change': round(f, 4),
+                }))
+        # 并列的按数据集顺序、再按窗口先后
+        candidates.sort(key=lambda item: item[:3])
+        results = [item[3] for item in candidates[:top_n]]
+
+    if report is not None:
+        report.update({'engine': 'cross_market', 'metric': metric, 'band': band, 'workers': workers,
+                       'seconds': elapsed})
+    return {'target': info, 'metric': metric, 'markets': [entry for entry, _, _ in plans], 'results': results}
+
+
+def run_cross_search(target, start=None, length=24, markets=None, top_n=DEFAULT_TOP_N, metric='dtw', report=None,
+                     progress=None):
+    """search_jobs 使用的入口：返回 (输出 JSON 字节串, 统计 dict)"""
+    report = {} if report is None else report
+    labels = {'target': str(target), 'start': start, 'length': length, 'top_n': top_n, 'metric': metric}
+    with search_metrics.trace(**labels):
+        output = cross_search(target, start, length, markets, top_n, metric, report=report, progress=progress)
+    output['search'] = report
+    stats = {'results': len(output['results']), 'markets': len(output['markets'])}
+    return json.dumps(output).encode(), stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='跨市场 / 跨周期相似走势搜索')
+    parser.add_argument('--target', default=dataset_name(ohlc_store.DEFAULT_SYMBOL, ohlc_store.DEFAULT_INTERVAL),
+                        help='目标数据集，如 BTCUSDT:1h')
+    parser.add_argument('--start', default=None, help='目标起始时间 (YYYY-MM-DD HH:MM)，默认最近的 length 根')
+    parser.add_argument('--length', type=int, default=24, help='目标根数（按目标周期）')
+    parser.add_argument('--markets', default=None,
+                        help='要搜索的数据集，逗号分隔（如 ETHUSDT:1h,SOLUSDT:4h），默认与目标同周期的全部已同步数据集')
+    parser.add_argument('--top-n', type=int, default=DEFAULT_TOP_N)
+    parser.add_argument('--metric', default='dtw', choices=chunked_search.CHUNKED_METRICS)
+    parser.add_argument('--workers', type=int, default=1, help='工作进程数（0 为 CPU 核数）')
+    parser.add_argument('--root', default=ohlc_store.STORE_ROOT, help='存储根目录')
+    args = parser.parse_args()
+    if args.workers != 1:
+        parallel_search.configure(args.workers or None)
+
+    markets = args.markets.split(',') if args.markets else None
+    t0 = time.perf_counter()
+    output = cross_search(args.target, args.start, args.length, markets, args.top_n, args.metric, root=args.root)
+    target = output['target']
+    print(f"🎯 目标: {target['dataset']} 从 {datetime.fromtimestamp(target['time'])} 开始的 {target['length']} 根")
+    for entry in output['markets']:
+        if 'skipped' in entry:
+            print(f"⚠️ {entry['dataset']}: 跳过（{entry['skipped']}）")
+        else:
+            print(f"📊 {entry['dataset']}: L={entry['length']} | {entry['windows']:,} 个窗口 | {entry['matches']} 个匹配")
+    for rank, r in enumerate(output['results'], 1):
+        print(f"{rank:>3}. {r['dataset']:<14} {r['date']}  相对距离 {r['score']:.4f}  "
+              f"期间 {r['change']:+.2f}%  之后 {r['future_change']:+.2f}%")
+    print(f"⏱️ 耗时 {time.perf_counter() - t0:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
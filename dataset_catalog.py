@@ -0,0 +1,190 @@
+"""
+数据集目录
+管理多个 (交易对, 周期) 的列式存储，磁盘布局统一为 ohlc_store/<SYMBOL>_<interval>/，
+登记表 ohlc_store/catalog.json 记录需要同步的数据集；目录下已有但未登记的存储（如旧版本生成的 BTCUSDT_1h）
+同样会列出，可以直接打开与搜索
+"""
+import os
+import json
+import time
+import argparse
+
+import ohlc_store
+
+CATALOG_FILE = 'catalog.json'
+
+
+def catalog_path(root=ohlc_store.STORE_ROOT):
+    return os.path.join(root, CATALOG_FILE)
+
+
+def dataset_name(symbol, interval):
+    """数据集名 'ETHUSDT:1h'"""
+    return f'{symbol.upper()}:{interval}'
+
+
+def parse_dataset(spec, default_interval=ohlc_store.DEFAULT_INTERVAL):
+    """'ETHUSDT:4h' / 'ETHUSDT' -> (交易对, 周期)，未写周期时用 default_interval"""
+    symbol, _, interval = spec.strip().partition(':')
+    if not symbol:
+        raise ValueError(f"无效的数据集: {spec!r}")
+    interval = interval or default_interval
+    ohlc_store.interval_seconds(interval)
+    return symbol.upper(), interval
+
+
+def load_registry(root=ohlc_store.STORE_ROOT):
+    """登记表中的数据集 [{'symbol', 'interval', 'added'}, ...]"""
+    try:
+        with open(catalog_path(root), 'r') as f:
+            return json.load(f).get('datasets', [])
+    except FileNotFoundError:
+        return []
+
+
+def _save_registry(entries, root):
+    """先写临时文件再替换"""
+    os.makedirs(root, exist_ok=True)
+    path = catalog_path(root)
+    with open(path + '.tmp', 'w') as f:
+        json.dump({'datasets': entries}, f, indent=2)
+    os.replace(path + '.tmp', path)
+
+
+def register(symbol, interval, root=ohlc_store.STORE_ROOT):
+    """登记一个数据集（已登记时不变）；返回存储目录"""
+    symbol, interval = parse_dataset(f'{symbol}:{interval}')
+    entries = load_registry(root)
+    if not any((e['symbol'], e['interval']) == (symbol, interval) for e in entries):
+        entries.append({'symbol': symbol, 'interval': interval, 'added': int(time.time())})
+        _save_registry(entries, root)
+    return ohlc_store.store_path(symbol, interval, root)
+
+
+def unregister(symbol, interval, root=ohlc_store.STORE_ROOT):
+    """取消登记（不删除数据）；返回是否登记过"""
+    symbol, interval = parse_dataset(f'{symbol}:{interval}')
+    entries = load_registry(root)
+    kept = [e for e in entries if (e['symbol'], e['interval']) != (symbol, interval)]
+    if len(kept) == len(entries):
+        return False
+    _save_registry(kept, root)
+    return True
+
+
+def _discover(root):
+    """root 下已有的存储目录 -> (交易对, 周期)，以 meta.json 为准"""
+    found = []
+    if not os.path.isdir(root):
+        return found
+    for name in sorted(os.listdir(root)):
+        path = os.path.join(root, name)
+        if '.tmp-' in name or '.old-' in name or not ohlc_store.store_exists(path):
+            continue
+        meta = ohlc_store.read_meta(path)
+        if ohlc_store.store_path(meta['symbol'], meta['interval'], root) == path:
+            found.append((meta['symbol'], meta['interval']))
+    return found
+
+
+def datasets(root=ohlc_store.STORE_ROOT):
+    """
+    全部数据集（登记的在前，其后是目录中已有但未登记的），每项:
+    {'name', 'symbol', 'interval', 'step', 'path', 'registered', 'count', 'first', 'last', 'revision'}
+    尚未同步的登记项 count 为 0
+    """
+    registered = [(e['symbol'], e['interval']) for e in load_registry(root)]
+    pairs = registered + [pair for pair in _discover(root) if pair not in registered]
+    rows = []
+    for symbol, interval in pairs:
+        path = ohlc_store.store_path(symbol, interval, root)
+        row = {'name': dataset_name(symbol, interval), 'symbol': symbol, 'interval': interval,
+               'step': ohlc_store.interval_seconds(interval), 'path': path,
+               'registered': (symbol, interval) in registered,
+               'count': 0, 'first': None, 'last': None, 'revision': None}
+        if ohlc_store.store_exists(path):
+            series = ohlc_store.open_store(path)
+            row.update({'count': len(series), 'revision': series.meta.get('revision'),
+                        'first': int(series.time[0]) if len(series) else None,
+                        'last': int(series.time[-1]) if len(series) else None})
+        rows.append(row)
+    return rows
+
+
+def open_dataset(symbol, interval, root=ohlc_store.STORE_ROOT):
+    """打开一个数据集的存储；默认数据集首次使用且只有 JSON 时自动导入"""
+    path = ohlc_store.store_path(symbol, interval, root)
+    if (symbol.upper(), interval) == (ohlc_store.DEFAULT_SYMBOL, ohlc_store.DEFAULT_INTERVAL):
+        return ohlc_store.load_series(path)
+    if not ohlc_store.store_exists(path):
+        raise FileNotFoundError(f"数据集 {dataset_name(symbol, interval)} 尚未同步（{path}）")
+    return ohlc_store.open_store(path)
+
+
+def sync(symbol, interval, base_url=None, root=ohlc_store.STORE_ROOT):
+    """登记并增量同步一个数据集（首次同步下载全部历史）"""
+    from fetch_binance_ohlc import BASE_URL, sync_klines
+
+    path = register(symbol, interval, root)
+    symbol, interval = parse_dataset(f'{symbol}:{interval}')
+    print(f"📥 同步 {dataset_name(symbol, interval)} -> {path}")
+    return sync_klines(path, symbol, interval, base_url or BASE_URL)
+
+
+def sync_all(base_url=None, root=ohlc_store.STORE_ROOT):
+    """同步全部登记的数据集；单个失败不影响其他，返回 {名称: 同步摘要或错误信息}"""
+    summary = {}
+    for entry in load_registry(root):
+        name = dataset_name(entry['symbol'], entry['interval'])
+        try:
+            summary[name] = sync(entry['symbol'], entry['interval'], base_url, root)
+        except Exception as e:
+            print(f"❌ {name} 同步失败: {e}")
+            summary[name] = {'error': str(e)}
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description='多交易对 / 多周期数据集目录')
+    parser.add_argument('--root', default=ohlc_store.STORE_ROOT, help='存储根目录')
+    sub = parser.add_subparsers(dest='command', required=True)
+    add = sub.add_parser('add', help='登记数据集，如 ETHUSDT:1h')
+    add.add_argument('datasets', nargs='+')
+    add.add_argument('--sync', action='store_true', help='登记后立即同步')
+    add.add_argument('--base-url', default=None, help='K 线接口地址（可指向 mock_binance）')
+    remove = sub.add_parser('remove', help='取消登记（不删除数据）')
+    remove.add_argument('datasets', nargs='+')
+    sub.add_parser('list', help='列出数据集')
+    sync_cmd = sub.add_parser('sync', help='同步指定或全部登记的数据集')
+    sync_cmd.add_argument('datasets', nargs='*')
+    sync_cmd.add_argument('--base-url', default=None, help='K 线接口地址（可指向 mock_binance）')
+    args = parser.parse_args()
+
+    if args.command == 'add':
+        for spec in args.datasets:
+            symbol, interval = parse_dataset(spec)
+            path = register(symbol, interval, args.root)
+            print(f"📒 已登记 {dataset_name(symbol, interval)} -> {path}")
+            if args.sync:
+                sync(symbol, interval, args.base_url, args.root)
+    elif args.command == 'remove':
+        for spec in args.datasets:
+            symbol, interval = parse_dataset(spec)
+            done = unregister(symbol, interval, args.root)
+            print(f"🗑️ 已取消登记 {dataset_name(symbol, interval)}" if done
+                  else f"⚠️ {dataset_name(symbol, interval)} 未登记")
+    elif args.command == 'list':
+        for row in datasets(args.root):
+            span = (f"{time.strftime('%Y-%m-%d', time.gmtime(row['first']))} ~ "
+                    f"{time.strftime('%Y-%m-%d', time.gmtime(row['last']))}" if row['count'] else '未同步')
+            mark = '' if row['registered'] else '（未登记）'
+            print(f"📊 {row['name']:<16} {row['count']:>10,} 根  {span}  {row['path']}{mark}")
+    elif args.datasets:
+        for spec in args.datasets:
+            sync(*parse_dataset(spec), args.base_url, args.root)
+    else:
+        sync_all(args.base_url, args.root)
+
+
+if __name__ == "__main__":
+    main()
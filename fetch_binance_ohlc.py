@@ -1,11 +1,24 @@
 """
-从 Binance API 获取真实的 1小时 OHLC 蜡烛图数据
+从 Binance API 获取真实的 OHLC 蜡烛图数据（默认 BTCUSDT 1小时，其他交易对 / 周期见 dataset_catalog）
 """
 import requests
 import pandas as pd
+import numpy as np
 import json
+import time
+import argparse
+import ohlc_store
+import candle_pyramid
+import dataset_catalog
+import pattern_index
+import outcome_tables
 from datetime import datetime, timedelta
 
+BASE_URL = "https://api.binance.com"
+KLINES_PATH = "/api/v3/klines"
+# --full 与首次同步下载的历史长度（秒），约 3 年
+FULL_HISTORY_SECONDS = 26280 * 3600
+
 def fetch_binance_klines(symbol="BTCUSDT", interval="1h", limit=500):
     """
     从 Binance 获取 K线数据
@@ -17,7 +30,7 @@ def fetch_binance_klines(symbol="BTCUSDT", interval="1h", limit=500):
     
     limit: 最多 1000 条
     """
-    url = "https://api.binance.com/api/v3/klines"
+    url = BASE_URL + KLINES_PATH
     params = {
         "symbol": symbol,
         "interval": interval,
@@ -69,7 +82,18 @@ def convert_to_tradingview_format(df):
         })
     return candles
 
-def fetch_binance_klines_batch(symbol="BTCUSDT", interval="1h", total_limit=2000):
+def dataframe_to_columns(df):
+    """DataFrame 转为列式存储需要的列数组（保留成交量）"""
+    return {
+        'time': ((df['datetime'] - pd.Timestamp(0)) // pd.Timedelta(seconds=1)).to_numpy(dtype='int64'),
+        'open': df['open'].to_numpy(),
+        'high': df['high'].to_numpy(),
+        'low': df['low'].to_numpy(),
+        'close': df['close'].to_numpy(),
+        'volume': df['volume'].to_numpy(),
+    }
+
+def fetch_binance_klines_batch(symbol="BTCUSDT", interval="1h", total_limit=2000, base_url=BASE_URL):
     """
     分批获取超过 1000 条的 K线数据
     """
@@ -81,7 +105,7 @@ def fetch_binance_klines_batch(symbol="BTCUSDT", interval="1h", total_limit=2000
     
     while remaining > 0:
         limit = min(remaining, 1000)
-        url = "https://api.binance.com/api/v3/klines"
+        url = base_url + KLINES_PATH
         params = {
             "symbol": symbol,
             "interval": interval,
@@ -123,17 +147,141 @@ def fetch_binance_klines_batch(symbol="BTCUSDT", interval="1h", total_limit=2000
     
     return df
 
+def fetch_klines_range(symbol, interval, start_ms, end_ms=None, base_url=BASE_URL, session=None):
+    """
+    从 start_ms 起按 startTime 向后翻页，直到 end_ms 或最新一根
+
+    返回: (K线原始数组列表, 请求次数)
+    """
+    http = session or requests
+    rows = []
+    requests_made = 0
+    while True:
+        params = {"symbol": symbol, "interval": interval, "startTime": start_ms, "limit": 1000}
+        if end_ms is not None:
+            params["endTime"] = end_ms
+        response = http.get(base_url + KLINES_PATH, params=params, timeout=10)
+        response.raise_for_status()
+        page = response.json()
+        requests_made += 1
+        rows.extend(page)
+        if len(page) < 1000:
+            break
+        start_ms = page[-1][0] + 1
+        if end_ms is not None and start_ms > end_ms:
+            break
+    return rows, requests_made
+
+def klines_to_columns(rows):
+    """Binance 原始 K 线数组转为列式存储的列（时间单位：秒）"""
+    table = np.array([row[:6] for row in rows], dtype=float).reshape(-1, 6)
+    return {
+        'time': (table[:, 0] // 1000).astype('int64'),
+        'open': table[:, 1],
+        'high': table[:, 2],
+        'low': table[:, 3],
+        'close': table[:, 4],
+        'volume': table[:, 5],
+    }
+
+def sync_klines(store_path=ohlc_store.DEFAULT_STORE, symbol="BTCUSDT", interval="1h",
+                base_url=BASE_URL, backfill=True, now_ms=None):
+    """
+    增量同步：只拉取存储中最后一根之后的 K 线
+
+    - 从最后一根的 open_time 开始请求，重叠的最后一根去重（若有变化则覆盖）
+    - 只追加已收盘的 K 线，未收盘的留到下次同步
+    - 检测存储中的时间缺口并回补；交易所确实没有数据的缺口记入 known_gaps，不再重复请求
+    例行的每小时刷新只需要 1 次请求
+    """
+    step = ohlc_store.interval_seconds(interval)
+    now_ms = int(time.time() * 1000) if now_ms is None else now_ms
+    summary = {'requests': 0, 'appended': 0, 'replaced': False, 'backfilled': 0, 'gaps': 0}
+
+    # 没有存储或存储为空（旧版本可能写入过 0 行的存储）时按首次同步处理
+    if not ohlc_store.store_exists(store_path) or len(ohlc_store.open_store(store_path)) == 0:
+        # 与 --full 相同只取最近 FULL_HISTORY_SECONDS 的历史，而不是从交易所最早的数据翻页
+        start_ms = now_ms - FULL_HISTORY_SECONDS * 1000
+        rows, summary['requests'] = fetch_klines_range(symbol, interval, start_ms, now_ms, base_url)
+        rows = [r for r in rows if r[6] < now_ms]
+        if not rows:
+            # 还没有已收盘的 K 线（如刚上线的交易对）：不写空存储，下次同步仍走首次同步
+            print(f"⚠️ {symbol} {interval} 暂无已收盘的 K 线，未建立存储")
+            return summary
+        ohlc_store.write_store(store_path, klines_to_columns(rows), symbol, interval)
+        candle_pyramid.update_pyramid(store_path)
+        outcome_tables.update_table(store_path)
+        summary['appended'] = len(rows)
+        print(f"💾 新建存储 {store_path}: {len(rows)} 条")
+        return summary
+
+    series = ohlc_store.open_store(store_path)
+    last_ms = int(series.time[-1]) * 1000
+    rows, count = fetch_klines_range(symbol, interval, last_ms, None, base_url)
+    summary['requests'] += count
+    rows = [r for r in rows if r[6] < now_ms]
+    if rows:
+        summary['appended'], summary['replaced'] = ohlc_store.append_rows(store_path, klines_to_columns(rows))
+
+    if backfill:
+        series = ohlc_store.open_store(store_path)
+        known = {tuple(g) for g in series.meta.get('known_gaps', [])}
+        gaps = [g for g in ohlc_store.find_gaps(series.time, step) if g not in known]
+        summary['gaps'] = len(gaps)
+        empty = []
+        filled = []
+        for gap_start, gap_end in gaps:
+            rows, count = fetch_klines_range(symbol, interval, gap_start * 1000, gap_end * 1000, base_url)
+            summary['requests'] += count
+            if rows:
+                filled.extend(rows)
+            else:
+                empty.append([gap_start, gap_end])
+        if filled:
+            ohlc_store.merge_rows(store_path, klines_to_columns(filled))
+            summary['backfilled'] = len(filled)
+        if empty:
+            ohlc_store.update_meta(store_path, known_gaps=sorted(known | {tuple(g) for g in empty}))
+
+    # 各级聚合只重算最后一根及新增部分；相似走势索引只标记受新 K 线影响的条目
+    candle_pyramid.update_pyramid(store_path)
+    pattern_index.update_all(store_path)
+    outcome_tables.update_table(store_path)
+    print(f"🔄 同步完成: 请求 {summary['requests']} 次, 新增 {summary['appended']} 条, "
+          f"回补 {summary['backfilled']} 条")
+    return summary
+
 def main():
-    # 获取 26280 条 1小时 K线数据 (约 3 年)
-    df = fetch_binance_klines_batch("BTCUSDT", interval="1h", total_limit=26280)
+    parser = argparse.ArgumentParser(description='Binance K 线下载 / 增量同步')
+    parser.add_argument('--full', action='store_true', help='重新下载全部历史（默认在已有存储上增量同步）')
+    parser.add_argument('--base-url', default=BASE_URL, help='K 线接口地址（可指向本地替身）')
+    parser.add_argument('--symbol', default=ohlc_store.DEFAULT_SYMBOL, help='交易对')
+    parser.add_argument('--interval', default=ohlc_store.DEFAULT_INTERVAL, help='K 线周期')
+    args = parser.parse_args()
+    symbol = args.symbol.upper()
+    store_path = ohlc_store.store_path(symbol, args.interval)
+    default = (symbol, args.interval) == (ohlc_store.DEFAULT_SYMBOL, ohlc_store.DEFAULT_INTERVAL)
+    if not default:
+        # 其他数据集登记到目录中，之后由 dataset_catalog sync 一起同步
+        dataset_catalog.register(symbol, args.interval)
+
+    if not args.full and ohlc_store.store_exists(store_path):
+        return sync_klines(store_path, symbol, args.interval, base_url=args.base_url)
+
+    # 获取约 3 年的 K 线（1h 周期为 26280 条）
+    total = FULL_HISTORY_SECONDS // ohlc_store.interval_seconds(args.interval)
+    df = fetch_binance_klines_batch(symbol, interval=args.interval, total_limit=total, base_url=args.base_url)
     
-    # 转换并保存 JSON
+    # 写入列式存储；默认数据集另外导出 JSON 以兼容旧工具
+    ohlc_store.write_store(store_path, dataframe_to_columns(df), symbol, args.interval)
+    print(f"💾 已保存到 {store_path}")
     candles = convert_to_tradingview_format(df)
-    with open('btc_1h_ohlc.json', 'w') as f:
-        json.dump(candles, f)
-    print("💾 已保存到 btc_1h_ohlc.json")
+    if default:
+        with open(ohlc_store.DEFAULT_JSON, 'w') as f:
+            json.dump(candles, f)
+        print(f"💾 已保存到 {ohlc_store.DEFAULT_JSON}")
     
     return df, candles
 
 if __name__ == "__main__":
-    df, candles = main()
+    main()
@@ -2,19 +2,36 @@
 相似蜡烛走势搜索工具
 在历史数据中找到与目标模式最相似的走势
 """
+import os
 import json
+import threading
+import time
 import numpy as np
 from fastdtw import fastdtw
 from datetime import datetime
+from dtw_engine import dtw_batch, pruned_dtw, resolve_band
+from mass_engine import METRICS, DistanceProfiler
+import paa_index
+import multivariate
+import chunked_search
+import outcome_tables
+import parallel_search
+import result_cache
+import search_metrics
+from topk_select import greedy_select
+from ohlc_store import load_series, dataset_version
+from window_matrix import close_array, normalized_windows, iter_normalized_windows
+
+# 保护 similarity_results.json 与图表页面的写入
+_output_lock = threading.Lock()
 
 def simple_distance(a, b):
     """简单欧几里得距离"""
     return abs(a - b)
 
 def load_data():
-    """加载 OHLC 数据"""
-    with open('btc_1h_ohlc.json', 'r') as f:
-        data = json.load(f)
+    """加载 OHLC 数据（内存映射的列式存储，首次运行时从 JSON 导入）"""
+    data = load_series()
     print(f"✅ 加载了 {len(data)} 条数据")
     return data
 
@@ -37,7 +54,111 @@ def extract_pattern(data, start_idx, length=24):
     closes = [c['close'] for c in segment]
     return normalize(closes)
 
-def find_similar_patterns(data, target_start, pattern_length=24, top_n=10, min_gap=24):
+def search_min_gap(pattern_length):
+    """do_search 使用的相似结果最小间隔（至少 48 根，且不小于两倍模式长度）"""
+    return max(48, pattern_length * 2)
+
+# engine='auto' 时改用 pruned 的门槛：band 内的 DP 格子数 L × min(L, 2r+1)。
+# BTC 1h 实测（每次搜索）：不加 band 时 L=6 batch 18 ms / pruned 26 ms，L=24 173 / 249 ms，L=48 两者持平，
+# L=72 2.1 / 1.4 s，L=96 4.6 / 2.5 s；band=0.1 时 L≤96 都是 batch 更快，L=128 持平，L=168 3.5 / 2.9 s。
+# 不加 band 时 LB_Keogh 的包络为 [0, 1]、LB_Kim 几乎不排除窗口，短模式下剪枝省下的只有提前放弃，抵不上分批的开销
+PRUNED_MIN_CELLS = 48 * 48
+ENGINES = ('auto', 'pruned', 'batch', 'fastdtw', 'paa')
+
+def choose_engine(engine, pattern_length, band=None):
+    """engine='auto' 时按 band 内的 DP 格子数在 batch 与 pruned 之间选择（两者结果相同）；其他引擎原样返回"""
+    if engine != 'auto':
+        return engine
+    cells = pattern_length * min(pattern_length, 2 * resolve_band(pattern_length, band) + 1)
+    return 'pruned' if cells >= PRUNED_MIN_CELLS else 'batch'
+
+def compute_distances(closes, target_start, pattern_length, top_n, min_gap, engine='auto', band=None,
+                      metric='dtw', progress=None, windows=None, profiler=None):
+    """
+    计算目标与每个候选窗口的距离（候选为 [0, N-L) 中与目标间隔 ≥ min_gap 的窗口）
+
+    windows / profiler: 可选，预先算好的归一化窗口矩阵或 DistanceProfiler，反复搜索同一序列时复用
+
+    返回: (distances, 实际使用的引擎, 统计 dict)；跳过或被剪枝的窗口距离为 inf
+    """
+    engine = choose_engine(engine, pattern_length, band)
+    target_pattern = normalize(closes[target_start:target_start + pattern_length])
+    window_count = max(0, len(closes) - pattern_length)
+    allowed = np.abs(np.arange(window_count) - target_start) >= min_gap
+    candidates = np.flatnonzero(allowed)
+    distances = np.full(window_count, np.inf)
+    stats = {'windows': len(candidates)}
+    if metric in METRICS:
+        engine = 'mass'
+        if profiler is None:
+            with search_metrics.stage('windows'):
+                profiler = DistanceProfiler(closes, pattern_length, metric)
+        with search_metrics.stage('distances'):
+            profile = profiler.profile(closes[target_start:target_start + pattern_length])
+        distances[candidates] = profile[candidates]
+        if progress is not None:
+            progress(1.0)
+    elif metric != 'dtw':
+        raise ValueError(f"未知的距离度量: {metric}")
+    elif engine == 'pruned':
+        if windows is None:
+            with search_metrics.stage('windows'):
+                windows = normalized_windows(closes, pattern_length, 0, window_count)
+        with search_metrics.stage('distances'):
+            distances[candidates], stats = pruned_dtw(target_pattern, windows[candidates], candidates, top_n,
+                                                      min_gap, band=band, progress=progress)
+    elif engine == 'batch':
+        # 窗口按块生成、随即计算，提取与 DTW 交错进行，整体计入 distances
+        with search_metrics.stage('distances'):
+            for offset, block in iter_normalized_windows(closes, pattern_length, stop=window_count):
+                mask = allowed[offset:offset + len(block)]
+                if mask.any():
+                    distances[offset:offset + len(block)][mask] = dtw_batch(target_pattern, block[mask], band=band)
+                if progress is not None:
+                    progress((offset + len(block)) / window_count)
+    elif engine == 'paa':
+        with search_metrics.stage('distances'):
+            distances, stats = paa_index.approximate_distances(closes, target_start, pattern_length, top_n,
+                                                               min_gap, band=band)
+        if progress is not None:
+            progress(1.0)
+    elif engine == 'fastdtw':
+        target_list = target_pattern.tolist()
+        with search_metrics.stage('distances'):
+            for offset, block in iter_normalized_windows(closes, pattern_length, stop=window_count):
+                for row, pattern in enumerate(block):
+                    if allowed[offset + row]:
+                        distances[offset + row] = fastdtw(target_list, pattern.tolist(), dist=simple_distance)[0]
+                if progress is not None:
+                    progress((offset + len(block)) / window_count)
+    else:
+        raise ValueError(f"未知的搜索引擎: {engine}")
+    search_metrics.count('windows', stats['windows'])
+    return distances, engine, stats
+
+def select_top(distances, top_n, min_gap):
+    """
+    按距离稳定排序（距离越小越相似，并列时按时间先后），贪心保留与已选结果间隔 ≥ min_gap 的窗口
+    （分批划分实现，不对全部窗口排序，见 topk_select）
+
+    返回: 入选窗口的索引列表（按距离升序）
+    """
+    # 距离为 inf 的窗口（被跳过或剪枝）不可能入选
+    return greedy_select(distances, top_n, min_gap).tolist()
+
+def make_results(data, indices, distances, pattern_length):
+    """把入选窗口（索引与对应距离）整理成结果 dict 列表"""
+    return [{
+        'index': i,
+        'start_time': datetime.fromtimestamp(data[i]['time']),
+        'distance': distance,
+        'start_price': data[i]['close'],
+        'end_price': data[i + pattern_length - 1]['close']
+    } for i, distance in zip(indices, distances)]
+
+def find_similar_patterns(data, target_start, pattern_length=24, top_n=10, min_gap=24,
+                          engine='auto', band=None, report=None, progress=None, metric='dtw', channels=None,
+                          chunked=None, workers=None):
     """
     在历史数据中找相似走势
     
@@ -47,10 +168,29 @@ def find_similar_patterns(data, target_start, pattern_length=24, top_n=10, min_g
     - pattern_length: 模式长度（默认24小时=1天）
     - top_n: 返回最相似的前N个
     - min_gap: 相似结果之间的最小间隔
+    - engine: 'auto'（默认）按模式长度与 band 在 batch / pruned 中选较快的一个（见 choose_engine）；
+              'pruned' 下界剪枝 + 提前放弃，结果与 batch 完全一致，模式较长（不加 band 时 L ≥ 48）才更快；
+              'batch' 对全部窗口批量计算精确 DTW；'fastdtw' 逐窗口调用 fastdtw（旧实现）；
+              'paa' 先用 PAA 签名的 KD 树取近邻候选，只对候选计算 DTW（近似，见 paa_index）
+    - band: Sakoe-Chiba 约束宽度（pruned/batch 引擎），None 为完整 DTW
+    - report: 可选 dict，写入本次搜索的引擎信息与剪枝统计
+    - progress: 可选回调，参数为已扫描窗口的比例 (0~1)
+    - metric: 'dtw'（默认，使用 engine 指定的 DTW 引擎）；
+              'znorm_euclidean' / 'minmax_euclidean' 用 FFT 一次算出全部窗口的欧氏距离（MASS），不做时间弯曲；
+              'mdtw_dependent' / 'mdtw_independent' 按 channels 比较多通道 K 线特征（见 multivariate）
+    - channels: 多通道度量的通道与权重，如 'ohlc:1,returns:0.5'，默认 multivariate.DEFAULT_CHANNELS
+    - chunked: 分块（out-of-core）搜索，按块从存储读取、只保留有界的候选池，内存不随历史长度增长，
+               结果与内存搜索相同（见 chunked_search）；None 时超过 OUT_OF_CORE_BARS 根自动启用。
+               只用于精确 DTW（pruned / batch）与欧氏距离度量
+    - workers: 多进程分片搜索的工作进程数，None 为 parallel_search.default_workers（默认 1，即不并行）；
+               大于 1 时把窗口范围分片交给常驻进程池，结果与串行相同（见 parallel_search），适用范围同 chunked
+
+    batch 引擎计算的是 fastdtw 所逼近的精确 DTW，因此距离总是 ≤ fastdtw 的结果；
+    在 BTC 1h 数据上排序的 Spearman 相关 ≥ 0.99，前 200 名重合率 ≥ 90%。
     """
-    # 提取目标模式
-    target_pattern = extract_pattern(data, target_start, pattern_length)
-    if target_pattern is None:
+    # 提取目标模式（收盘价只转换一次，窗口由跨步视图统一生成）
+    closes = close_array(data)
+    if target_start < 0 or target_start + pattern_length > len(closes):
         print("❌ 无法提取目标模式")
         return []
     
@@ -58,43 +198,55 @@ def find_similar_patterns(data, target_start, pattern_length=24, top_n=10, min_g
     print(f"🎯 目标模式: 从 {target_time} 开始的 {pattern_length} 小时走势")
     print("🔍 正在搜索相似走势...")
     
-    similarities = []
-    
-    # 滑动窗口搜索
-    for i in range(0, len(data) - pattern_length):
-        # 跳过目标模式附近的时间段
-        if abs(i - target_start) < min_gap:
-            continue
-        
-        pattern = extract_pattern(data, i, pattern_length)
-        if pattern is None:
-            continue
-        
-        # 使用 DTW 计算相似度
-        distance, _ = fastdtw(target_pattern.tolist(), pattern.tolist(), dist=simple_distance)
-        
-        start_time = datetime.fromtimestamp(data[i]['time'])
-        similarities.append({
-            'index': i,
-            'start_time': start_time,
-            'distance': distance,
-            'start_price': data[i]['close'],
-            'end_price': data[i + pattern_length - 1]['close']
-        })
-    
-    # 按距离排序（距离越小越相似）
-    similarities.sort(key=lambda x: x['distance'])
-    
+    engine = choose_engine(engine, pattern_length, band)
+    workers = parallel_search.default_workers if workers is None else workers
+    if chunked is None:
+        chunked = len(closes) > chunked_search.OUT_OF_CORE_BARS
+    exact = metric in chunked_search.CHUNKED_METRICS and (metric != 'dtw' or engine in ('pruned', 'batch'))
+    if exact and workers > 1:
+        key = dataset_version(data) if hasattr(data, 'meta') else None
+        with search_metrics.stage('distances'):
+            kept, kept_distances, stats = parallel_search.sharded_search(closes, target_start, pattern_length, top_n,
+                                                                         min_gap, metric, band, workers, key,
+                                                                         progress=progress)
+        if report is not None:
+            report.update({'engine': 'sharded', 'metric': metric, 'band': band, **stats})
+        with search_metrics.stage('select_top'):
+            return make_results(data, kept.tolist(), kept_distances.tolist(), pattern_length)
+    if chunked and exact:
+        with search_metrics.stage('distances'):
+            kept, kept_distances, stats = chunked_search.chunked_search(closes, target_start, pattern_length, top_n,
+                                                                        min_gap, metric, band, progress=progress)
+        if report is not None:
+            report.update({'engine': 'chunked', 'metric': metric, 'band': band, **stats})
+        with search_metrics.stage('select_top'):
+            return make_results(data, kept.tolist(), kept_distances.tolist(), pattern_length)
+
+    # 滑动窗口搜索（跳过目标模式附近的时间段）
+    if metric in multivariate.MULTIVARIATE_METRICS:
+        channels = multivariate.parse_channels(channels)
+        with search_metrics.stage('windows'):
+            tensor = multivariate.WindowTensor(data, pattern_length, channels)
+            tensor.candidate_windows()
+        with search_metrics.stage('distances'):
+            distances, stats = multivariate.multivariate_distances(data, target_start, pattern_length, top_n,
+                                                                   min_gap, channels,
+                                                                   multivariate.metric_mode(metric), band,
+                                                                   progress, tensor)
+        engine = 'pruned'
+        stats['channels'] = multivariate.channel_spec(tensor.channels)
+        search_metrics.count('windows', stats['windows'])
+    else:
+        distances, engine, stats = compute_distances(closes, target_start, pattern_length, top_n, min_gap,
+                                                     engine, band, metric, progress)
+
+    if report is not None:
+        report.update({'engine': engine, 'metric': metric, 'band': band, **stats})
+
     # 过滤掉太接近的结果
-    filtered = []
-    for s in similarities:
-        is_close = any(abs(s['index'] - existing['index']) < min_gap for existing in filtered)
-        if not is_close:
-            filtered.append(s)
-        if len(filtered) >= top_n:
-            break
-    
-    return filtered
+    with search_metrics.stage('select_top'):
+        kept = select_top(distances, top_n, min_gap)
+        return make_results(data, kept, distances[kept], pattern_length)
 
 def display_results(results, data, pattern_length=24):
     """显示搜索结果"""
@@ -160,63 +312,19 @@ def find_target_window(data, start_date=None, length=24):
     # 如果找不到或数据不够，退回到最后 length 小时
     return max(0, len(data) - length), length
 
-def do_search(start_str=None, length=24, top_n=200):
-    """
-    执行搜索的核心流：加载数据 -> 寻找窗口 -> DTW 搜索 -> 统计计算 -> 保存结果 -> 刷新页面
-    """
-    # 加载数据
-    data = load_data()
-    
-    # 确定目标窗口
-    target_start, pattern_length = find_target_window(data, start_str, length)
-    
-    print(f"🎯 目标模式: 从 {datetime.fromtimestamp(data[target_start]['time'])} 开始的 {pattern_length} 小时走势")
-
-    # 搜索相似走势
-    results = find_similar_patterns(
-        data, 
-        target_start=target_start,
-        pattern_length=pattern_length,
-        top_n=top_n, 
-        min_gap=max(48, pattern_length * 2)
-    )
-    
-    # 保存包含完整 OHLC 的结果
-    output_results = []
-    future_changes = []
-    
-    for r in results:
-        match_end = r['index'] + pattern_length
-        future_obs = max(24, pattern_length)
-        future_end = min(len(data), match_end + future_obs)
-        segment = data[r['index']:future_end]
-        
-        f_change = 0.0
-        if future_end > match_end:
-            f_change = (data[future_end-1]['close'] - data[match_end-1]['close']) / data[match_end-1]['close'] * 100
-            future_changes.append(f_change)
-            
-        output_results.append({
-            'time': int(r['start_time'].timestamp()),
-            'date': r['start_time'].strftime('%Y-%m-%d %H:00'),
-            'distance': float(r['distance']),
-            'change': float((r['end_price'] - r['start_price']) / r['start_price'] * 100),
-            'future_change': float(f_change),
-            'ohlc': segment
-        })
-    
-    # 统计学预测计算
-    if future_changes:
-        up_count = len([x for x in future_changes if x > 0])
-        win_rate = (up_count / len(future_changes)) * 100
-        avg_return = sum(future_changes) / len(future_changes)
-        max_up = max(future_changes)
-        max_down = min(future_changes)
-        median_return = sorted(future_changes)[len(future_changes)//2]
+def prediction_stats(future_changes):
+    """相似走势之后涨跌幅（%）的统计：胜率、平均 / 中位回报、最大涨跌（向量化；中位数取排序后第 n // 2 个）"""
+    future_changes = np.asarray(future_changes, dtype=float)
+    if len(future_changes):
+        win_rate = float((future_changes > 0).mean()) * 100
+        avg_return = float(future_changes.mean())
+        max_up = float(future_changes.max())
+        max_down = float(future_changes.min())
+        median_return = float(np.partition(future_changes, len(future_changes) // 2)[len(future_changes) // 2])
     else:
         win_rate = avg_return = max_up = max_down = median_return = 0
         
-    stats = {
+    return {
         'count': len(future_changes),
         'win_rate': round(win_rate, 2),
         'avg_return': round(avg_return, 2),
@@ -224,34 +332,376 @@ def do_search(start_str=None, length=24, top_n=200):
         'max_down': round(max_down, 2),
         'median_return': round(median_return, 2)
     }
+
+def build_search_output(data, target_start, pattern_length, top_n=200, engine='auto',
+                        report=None, progress=None, metric='dtw', use_index=True, channels=None):
+    """
+    搜索并整理输出（即 similarity_results.json 的内容）
+
+    use_index: 先查预计算索引（pattern_index），条目可用时不再扫描；
+               未命中时实际搜索，并把结果写回索引中待更新的条目
+    channels: 多通道度量的通道与权重，见 find_similar_patterns（索引只覆盖单通道度量）
+
+    返回: (输出 dict, 统计 dict)
+    """
+    engine = choose_engine(engine, pattern_length)
+    min_gap = search_min_gap(pattern_length)
+    hit = None
+    use_index = use_index and metric not in multivariate.MULTIVARIATE_METRICS
+    if use_index:
+        # 延迟导入：pattern_index 依赖本模块的搜索函数
+        import pattern_index
+        t0 = time.perf_counter()
+        with search_metrics.stage('index'):
+            hit = pattern_index.lookup(data, target_start, pattern_length, top_n, min_gap, engine, metric)
+        index_info = {'hit': hit is not None, 'lookup_ms': round((time.perf_counter() - t0) * 1000, 3)}
+
+    if hit is not None:
+        print("⚡ 命中预计算索引")
+        results = make_results(data, *hit, pattern_length)
+        if report is not None:
+            report.update({'engine': 'index', 'metric': metric, 'band': None})
+        if progress is not None:
+            progress(1.0)
+    else:
+        # 搜索相似走势
+        results = find_similar_patterns(
+            data, 
+            target_start=target_start,
+            pattern_length=pattern_length,
+            top_n=top_n, 
+            min_gap=min_gap,
+            engine=engine,
+            report=report,
+            progress=progress,
+            metric=metric,
+            channels=channels
+        )
+        if use_index:
+            with search_metrics.stage('index'):
+                pattern_index.remember(data, target_start, pattern_length, top_n, min_gap, engine, metric, None,
+                                       [r['index'] for r in results], [r['distance'] for r in results])
+    if use_index and report is not None:
+        report['index'] = index_info
     
-    with open('similarity_results.json', 'w') as f:
-        json.dump({
-            'target_time': int(data[target_start]['time']),
-            'target_date': datetime.fromtimestamp(data[target_start]['time']).strftime('%Y-%m-%d %H:%M'),
-            'pattern_length': pattern_length,
-            'stats': stats,
-            'results': output_results
-        }, f)
+    with search_metrics.stage('stats'):
+        # 期间与之后 max(24, L) 根的涨跌一次向量化算出；多周期统计从前瞻收益表按匹配的最后一根取行
+        indices = np.asarray([r['index'] for r in results], dtype=int)
+        closes = close_array(data)
+        change, future, has_future = match_outcomes(closes, indices, pattern_length)
+        _, future_end = match_span(len(data), indices, pattern_length)
+        stats = prediction_stats(future[has_future])
+        stats['horizons'] = outcome_tables.match_stats(outcome_tables.table_for(data), indices + pattern_length - 1)
+
+        # 保存包含完整 OHLC 的结果
+        output_results = [{
+            'time': int(r['start_time'].timestamp()),
+            'date': r['start_time'].strftime('%Y-%m-%d %H:00'),
+            'distance': float(r['distance']),
+            'change': float(c),
+            'future_change': float(f),
+            'ohlc': data[r['index']:end]
+        } for r, c, f, end in zip(results, change.tolist(), future.tolist(), future_end.tolist())]
+    
+    output = {
+        'target_time': int(data[target_start]['time']),
+        'target_date': datetime.fromtimestamp(data[target_start]['time']).strftime('%Y-%m-%d %H:%M'),
+        'pattern_length': pattern_length,
+        'stats': stats,
+        'search': dict(report or {}),
+        'results': output_results
+    }
+    return output, stats
+
+def run_search(start_str=None, length=24, top_n=200, engine='auto', report=None, progress=None,
+               use_cache=True, metric='dtw', channels=None):
+    """
+    加载数据 -> 寻找窗口 -> (缓存) DTW 搜索 -> 统计计算
+
+    report: 可选 dict，写入搜索引擎信息（剪枝统计、缓存命中等）
+    progress: 可选回调，参数为已扫描窗口的比例 (0~1)
+    use_cache: 是否使用结果缓存（键包含数据版本，同步新数据后自动失效）
+    metric / channels: 距离度量与多通道度量的通道权重，见 find_similar_patterns
+
+    返回: (输出 JSON 字节串, 统计 dict)
+    """
+    report = {} if report is None else report
+    if metric in multivariate.MULTIVARIATE_METRICS:
+        # 规范化后作为缓存键，写法不同的同一组通道共用缓存
+        channels = multivariate.channel_spec(multivariate.parse_channels(channels))
+    else:
+        channels = None
+
+    labels = {'start': start_str, 'length': length, 'top_n': top_n, 'metric': metric, 'channels': channels}
+    with search_metrics.trace(**labels) as trace:
+        # 加载数据
+        with search_metrics.stage('load_data'):
+            data = load_data()
     
-    print(f"✅ 统计预测完成: 胜率 {stats['win_rate']}% | 平均回报 {stats['avg_return']}%")
+        # 确定目标窗口
+        with search_metrics.stage('target'):
+            target_start, pattern_length = find_target_window(data, start_str, length)
     
-    # 自动更新 HTML 页面
-    try:
-        from repair_chart import regenerate_html
-        regenerate_html()
-    except Exception as e:
-        print(f"⚠️ 更新 HTML 失败: {e}")
+        print(f"🎯 目标模式: 从 {datetime.fromtimestamp(data[target_start]['time'])} 开始的 {pattern_length} 小时走势")
+
+        cache = result_cache.default_cache
+        # 'auto' 先换算为实际引擎，与显式指定同一引擎的请求共用缓存
+        engine = choose_engine(engine, pattern_length)
+        # 单通道度量的键不含 channels，已有缓存保持有效
+        extra = {'channels': channels} if channels else {}
+        key = result_cache.make_key(dataset_version(data), target_start=target_start,
+                                    pattern_length=pattern_length, top_n=top_n, engine=engine,
+                                    min_gap=search_min_gap(pattern_length), metric=metric, **extra)
+        with search_metrics.stage('cache'):
+            payload, cache_info = (cache.get(key) if use_cache
+                                   else (None, {'hit': False, 'tier': None, 'lookup_ms': 0.0}))
+        if payload is not None:
+            output = json.loads(payload)
+            stats = output['stats']
+            report.update(output.get('search', {}))
+            print("⚡ 命中结果缓存")
+            if progress is not None:
+                progress(1.0)
+        else:
+            output, stats = build_search_output(data, target_start, pattern_length, top_n, engine, report, progress,
+                                                metric, channels=channels)
+            with search_metrics.stage('serialize'):
+                payload = json.dumps(output).encode()
+            if use_cache:
+                with search_metrics.stage('cache'):
+                    cache.put(key, payload)
+        report['cache'] = cache_info
+        trace.labels.update(target_start=int(target_start), cache_hit=bool(cache_info['hit']),
+                            engine=report.get('engine', engine))
+        print(f"✅ 统计预测完成: 胜率 {stats['win_rate']}% | 平均回报 {stats['avg_return']}%")
+    report['trace'] = trace.summary()
+    return payload, stats
+
+def save_results(payload, render_html=True):
+    """
+    写入 similarity_results.json；render_html 时同时重新生成内嵌数据的离线页面
+    （服务器模式的页面通过 API 取数据，不需要重新生成）
+    """
+    # 多个搜索任务可能并发执行，结果文件与页面的写入串行化并原子替换
+    with _output_lock:
+        with search_metrics.stage('save'):
+            tmp_path = f'similarity_results.json.{threading.get_ident()}.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(payload)
+            os.replace(tmp_path, 'similarity_results.json')
         
+        if not render_html:
+            return
+        # 自动更新 HTML 页面
+        try:
+            from repair_chart import regenerate_html
+            with search_metrics.stage('render'):
+                regenerate_html()
+        except Exception as e:
+            print(f"⚠️ 更新 HTML 失败: {e}")
+
+def strip_segments(payload):
+    """去掉每个结果内嵌的 OHLC 片段，前端需要时再按时间范围从 /api/ohlc 获取"""
+    output = json.loads(payload)
+    for item in output.get('results', []):
+        item.pop('ohlc', None)
+    return json.dumps(output).encode()
+
+def do_search(start_str=None, length=24, top_n=200, engine='auto', report=None, progress=None,
+              use_cache=True, render_html=True, metric='dtw', channels=None):
+    """
+    执行搜索的核心流：搜索 -> 保存结果 -> 刷新页面
+
+    report: 可选 dict，除 run_search 写入的内容外，report['trace'] 为各阶段的耗时与内存（见 search_metrics）
+
+    返回: 统计 dict
+    """
+    report = {} if report is None else report
+    with search_metrics.trace() as trace:
+        payload, stats = run_search(start_str, length, top_n, engine, report, progress, use_cache, metric,
+                                    channels)
+        save_results(payload, render_html)
+    report['trace'] = trace.summary()
+    print(f"⏱️ {search_metrics.format_summary(report['trace'])}")
     return stats
 
+# search_many 每批向量化评分的距离矩阵元素上限（查询数 × 窗口数）
+BATCH_CELLS = 1 << 24
+
+def resolve_targets(data, targets, length):
+    """
+    把目标起始时间（'YYYY-MM-DD HH:MM' 字符串或 Unix 秒）换算为行号：取该时间及之前最近的一根，
+    放不下完整模式的目标被丢弃
+    """
+    times = np.asarray(data.time) if hasattr(data, 'time') else np.array([c['time'] for c in data])
+    rows = []
+    for target in targets:
+        if isinstance(target, str):
+            target = int(datetime.strptime(target, '%Y-%m-%d %H:%M').timestamp())
+        row = int(np.searchsorted(times, target, 'right')) - 1
+        if 0 <= row and row + length <= len(times):
+            rows.append(row)
+    return rows
+
+def match_span(count, indices, pattern_length):
+    """
+    各匹配窗口的结束位置与其后 max(24, L) 根的结束位置（不超过数据末尾 count），均为开区间
+
+    返回: (match_end, future_end)
+    """
+    match_end = np.asarray(indices, dtype=int) + pattern_length
+    return match_end, np.minimum(count, match_end + max(24, pattern_length))
+
+def match_outcomes(closes, indices, pattern_length):
+    """
+    各匹配窗口的期间涨跌与之后 max(24, L) 根的涨跌（%），区间见 match_span
+
+    返回: (change, future_change, has_future)
+    """
+    indices = np.asarray(indices, dtype=int)
+    match_end, future_end = match_span(len(closes), indices, pattern_length)
+    has_future = future_end > match_end
+    base = closes[match_end - 1]
+    change = (base - closes[indices]) / closes[indices] * 100
+    future = np.where(has_future, (closes[future_end - 1] - base) / base * 100, 0.0)
+    return change, future, has_future
+
+def search_many(targets, length=24, top_n=200, engine='auto', metric='dtw', output='batch_results.jsonl',
+                data=None, use_index=True, progress=None):
+    """
+    批量搜索多个目标窗口：数据只加载一次，归一化窗口矩阵 / FFT 预处理在所有查询间共用，
+    欧氏度量按块一次评分多个查询；每个查询的结果写成 JSON Lines 的一行（不含 OHLC 片段），
+    不写 similarity_results.json，也不重新生成页面
+
+    targets: 目标起始时间列表，见 resolve_targets
+    output: 输出文件路径，每行 {'target_time', 'pattern_length', 'stats', 'results': 按列存放的结果}
+    progress: 可选回调，参数为已完成查询的比例 (0~1)
+
+    返回: {'queries', 'seconds', 'qps', 'output'}
+    """
+    t0 = time.perf_counter()
+    data = load_data() if data is None else data
+    closes = close_array(data)
+    times = np.asarray(data.time) if hasattr(data, 'time') else np.array([c['time'] for c in data])
+    rows = resolve_targets(data, targets, length)
+    engine = choose_engine(engine, length)
+    min_gap = search_min_gap(length)
+    window_count = max(0, len(closes) - length)
+    positions = np.arange(window_count)
+
+    windows = profiler = None
+    block = 1
+    if metric in METRICS:
+        profiler = DistanceProfiler(closes, length, metric)
+        block = max(1, BATCH_CELLS // max(profiler.count, 1))
+    elif metric != 'dtw':
+        raise ValueError(f"未知的距离度量: {metric}")
+    elif engine == 'pruned':
+        windows = normalized_windows(closes, length, 0, window_count)
+    if use_index:
+        import pattern_index
+
+    print(f"🔍 批量搜索 {len(rows)} 个目标 (长度 {length}, {metric}, 每批 {block} 个)")
+    table = outcome_tables.table_for(data)
+    with open(output, 'w') as f:
+        for start in range(0, len(rows), block):
+            chunk = rows[start:start + block]
+            found = {}
+            if use_index:
+                for target in chunk:
+                    hit = pattern_index.lookup(data, target, length, top_n, min_gap, engine, metric)
+                    if hit is not None:
+                        found[target] = (np.asarray(hit[0], dtype=int), np.asarray(hit[1]))
+            missing = [target for target in chunk if target not in found]
+            if profiler is not None and missing:
+                profiles = profiler.profile(np.stack([closes[t:t + length] for t in missing]))[:, :window_count]
+                for target, distances in zip(missing, profiles):
+                    distances[np.abs(positions - target) < min_gap] = np.inf
+                    kept = select_top(distances, top_n, min_gap)
+                    found[target] = (np.asarray(kept, dtype=int), distances[kept])
+            else:
+                for target in missing:
+                    distances, _, _ = compute_distances(closes, target, length, top_n, min_gap, engine,
+                                                        metric=metric, windows=windows)
+                    kept = select_top(distances, top_n, min_gap)
+                    found[target] = (np.asarray(kept, dtype=int), distances[kept])
+
+            for target in chunk:
+                kept, distances = found[target]
+                change, future, has_future = match_outcomes(closes, kept, length)
+                record = {
+                    'target_time': int(times[target]),
+                    'pattern_length': length,
+                    'stats': {**prediction_stats(future[has_future]),
+                              'horizons': outcome_tables.match_stats(table, kept + length - 1)},
+                    'results': {
+                        'time': times[kept].tolist(),
+                        'distance': np.round(distances, 6).tolist(),
+                        'change': np.round(change, 4).tolist(),
+                        'future_change': np.round(future, 4).tolist(),
+                    },
+                }
+                f.write(json.dumps(record) + '\n')
+            f.flush()
+            if progress is not None:
+                progress(min(1.0, (start + len(chunk)) / len(rows)))
+
+    elapsed = time.perf_counter() - t0
+    qps = len(rows) / elapsed if elapsed > 0 else 0.0
+    print(f"⚡ 完成 {len(rows)} 个查询，耗时 {elapsed:.1f}s，{qps:.1f} 查询/秒 -> {output}")
+    return {'queries': len(rows), 'seconds': elapsed, 'qps': qps, 'output': output}
+
+def periodic_targets(data, start=None, end=None, every=24, at=0):
+    """
+    [start, end] 内每 every 小时、对齐到 UTC at 点的目标起始时间（默认最近一年每天 0 点）
+    start / end: 'YYYY-MM-DD HH:MM' 字符串，None 为数据末尾往前一年 / 数据末尾
+    """
+    times = np.asarray(data.time) if hasattr(data, 'time') else np.array([c['time'] for c in data])
+    last = int(times[-1])
+    end_ts = last if end is None else int(datetime.strptime(end, '%Y-%m-%d %H:%M').timestamp())
+    start_ts = end_ts - 365 * 86400 if start is None else int(datetime.strptime(start, '%Y-%m-%d %H:%M').timestamp())
+    step = every * 3600
+    selected = times[(times >= start_ts) & (times <= end_ts) & ((times - at * 3600) % step == 0)]
+    return selected.tolist()
+
 def main():
     parser = argparse.ArgumentParser(description='Bitcoin Pattern Finder')
     parser.add_argument('--start', type=str, help='起始时间 (YYYY-MM-DD HH:MM)')
     parser.add_argument('--length', type=int, default=24, help='对比模式长度 (小时)')
+    parser.add_argument('--metric', default='dtw', choices=('dtw',) + METRICS + multivariate.MULTIVARIATE_METRICS,
+                        help='距离度量：dtw、基于 FFT 的欧氏距离或多通道 DTW（多通道 DTW 不支持 many 批量搜索）')
+    parser.add_argument('--channels', default=None,
+                        help=f"多通道 DTW 的通道与权重，默认 '{multivariate.DEFAULT_CHANNELS}'，"
+                             f"可选 {'/'.join(multivariate.CHANNELS)}")
+    parser.add_argument('--engine', default='auto', choices=ENGINES,
+                        help='DTW 引擎：pruned / batch 为精确搜索（auto 按模式长度选较快的一个），paa 为近似检索 + 精确重排')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='多进程分片搜索的工作进程数（0 为 CPU 核数），结果与单进程相同')
+    sub = parser.add_subparsers(dest='command')
+    many = sub.add_parser('many', help='批量搜索多个目标，结果逐行写入 JSON Lines（仅 dtw 与欧氏距离）')
+    many.add_argument('--from', dest='range_start', help='第一个目标不早于 (YYYY-MM-DD HH:MM)，默认末尾往前一年')
+    many.add_argument('--to', dest='range_end', help='最后一个目标不晚于 (YYYY-MM-DD HH:MM)，默认数据末尾')
+    many.add_argument('--every', type=int, default=24, help='目标间隔 (小时)')
+    many.add_argument('--at', type=int, default=0, help='目标对齐到 UTC 的几点')
+    many.add_argument('--top-n', type=int, default=200, help='每个目标的结果数')
+    many.add_argument('--output', default='batch_results.jsonl', help='输出文件')
+    # 与顶层同名的参数放在子命令后也可以生效
+    many.add_argument('--length', type=int, default=argparse.SUPPRESS)
+    many.add_argument('--metric', choices=('dtw',) + METRICS, default=argparse.SUPPRESS)
+    many.add_argument('--engine', choices=ENGINES, default=argparse.SUPPRESS)
     args = parser.parse_args()
+    if args.workers != 1:
+        parallel_search.configure(args.workers or None)
     
-    do_search(args.start, args.length)
+    if args.command == 'many':
+        # 顶层 --metric 可以是多通道度量，但批量搜索只支持单通道度量
+        if args.metric in multivariate.MULTIVARIATE_METRICS:
+            parser.error(f"many 批量搜索不支持多通道度量 {args.metric}，可选: {', '.join(('dtw',) + METRICS)}")
+        data = load_data()
+        targets = periodic_targets(data, args.range_start, args.range_end, args.every, args.at)
+        search_many(targets, args.length, args.top_n, args.engine, args.metric, args.output, data)
+        return
+    do_search(args.start, args.length, engine=args.engine, metric=args.metric, channels=args.channels)
 
 if __name__ == "__main__":
     main()
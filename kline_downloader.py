@@ -0,0 +1,243 @@
+"""
+并发 K 线下载器
+把时间范围切成互不重叠的 startTime/endTime 分片，在连接池会话上并发拉取，
+带客户端权重限流与重试退避，按顺序写入本地列式存储
+"""
+import time
+import random
+import argparse
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+
+import ohlc_store
+import candle_pyramid
+import dataset_catalog
+import pattern_index
+import outcome_tables
+from fetch_binance_ohlc import BASE_URL, KLINES_PATH, klines_to_columns
+
+PAGE_SIZE = 1000
+# Binance /api/v3/klines 单次请求权重与每分钟权重预算
+REQUEST_WEIGHT = 2
+WEIGHT_PER_MINUTE = 6000
+RETRY_STATUS = {418, 429, 500, 502, 503, 504}
+
+
+class RateLimiter:
+    """
+    令牌桶限流（单位：请求权重）
+
+    桶容量为每分钟预算，按预算/60 每秒匀速回填；
+    服务端返回的已用权重接近预算时，暂停到下一分钟
+    """
+
+    def __init__(self, weight_per_minute=WEIGHT_PER_MINUTE):
+        self.capacity = float(weight_per_minute)
+        self.rate = weight_per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self, weight=REQUEST_WEIGHT):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if now >= self.paused_until and self.tokens >= weight:
+                    self.tokens -= weight
+                    return
+                wait = max(self.paused_until - now, (weight - self.tokens) / self.rate)
+            time.sleep(wait)
+
+    def observe(self, used_weight):
+        """根据 X-MBX-USED-WEIGHT-1M 调整：超过预算 90% 时等待到下一分钟"""
+        if used_weight >= 0.9 * self.capacity:
+            with self.lock:
+                self.paused_until = max(self.paused_until, time.monotonic() + 60 - time.time() % 60)
+
+    def pause(self, seconds):
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+def make_session(pool_size=16):
+    """带连接池的会话，所有分片复用 keep-alive 连接"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def plan_shards(start_ms, end_ms, interval_ms, page_size=PAGE_SIZE):
+    """把 [start_ms, end_ms] 切成每片恰好一页（page_size 根）的区间"""
+    span = page_size * interval_ms
+    return [(s, min(s + span - 1, end_ms)) for s in range(start_ms, end_ms + 1, span)]
+
+
+def fetch_shard(session, limiter, symbol, interval, start_ms, end_ms,
+                base_url=BASE_URL, retries=5, backoff=0.5):
+    """拉取一个分片，网络错误 / 429 / 5xx 时指数退避重试"""
+    params = {"symbol": symbol, "interval": interval,
+              "startTime": start_ms, "endTime": end_ms, "limit": PAGE_SIZE}
+    for attempt in range(retries + 1):
+        limiter.acquire()
+        try:
+            response = session.get(base_url + KLINES_PATH, params=params, timeout=10)
+        except requests.RequestException:
+            if attempt == retries:
+                raise
+        else:
+            used = response.headers.get('X-MBX-USED-WEIGHT-1M')
+            if used is not None:
+                limiter.observe(int(used))
+            if response.status_code not in RETRY_STATUS:
+                response.raise_for_status()
+                return response.json()
+            if attempt == retries:
+                response.raise_for_status()
+            retry_after = response.headers.get('Retry-After')
+            if retry_after is not None:
+                limiter.pause(float(retry_after))
+        time.sleep(backoff * (2 ** attempt) * (1 + random.random()))
+
+
+def iter_klines(symbol, interval, start_ms, end_ms, base_url=BASE_URL, max_workers=8,
+                weight_per_minute=WEIGHT_PER_MINUTE, session=None):
+    """
+    并发下载，按分片顺序逐片 yield K 线原始数组
+
+    同时在途的分片数不超过 2 * max_workers，内存占用与总范围无关
+    """
+    interval_ms = ohlc_store.interval_seconds(interval) * 1000
+    shards = plan_shards(start_ms, end_ms, interval_ms)
+    limiter = RateLimiter(weight_per_minute)
+    session = session or make_session(max_workers)
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        pending = []
+        for shard_start, shard_end in shards:
+            pending.append(pool.submit(fetch_shard, session, limiter, symbol, interval,
+                                       shard_start, shard_end, base_url))
+            if len(pending) >= 2 * max_workers:
+                yield pending.pop(0).result()
+        for future in pending:
+            yield future.result()
+
+
+def download_to_store(store_path, symbol, interval, start_ms, end_ms=None, base_url=BASE_URL,
+                      max_workers=8, weight_per_minute=WEIGHT_PER_MINUTE, now_ms=None):
+    """
+    下载 [start_ms, end_ms] 的已收盘 K 线并写入存储
+
+    范围在已有数据之后时按顺序流式追加；与已有数据重叠时下载完再整体合并
+    返回: 写入的 K 线数量
+    """
+    now_ms = int(time.time() * 1000) if now_ms is None else now_ms
+    end_ms = now_ms if end_ms is None else min(end_ms, now_ms)
+    # 空存储（没有任何一行）与不存在相同：第一页整体写入，之后流式追加
+    series = ohlc_store.open_store(store_path) if ohlc_store.store_exists(store_path) else None
+    exists = series is not None and len(series) > 0
+    streaming = not exists or int(series.time[-1]) * 1000 < start_ms
+
+    total = 0
+    buffered = []
+    for page in iter_klines(symbol, interval, start_ms, end_ms, base_url, max_workers, weight_per_minute):
+        rows = [r for r in page if r[6] < now_ms]
+        if not rows:
+            continue
+        total += len(rows)
+        if not streaming:
+            buffered.extend(rows)
+        elif not exists:
+            ohlc_store.write_store(store_path, klines_to_columns(rows), symbol, interval)
+            exists = True
+        else:
+            ohlc_store.append_rows(store_path, klines_to_columns(rows))
+    if buffered:
+        ohlc_store.merge_rows(store_path, klines_to_columns(buffered))
+    if exists:
+        candle_pyramid.update_pyramid(store_path)
+        pattern_index.update_all(store_path)
+        outcome_tables.update_table(store_path)
+    print(f"💾 已下载 {total} 条 {symbol} {interval} K 线到 {store_path}")
+    return total
+
+
+def benchmark(count=100_000, latency=0.05, workers=(1, 4, 8, 16), interval='1m'):
+    """在本地替身服务器上比较不同并发度的下载吞吐（含逐页顺序下载基线）"""
+    import shutil
+    import tempfile
+    from mock_binance import random_walk_klines, start_mock_server
+    from fetch_binance_ohlc import fetch_klines_range
+
+    interval_ms = ohlc_store.interval_seconds(interval) * 1000
+    klines = random_walk_klines(count, interval_ms=interval_ms)
+    start_ms, end_ms = klines[0][0], klines[-1][0]
+    server, base_url, _ = start_mock_server(klines, latency=latency)
+    results = {}
+    try:
+        t0 = time.perf_counter()
+        rows, _ = fetch_klines_range('BTCUSDT', interval, start_ms, end_ms, base_url)
+        elapsed = time.perf_counter() - t0
+        results['sequential'] = len(rows) / elapsed
+        print(f"⏱️ 顺序翻页 (requests.get): {elapsed:.2f}s | {results['sequential']:.0f} 条/秒")
+
+        for n in workers:
+            tmp = tempfile.mkdtemp()
+            try:
+                t0 = time.perf_counter()
+                total = download_to_store(f'{tmp}/store', 'BTCUSDT', interval, start_ms, end_ms,
+                                          base_url, max_workers=n, weight_per_minute=10**9,
+                                          now_ms=end_ms + interval_ms)
+                elapsed = time.perf_counter() - t0
+            finally:
+                shutil.rmtree(tmp, ignore_errors=True)
+            results[n] = total / elapsed
+            print(f"⏱️ 并发 {n:>2}: {elapsed:.2f}s | {results[n]:.0f} 条/秒")
+    finally:
+        server.shutdown()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='并发 K 线下载器')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    fetch = sub.add_parser('fetch', help='下载一段历史到本地存储')
+    fetch.add_argument('--symbol', default=ohlc_store.DEFAULT_SYMBOL)
+    fetch.add_argument('--interval', default=ohlc_store.DEFAULT_INTERVAL)
+    fetch.add_argument('--days', type=float, default=1095, help='回溯天数')
+    fetch.add_argument('--store', default=None, help='存储目录（默认 ohlc_store/<SYMBOL>_<interval>）')
+    fetch.add_argument('--workers', type=int, default=8, help='并发请求数')
+    fetch.add_argument('--weight', type=int, default=WEIGHT_PER_MINUTE, help='每分钟权重预算')
+    fetch.add_argument('--base-url', default=BASE_URL)
+
+    bench = sub.add_parser('bench', help='在本地替身服务器上压测吞吐')
+    bench.add_argument('--count', type=int, default=100_000)
+    bench.add_argument('--latency', type=float, default=0.05, help='模拟的单请求延迟 (秒)')
+
+    args = parser.parse_args()
+    if args.command == 'bench':
+        benchmark(args.count, args.latency)
+        return
+
+    symbol = args.symbol.upper()
+    store = args.store
+    if store is None:
+        store = ohlc_store.store_path(symbol, args.interval)
+        if (symbol, args.interval) != (ohlc_store.DEFAULT_SYMBOL, ohlc_store.DEFAULT_INTERVAL):
+            # 与 fetch_binance_ohlc 相同：其他数据集登记到目录中，之后由 dataset_catalog sync 一起同步
+            dataset_catalog.register(symbol, args.interval)
+    end_ms = int(time.time() * 1000)
+    start_ms = end_ms - int(args.days * 86400 * 1000)
+    step_ms = ohlc_store.interval_seconds(args.interval) * 1000
+    download_to_store(store, symbol, args.interval, start_ms - start_ms % step_ms, end_ms,
+                      args.base_url, args.workers, args.weight)
+
+
+if __name__ == "__main__":
+    main()
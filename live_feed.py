@@ -0,0 +1,401 @@
+"""
+实时 K 线推送
+数据源（可替换）-> LiveFeed -> 存储 / StreamHub -> 各个图表页面（SSE）
+
+- 数据源只需实现 poll(since_ms) -> (K 线原始数组列表, 是否已收盘列表)：
+  BinanceSource 轮询 REST 接口（也可以指向 mock_binance 本地替身），ReplaySource 在本地回放给定的 K 线
+- 已收盘的 K 线追加进列式存储并同步聚合金字塔与相似走势索引（与 sync_klines 一致，存储里只有收盘 K 线）；
+  未收盘的 K 线只推送给页面，不写入存储
+- StreamHub 用一个线程 + selectors 管理所有 SSE 连接：HTTP 处理线程回完响应头后把套接字交给它就返回，
+  空闲连接不占线程；每条事件只包含新增或变化的 K 线，新连接按 since 补发之后的部分
+"""
+import json
+import time
+import socket
+import threading
+import selectors
+import collections
+import numpy as np
+import requests
+
+import ohlc_store
+import candle_pyramid
+import pattern_index
+import outcome_tables
+from fetch_binance_ohlc import BASE_URL, fetch_klines_range, klines_to_columns
+
+# 轮询间隔（秒）
+POLL_SECONDS = 5
+# SSE 心跳间隔（秒），保持空闲连接并及时发现断开的客户端
+HEARTBEAT_SECONDS = 15
+# 单个客户端积压的未发送字节上限，超过视为慢客户端并断开
+MAX_BUFFER = 1 << 20
+# 新连接补发的最多 K 线根数（更早的由页面通过 /api/ohlc 获取）
+CATCH_UP_LIMIT = 1000
+# 不写存储时（回放演示）内存中保留的收盘 K 线根数
+MEMORY_BARS = 5000
+
+
+class BinanceSource:
+    """轮询 Binance /api/v3/klines：从存储的最后一根起取到最新一根（通常 1 次请求、2 根）"""
+
+    def __init__(self, symbol='BTCUSDT', interval='1h', base_url=BASE_URL):
+        self.symbol = symbol
+        self.interval = interval
+        self.base_url = base_url
+        self.session = requests.Session()
+
+    def poll(self, since_ms):
+        rows, _ = fetch_klines_range(self.symbol, self.interval, since_ms, None, self.base_url, self.session)
+        now_ms = int(time.time() * 1000)
+        return rows, [row[6] < now_ms for row in rows]
+
+
+class ReplaySource:
+    """
+    本地回放：按顺序吐出给定的 K 线（Binance 原始数组格式），
+    每根先给出 ticks - 1 个逐步成形的未收盘状态，最后给出收盘值；每次 poll 推进一步
+    """
+
+    def __init__(self, klines, ticks=4):
+        self.klines = list(klines)
+        self.ticks = max(1, ticks)
+        self.position = 0
+        self.tick = 0
+
+    @property
+    def exhausted(self):
+        return self.position >= len(self.klines)
+
+    def poll(self, since_ms=None):
+        if self.exhausted:
+            return [], []
+        row = self.klines[self.position]
+        self.tick += 1
+        if self.tick < self.ticks:
+            return [self._partial(row, self.tick / self.ticks)], [False]
+        self.position += 1
+        self.tick = 0
+        return [list(row)], [True]
+
+    @staticmethod
+    def _partial(row, fraction):
+        o, h, l, c = (float(v) for v in row[1:5])
+        close = o + (c - o) * fraction
+        high = max(o, close) + (h - max(o, c)) * fraction
+        low = min(o, close) - (min(o, c) - l) * fraction
+        return [row[0], f'{o:.2f}', f'{high:.2f}', f'{low:.2f}', f'{close:.2f}', f'{float(row[5]) * fraction:.5f}',
+                *row[6:]]
+
+
+def sse_event(name, payload, event_id=None):
+    """一条 SSE 事件（payload 序列化为 JSON）"""
+    head = f"id: {event_id}\n" if event_id is not None else ''
+    return f"{head}event: {name}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n".encode()
+
+
+def candles_event(columns, closed, interval, reset=False):
+    """
+    一条 SSE 事件：列式 K 线（与 /api/ohlc 相同的 t/o/h/l/c 字段）与各根是否已收盘；
+    id 为最后一根的时间，浏览器重连时经 Last-Event-ID 带回，用于补发
+    reset: 补发内容与客户端已有的 K 线之间有缺口（断线太久，只补发了最新的一段），客户端应以此替换末尾
+    """
+    payload = {'interval': interval, 'closed': [bool(x) for x in closed]}
+    if reset:
+        payload['reset'] = True
+    for key, name in (('t', 'time'), ('o', 'open'), ('h', 'high'), ('l', 'low'), ('c', 'close')):
+        payload[key] = np.asarray(columns[name]).tolist()
+    return sse_event('candles', payload, payload['t'][-1] if payload['t'] else 0)
+
+
+class _Client:
+    __slots__ = ('sock', 'buffer')
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.buffer = bytearray()
+
+
+class StreamHub:
+    """
+    SSE 扇出：一个线程用 selectors（Linux 上为 epoll）管理全部连接
+
+    attach / publish 可在任意线程调用，操作按调用顺序排队由 hub 线程执行，
+    因此新连接的补发快照与之后的广播不会乱序或遗漏
+    """
+
+    def __init__(self, heartbeat=HEARTBEAT_SECONDS, max_buffer=MAX_BUFFER):
+        self.heartbeat = heartbeat
+        self.max_buffer = max_buffer
+        self.selector = selectors.DefaultSelector()
+        self.clients = {}
+        self.queue = collections.deque()
+        self.lock = threading.Lock()
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._wake_w.setblocking(False)
+        self.selector.register(self._wake_r, selectors.EVENT_READ, None)
+        self.stats = {'attached': 0, 'dropped': 0, 'events': 0}
+        self._stop = threading.Event()
+        self.thread = threading.Thread(target=self._loop, name='sse-hub', daemon=True)
+        self.thread.start()
+
+    def __len__(self):
+        return len(self.clients)
+
+    def attach(self, sock, snapshot=None):
+        """
+        接管一个已发送 SSE 响应头的套接字（调用方不再使用它）
+        snapshot: 可选，在 hub 线程中调用、返回首次补发内容（字节串）的函数
+        """
+        self._enqueue(('attach', sock, snapshot))
+
+    def publish(self, data):
+        """向所有连接广播一条事件（字节串）"""
+        self._enqueue(('publish', data))
+
+    def close(self):
+        self._stop.set()
+        self._wake()
+        self.thread.join(timeout=5)
+
+    def _enqueue(self, item):
+        with self.lock:
+            self.queue.append(item)
+        self._wake()
+
+    def _wake(self):
+        try:
+            self._wake_w.send(b'\0')
+        except (BlockingIOError, OSError):
+            pass  # 唤醒字节已经积压，hub 线程一定会醒来
+
+    def _loop(self):
+        next_beat = time.monotonic() + self.heartbeat
+        while not self._stop.is_set():
+            timeout = max(0.0, next_beat - time.monotonic())
+            for key, mask in self.selector.select(timeout):
+                if key.data is None:
+                    self._drain_wake()
+                    continue
+                client = key.data
+                if mask & selectors.EVENT_READ:
+                    self._read(client)
+                if mask & selectors.EVENT_WRITE and client.sock.fileno() in self.clients:
+                    self._flush(client)
+            self._process_queue()
+            if time.monotonic() >= next_beat:
+                self._broadcast(b': ping\n\n')
+                next_beat = time.monotonic() + self.heartbeat
+        for client in list(self.clients.values()):
+            self._drop(client, count=False)
+        self.selector.close()
+        self._wake_r.close()
+        self._wake_w.close()
+
+    def _drain_wake(self):
+        try:
+            while self._wake_r.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def _process_queue(self):
+        while True:
+            with self.lock:
+                if not self.queue:
+                    return
+                item = self.queue.popleft()
+            if item[0] == 'attach':
+                _, sock, snapshot = item
+                sock.setblocking(False)
+                client = _Client(sock)
+                self.clients[sock.fileno()] = client
+                self.selector.register(sock, selectors.EVENT_READ, client)
+                self.stats['attached'] += 1
+                if snapshot is not None:
+                    self._send(client, snapshot())
+            else:
+                self.stats['events'] += 1
+                self._broadcast(item[1])
+
+    def _broadcast(self, data):
+        for client in list(self.clients.values()):
+            self._send(client, data)
+
+    def _send(self, client, data):
+        if not data:
+            return
+        client.buffer += data
+        if len(client.buffer) > self.max_buffer:
+            self._drop(client)
+            return
+        self._flush(client)
+
+    def _flush(self, client):
+        try:
+            sent = client.sock.send(client.buffer)
+            del client.buffer[:sent]
+        except BlockingIOError:
+            pass
+        except OSError:
+            self._drop(client)
+            return
+        events = selectors.EVENT_READ | (selectors.EVENT_WRITE if client.buffer else 0)
+        self.selector.modify(client.sock, events, client)
+
+    def _read(self, client):
+        # SSE 客户端不会再发数据；读到 EOF 或错误说明连接已关闭
+        try:
+            if client.sock.recv(4096):
+                return
+        except BlockingIOError:
+            return
+        except OSError:
+            pass
+        self._drop(client)
+
+    def _drop(self, client, count=True):
+        fd = client.sock.fileno()
+        if self.clients.pop(fd, None) is None:
+            return
+        try:
+            self.selector.unregister(client.sock)
+        except (KeyError, ValueError):
+            pass
+        client.sock.close()
+        if count:
+            self.stats['dropped'] += 1
+
+
+class LiveFeed:
+    """
+    后台线程定期从数据源取 K 线：收盘的写入存储并同步金字塔 / 索引，变化的推送给 StreamHub
+
+    persist: False 时不写存储，收盘 K 线只保存在内存中（回放演示用，不污染真实数据）
+    listeners: 每批新收盘 K 线（列式）写入后依次调用的函数，如常驻查询引擎的 on_bars
+    """
+
+    def __init__(self, source, hub, store_path=ohlc_store.DEFAULT_STORE, poll_seconds=POLL_SECONDS, persist=True,
+                 listeners=()):
+        self.source = source
+        self.listeners = list(listeners)
+        self.hub = hub
+        self.store_path = store_path
+        self.poll_seconds = poll_seconds
+        self.persist = persist
+        series = ohlc_store.open_store(store_path)
+        self.interval = series.meta['interval']
+        self.last_closed = int(series.time[-1]) if len(series) else None
+        self.memory = collections.deque(maxlen=MEMORY_BARS)
+        self.forming = None
+        self.lock = threading.Lock()
+        self.stats = {'polls': 0, 'closed': 0, 'updates': 0, 'errors': 0}
+        self._stop = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name='live-feed', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self.thread is not None:
+            self.thread.join(timeout=10)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.step()
+            except Exception as e:
+                self.stats['errors'] += 1
+                print(f"⚠️ 实时数据更新失败: {e}")
+            self._stop.wait(self.poll_seconds)
+
+    def step(self):
+        """取一次数据并处理；返回推送的 K 线根数"""
+        since_ms = (self.last_closed or 0) * 1000
+        rows, closed = self.source.poll(since_ms)
+        self.stats['polls'] += 1
+        if not rows:
+            return 0
+        columns = klines_to_columns(rows)
+        closed = np.asarray(closed, dtype=bool)
+        times = columns['time']
+        # 只处理最后一根收盘 K 线及之后的部分（重叠的旧 K 线不重复推送）
+        fresh = times > self.last_closed if self.last_closed is not None else np.ones(len(times), dtype=bool)
+        changed = np.zeros(len(times), dtype=bool)
+        done = fresh & closed
+        if done.any():
+            rows_closed = {name: values[done] for name, values in columns.items()}
+            if self.persist:
+                ohlc_store.append_rows(self.store_path, rows_closed)
+                # 与增量同步相同：聚合只重算末尾，索引只标记受新 K 线影响的条目
+                candle_pyramid.update_pyramid(self.store_path)
+                pattern_index.update_all(self.store_path)
+                outcome_tables.update_table(self.store_path)
+            with self.lock:
+                for i in np.flatnonzero(done):
+                    self.memory.append(tuple(columns[name][i] for name in ohlc_store.COLUMNS))
+                self.last_closed = int(times[done][-1])
+                if self.forming is not None and self.forming[0] <= self.last_closed:
+                    self.forming = None
+            self.stats['closed'] += int(done.sum())
+            changed |= done
+            for listener in self.listeners:
+                listener(rows_closed)
+        open_rows = np.flatnonzero(fresh & ~closed)
+        if len(open_rows):
+            i = open_rows[-1]
+            bar = tuple(columns[name][i] for name in ohlc_store.COLUMNS)
+            with self.lock:
+                if bar != self.forming:
+                    self.forming = bar
+                    changed[i] = True
+        if not changed.any():
+            return 0
+        self.stats['updates'] += 1
+        self.hub.publish(candles_event({name: values[changed] for name, values in columns.items()},
+                                       closed[changed], self.interval))
+        return int(changed.sum())
+
+    def snapshot(self, since=None):
+        """
+        新连接的补发内容：时间 ≥ since 的收盘 K 线加上正在形成的一根；since 为空时只发正在形成的一根
+        超过 CATCH_UP_LIMIT 根时只补发最新的 CATCH_UP_LIMIT 根，并标记 reset（与客户端已有的数据之间有缺口）
+        """
+        with self.lock:
+            forming = self.forming
+            memory = list(self.memory)
+        bars, closed = [], []
+        reset = False
+        if since is not None:
+            if self.persist:
+                series = ohlc_store.open_store(self.store_path)
+                lo, hi = series.locate(since)
+                reset = hi - lo > CATCH_UP_LIMIT
+                bars = [tuple(series.columns[name][i] for name in ohlc_store.COLUMNS)
+                        for i in range(max(lo, hi - CATCH_UP_LIMIT), hi)]
+            else:
+                bars = [bar for bar in memory if bar[0] >= since]
+                reset = len(bars) > CATCH_UP_LIMIT
+                bars = bars[-CATCH_UP_LIMIT:]
+            closed = [True] * len(bars)
+        if forming is not None:
+            bars.append(forming)
+            closed.append(False)
+        if not bars:
+            return b''
+        columns = {name: np.array([bar[k] for bar in bars]) for k, name in enumerate(ohlc_store.COLUMNS)}
+        return candles_event(columns, closed, self.interval, reset)
+
+
+def replay_after(series, count=48, seed=0):
+    """接在存储最后一根之后的随机游走 K 线（回放演示用）"""
+    from mock_binance import random_walk_klines
+
+    step_ms = ohlc_store.interval_seconds(series.meta['interval']) * 1000
+    start_ms = (int(series.time[-1]) * 1000 + step_ms) if len(series) else 0
+    price = float(series.close[-1]) if len(series) else 20000.0
+    return random_walk_klines(count, step_ms, start_ms, seed, price)
@@ -0,0 +1,119 @@
+"""
+app_server 负载测试
+在搜索任务运行期间持续请求静态图表页面，统计 GET 延迟的 p50 / p99
+"""
+import json
+import time
+import argparse
+import threading
+import urllib.request
+import numpy as np
+
+import ohlc_store
+from app_server import SearchServer, SearchHandler
+
+
+class QuietHandler(SearchHandler):
+    """压测时不打印每条访问日志"""
+
+    def log_message(self, *args):
+        pass
+
+
+def _get(url):
+    t0 = time.perf_counter()
+    with urllib.request.urlopen(url) as response:
+        response.read()
+    return time.perf_counter() - t0
+
+
+def _post_json(url, payload):
+    request = urllib.request.Request(url, data=json.dumps(payload).encode(), method='POST')
+    with urllib.request.urlopen(request) as response:
+        return json.loads(response.read())
+
+
+def _get_json(url):
+    with urllib.request.urlopen(url) as response:
+        return json.loads(response.read())
+
+
+def hammer(url, stop, latencies, interval=0.0):
+    """循环发送 GET 直到 stop 被置位"""
+    while not stop.is_set():
+        latencies.append(_get(url))
+        if interval:
+            time.sleep(interval)
+
+
+def measure(url, clients, duration=None, stop=None):
+    """用 clients 个并发客户端请求 url，返回延迟列表（秒）"""
+    stop = stop or threading.Event()
+    latencies = []
+    threads = [threading.Thread(target=hammer, args=(url, stop, latencies)) for _ in range(clients)]
+    for t in threads:
+        t.start()
+    if duration is not None:
+        time.sleep(duration)
+        stop.set()
+    for t in threads:
+        t.join()
+    return latencies
+
+
+def summarize(label, latencies):
+    ms = np.array(latencies) * 1000
+    p50, p99 = np.percentile(ms, [50, 99])
+    print(f"📊 {label}: {len(ms)} 次 GET | p50 {p50:.1f} ms | p99 {p99:.1f} ms | max {ms.max():.1f} ms")
+    return {'count': len(ms), 'p50_ms': float(p50), 'p99_ms': float(p99)}
+
+
+def run(searches=4, length=168, clients=8, baseline_seconds=3.0, path='/'):
+    server = SearchServer(('127.0.0.1', 0), QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f'http://127.0.0.1:{server.server_address[1]}'
+    try:
+        idle = summarize('空闲时静态 GET', measure(base + path, clients, duration=baseline_seconds))
+
+        # 提交若干搜索任务，POST 应立即返回
+        t0 = time.perf_counter()
+        start = int(ohlc_store.load_series().time[-1]) - 90 * 86400
+        jobs = [_post_json(base + '/api/search', {'startTime': start - i * 7 * 86400, 'length': length})
+                for i in range(searches)]
+        submit_ms = (time.perf_counter() - t0) * 1000 / searches
+        print(f"🚀 提交 {searches} 个搜索任务，平均 POST 耗时 {submit_ms:.1f} ms")
+
+        stop = threading.Event()
+        latencies = []
+        threads = [threading.Thread(target=hammer, args=(base + path, stop, latencies)) for _ in range(clients)]
+        for t in threads:
+            t.start()
+        while True:
+            states = [_get_json(f"{base}/api/jobs/{job['job_id']}") for job in jobs]
+            if all(s['status'] in ('done', 'error') for s in states):
+                break
+            time.sleep(0.5)
+        stop.set()
+        for t in threads:
+            t.join()
+        busy = summarize('搜索运行时静态 GET', latencies)
+        durations = [s['finished'] - s['started'] for s in states]
+        print(f"🧠 搜索任务耗时: {', '.join(f'{d:.1f}s' for d in durations)}")
+        return {'idle': idle, 'busy': busy, 'submit_ms': submit_ms, 'search_seconds': durations}
+    finally:
+        server.shutdown()
+        server.jobs.shutdown(wait=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='app_server 负载测试')
+    parser.add_argument('--searches', type=int, default=4, help='并发提交的搜索任务数')
+    parser.add_argument('--length', type=int, default=168, help='搜索的模式长度 (小时)')
+    parser.add_argument('--clients', type=int, default=8, help='并发 GET 客户端数')
+    parser.add_argument('--path', default='/', help='压测的静态路径')
+    args = parser.parse_args()
+    run(args.searches, args.length, args.clients, path=args.path)
+
+
+if __name__ == "__main__":
+    main()
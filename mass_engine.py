@@ -0,0 +1,189 @@
+"""
+基于 FFT 的欧氏距离剖面（MASS）
+不需要时间弯曲时，用一次 FFT 互相关求出目标与所有窗口的点积，
+再配合滚动均值 / 方差 / 极值，O(N log N) 得到每个窗口的距离：
+- znorm_euclidean: z-score 归一化后的欧氏距离
+- minmax_euclidean: 与 normalize() 相同的 min-max 归一化后的欧氏距离
+"""
+import time
+import argparse
+import numpy as np
+from scipy import fft
+
+from window_matrix import rolling_min_max, normalized_windows
+
+METRICS = ('znorm_euclidean', 'minmax_euclidean')
+# 滚动求和时的分块长度：每块先平移到块内均值再做前缀和，避免百万根 K 线的前缀和吞掉小波动
+MOMENT_BLOCK = 1024
+# FFT 互相关的分块长度
+FFT_BLOCK = 1 << 16
+
+
+def rolling_moments(series, length, block=MOMENT_BLOCK):
+    """
+    每个窗口的均值与离差平方和 sum((x - mean)^2)
+
+    返回: (mean, m2)，长度均为 N-L+1
+    """
+    series = np.asarray(series, dtype=float)
+    count = series.shape[0] - length + 1
+    mean = np.empty(max(count, 0))
+    m2 = np.empty(max(count, 0))
+    for start in range(0, count, block):
+        stop = min(count, start + block)
+        segment = series[start:stop + length - 1]
+        center = segment.mean()
+        shifted = segment - center
+        s1 = np.concatenate([[0.0], np.cumsum(shifted)])
+        s2 = np.concatenate([[0.0], np.cumsum(shifted * shifted)])
+        sum1 = s1[length:] - s1[:-length]
+        sum2 = s2[length:] - s2[:-length]
+        mean[start:stop] = center + sum1 / length
+        m2[start:stop] = sum2 - sum1 * sum1 / length
+    return mean, np.maximum(m2, 0.0)
+
+
+def fft_size(count, length, block=FFT_BLOCK):
+    """DistanceProfiler 对 count 个窗口使用的 FFT 长度"""
+    return fft.next_fast_len(min(block, count) + length - 1, real=True)
+
+
+class DistanceProfiler:
+    """
+    对同一序列反复求距离剖面：与目标无关的部分（各块 FFT、滚动均值 / 方差 / 极值）只算一次，
+    之后每个目标只需一次频域乘法与逆变换
+    """
+
+    def __init__(self, series, length, metric='znorm_euclidean', block=FFT_BLOCK, size=None):
+        """size: 可选，固定 FFT 长度（分块搜索时与整段计算取相同长度，结果逐位一致）"""
+        if metric not in METRICS:
+            raise ValueError(f"未知的距离度量: {metric}")
+        self.series = np.asarray(series, dtype=float)
+        self.length = length
+        self.metric = metric
+        self.count = self.series.shape[0] - length + 1
+        self.block = block
+        self.size = size or fft_size(self.count, length, block)
+        self.centers = []
+        self.blocks = []
+        for start in range(0, self.count, block):
+            stop = min(self.count, start + block)
+            segment = self.series[start:stop + length - 1]
+            center = segment.mean()
+            self.centers.append(center)
+            self.blocks.append(fft.rfft(segment - center, self.size))
+        self.mean, self.m2 = rolling_moments(self.series, length)
+        if metric == 'minmax_euclidean':
+            self.low, high = rolling_min_max(self.series, length)
+            self.span = high - self.low
+            self.flat = self.span == 0
+            self.scale = np.where(self.flat, 1.0, self.span)
+            self.offset = self.mean - self.low
+            self.square = (self.m2 + length * self.offset * self.offset) / (self.scale * self.scale)
+        else:
+            self.flat = self.m2 <= 1e-12 * np.maximum(self.mean * self.mean, 1.0) * length
+
+    def dot(self, query):
+        """
+        query 与每个窗口的点积；query 为 (L,) 或一组查询 (Q, L)，返回 (N-L+1,) 或 (Q, N-L+1)
+
+        按块做 FFT（重叠 L-1），每块先减去块内均值 c 再用 Σq(w - c) + c Σq 还原：
+        价格的绝对水平不再放大 FFT 的舍入误差
+        """
+        query = np.asarray(query, dtype=float)
+        q_fft = fft.rfft(query[..., ::-1], self.size, axis=-1)
+        q_sum = query.sum(axis=-1, keepdims=True)
+        m = self.length
+        out = np.empty(query.shape[:-1] + (self.count,))
+        for start, center, block in zip(range(0, self.count, self.block), self.centers, self.blocks):
+            stop = min(self.count, start + self.block)
+            product = fft.irfft(block * q_fft, self.size, axis=-1)
+            out[..., start:stop] = product[..., m - 1:m - 1 + stop - start] + center * q_sum
+        return out
+
+    def profile(self, query):
+        """目标与所有窗口的距离；query 为 (L,) 或一组查询 (Q, L)，返回 (N-L+1,) 或 (Q, N-L+1)"""
+        query = np.asarray(query, dtype=float)
+        if self.metric == 'znorm_euclidean':
+            return self._znorm(query)
+        return self._minmax(query)
+
+    def _znorm(self, query):
+        """
+        z-score 归一化欧氏距离：d^2 = 2L (1 - corr)
+        常数窗口（标准差为 0）与非常数目标的距离取 sqrt(L)，两者都为常数时为 0
+        """
+        length = self.length
+        q_std = query.std(axis=-1, keepdims=True)
+        flat_query = q_std == 0
+        q_hat = (query - query.mean(axis=-1, keepdims=True)) / np.where(flat_query, 1.0, q_std)
+        # q_hat 均值为 0，与窗口的点积不受窗口均值影响
+        corr = self.dot(q_hat) / np.sqrt(np.where(self.flat, 1.0, self.m2) * length)
+        dist = np.sqrt(np.maximum(2.0 * length * (1.0 - corr), 0.0))
+        dist = np.where(self.flat, np.sqrt(length), dist)
+        return np.where(flat_query, np.where(self.flat, 0.0, np.sqrt(length)), dist)
+
+    def _minmax(self, query):
+        """
+        min-max 归一化欧氏距离，窗口与目标都按 normalize() 的规则缩放到 0-1（区间为 0 时置 0）
+
+        w' = (w - lo) / r，展开 ||q' - w'||^2 = Σq'^2 - 2 Σq'(w - lo) / r + Σ(w - lo)^2 / r^2
+        """
+        length = self.length
+        q_min = query.min(axis=-1, keepdims=True)
+        q_span = query.max(axis=-1, keepdims=True) - q_min
+        q_norm = np.where(q_span > 0, (query - q_min) / np.where(q_span > 0, q_span, 1.0), 0.0)
+        q_sum = q_norm.sum(axis=-1, keepdims=True)
+        q_sq = (q_norm * q_norm).sum(axis=-1, keepdims=True)
+        # Σq'w 拆成 Σ(q' - mean(q'))w + Σq' * mean(w)，FFT 只处理零均值的部分
+        dot = self.dot(q_norm - q_sum / length) + q_sum * self.mean
+        cross = (dot - self.low * q_sum) / self.scale
+        dist = np.sqrt(np.maximum(q_sq - 2.0 * cross + self.square, 0.0))
+        return np.where(self.flat, np.sqrt(q_sq), dist)
+
+
+def distance_profile(query, series, metric='znorm_euclidean'):
+    """目标与 series 中所有窗口的距离，(N-L+1,)"""
+    return DistanceProfiler(series, len(query), metric).profile(query)
+
+
+def _reference(query, series, metric):
+    """逐窗口直接计算的参考实现（用于校验）"""
+    windows = np.lib.stride_tricks.sliding_window_view(np.asarray(series, dtype=float), len(query))
+    if metric == 'minmax_euclidean':
+        target = normalized_windows(query, len(query))[0]
+        return np.sqrt(((normalized_windows(series, len(query)) - target) ** 2).sum(axis=1))
+    std = windows.std(axis=1)
+    z = (windows - windows.mean(axis=1, keepdims=True)) / np.where(std == 0, 1.0, std)[:, None]
+    q = (query - query.mean()) / query.std()
+    return np.sqrt(((z - q) ** 2).sum(axis=1))
+
+
+def benchmark(bars=1_000_000, length=168, seed=0):
+    """随机游走价格上的单次查询耗时，并与逐窗口计算比对误差"""
+    rng = np.random.default_rng(seed)
+    series = 30000.0 * np.exp(np.cumsum(rng.normal(0, 0.005, bars)))
+    query = series[bars // 2:bars // 2 + length]
+    results = {}
+    for metric in METRICS:
+        distance_profile(query, series[:10000], metric)
+        t0 = time.perf_counter()
+        profile = distance_profile(query, series, metric)
+        elapsed = time.perf_counter() - t0
+        sample = slice(0, 50000)
+        error = np.abs(profile[sample] - _reference(query, series[:50000 + length - 1], metric)).max()
+        print(f"⏱️ {metric}: {bars} 根 K 线, 长度 {length}: {elapsed * 1000:.0f} ms | 最大误差 {error:.2e}")
+        results[metric] = {'seconds': elapsed, 'max_error': float(error)}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='MASS 欧氏距离剖面基准测试')
+    parser.add_argument('--bars', type=int, default=1_000_000)
+    parser.add_argument('--length', type=int, default=168)
+    args = parser.parse_args()
+    benchmark(args.bars, args.length)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""
+本地 Binance K 线接口替身
+模拟 /api/v3/klines 的翻页语义，供增量同步与并发下载在离线环境下验证和压测
+"""
+import json
+import time
+import threading
+import argparse
+import http.server
+import urllib.parse
+import numpy as np
+
+DEFAULT_LIMIT = 500
+MAX_LIMIT = 1000
+# /api/v3/klines 的单次请求权重
+KLINES_WEIGHT = 2
+
+
+def random_walk_klines(count, interval_ms=3_600_000, start_ms=1_600_000_000_000, seed=0, price=20000.0):
+    """生成随机游走的 K 线（Binance 原始数组格式）"""
+    rng = np.random.default_rng(seed)
+    closes = price * np.exp(np.cumsum(rng.normal(0, 0.005, count)))
+    opens = np.concatenate([[price], closes[:-1]])
+    spread = np.abs(rng.normal(0, 0.003, count)) * closes
+    highs = np.maximum(opens, closes) + spread
+    lows = np.minimum(opens, closes) - spread
+    volumes = rng.gamma(2.0, 500.0, count)
+    rows = []
+    for i in range(count):
+        open_time = start_ms + i * interval_ms
+        rows.append([
+            open_time, f'{opens[i]:.2f}', f'{highs[i]:.2f}', f'{lows[i]:.2f}', f'{closes[i]:.2f}',
+            f'{volumes[i]:.5f}', open_time + interval_ms - 1, '0', 0, '0', '0', '0',
+        ])
+    return rows
+
+
+class MockKlines:
+    """保存一组 K 线并按 Binance 规则切片"""
+
+    def __init__(self, klines):
+        self.klines = sorted(klines, key=lambda k: k[0])
+        self.open_times = np.array([k[0] for k in self.klines], dtype=np.int64)
+        self.requests = 0
+        self.used_weight = 0
+        self.minute = None
+        self.lock = threading.Lock()
+
+    def query(self, start_time=None, end_time=None, limit=DEFAULT_LIMIT):
+        """
+        - 给出 startTime：从 startTime 起向后取 limit 条
+        - 只给 endTime：取 endTime 之前最近的 limit 条
+        - 都不给：取最新的 limit 条
+        """
+        limit = max(1, min(int(limit), MAX_LIMIT))
+        lo = 0 if start_time is None else int(np.searchsorted(self.open_times, start_time, 'left'))
+        hi = len(self.klines) if end_time is None else int(np.searchsorted(self.open_times, end_time, 'right'))
+        if start_time is not None:
+            hi = min(hi, lo + limit)
+        else:
+            lo = max(lo, hi - limit)
+        with self.lock:
+            # 与 Binance 一样按自然分钟统计已用权重
+            minute = int(time.time() // 60)
+            if minute != self.minute:
+                self.minute, self.used_weight = minute, 0
+            self.requests += 1
+            self.used_weight += KLINES_WEIGHT
+        return self.klines[lo:hi]
+
+
+def make_handler(store, latency=0.0):
+    """构造绑定到某个 MockKlines 的请求处理器"""
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def _send_json(self, status, payload, headers=None):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            parsed = urllib.parse.urlparse(self.path)
+            params = dict(urllib.parse.parse_qsl(parsed.query))
+            if parsed.path == '/api/v3/time':
+                return self._send_json(200, {'serverTime': int(time.time() * 1000)})
+            if parsed.path != '/api/v3/klines':
+                return self._send_json(404, {'code': -1, 'msg': 'not found'})
+            if 'symbol' not in params or 'interval' not in params:
+                return self._send_json(400, {'code': -1102, 'msg': 'symbol and interval are required'})
+            if latency:
+                time.sleep(latency)
+            rows = store.query(
+                int(params['startTime']) if 'startTime' in params else None,
+                int(params['endTime']) if 'endTime' in params else None,
+                params.get('limit', DEFAULT_LIMIT),
+            )
+            self._send_json(200, rows, {'X-MBX-USED-WEIGHT-1M': str(store.used_weight)})
+
+    return Handler
+
+
+def start_mock_server(klines, port=0, latency=0.0):
+    """
+    在后台线程启动替身服务器
+
+    返回: (server, base_url, store)，用完调用 server.shutdown()
+    """
+    store = MockKlines(klines)
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', port), make_handler(store, latency))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}', store
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本地 Binance K 线接口替身')
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--count', type=int, default=26280, help='生成的 K 线数量')
+    parser.add_argument('--latency', type=float, default=0.0, help='每个请求的模拟延迟 (秒)')
+    args = parser.parse_args()
+
+    server, base_url, _ = start_mock_server(random_walk_klines(args.count), args.port, args.latency)
+    print(f"📡 K 线替身服务已启动: {base_url}/api/v3/klines")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,257 @@
+"""
+多通道 OHLCV 走势匹配
+只比收盘价时，平缓的漂移与大开大合、长影线的 K 线序列可能归一化后一模一样。
+多通道模式把每个窗口展开为 (窗口数 × L × 通道数) 的数组，按通道加权做多维 DTW：
+- ohlc: 开高低收按窗口内最低价 ~ 最高价归一化到 0-1（4 个通道，平分权重），反映影线与实体
+- close: 与单通道搜索相同的收盘价归一化
+- returns: 对数收益率
+- range: 振幅 (high - low) / close
+- volume: log(1 + 成交量 / 全历史中位数)；数据中没有成交量（如从 JSON 导入的存储）时忽略该通道
+后三者按全历史的标准差缩放并乘以 CHANNEL_SCALE，使其离散程度与 0-1 的形态通道相当。
+
+dependent DTW 所有通道共用一条弯曲路径；independent DTW 各通道分别弯曲后加权求和。
+默认通道（收盘价 + 收益率 + 振幅，3 维）使剪枝搜索的耗时保持在单通道的 2 倍以内；
+ohlc 形态占 4 维，加入后约为单通道的 2.3 倍（dependent）/ 3.5 倍（independent）
+"""
+import time
+import argparse
+import numpy as np
+
+from dtw_engine import pruned_dtw, dtw_batch
+from window_matrix import rolling_min_max, sliding_windows, normalized_windows
+
+CHANNELS = ('ohlc', 'close', 'returns', 'range', 'volume')
+MODES = ('dependent', 'independent')
+# 多通道搜索对应的距离度量名
+MULTIVARIATE_METRICS = ('mdtw_dependent', 'mdtw_independent')
+DEFAULT_CHANNELS = 'close:1,returns:0.5,range:0.5'
+# 逐根特征标准化后的缩放（0-1 均匀分布的标准差约 0.29）
+CHANNEL_SCALE = 0.25
+
+
+def parse_channels(spec=None):
+    """
+    'ohlc:1,returns:0.5' 或 {'ohlc': 1, 'returns': 0.5} -> {通道: 权重}；省略权重时为 1
+    """
+    spec = DEFAULT_CHANNELS if spec is None else spec
+    if isinstance(spec, dict):
+        channels = {name: float(weight) for name, weight in spec.items()}
+    else:
+        channels = {}
+        for part in spec.split(','):
+            if not part.strip():
+                continue
+            name, _, weight = part.strip().partition(':')
+            channels[name] = float(weight) if weight else 1.0
+    unknown = set(channels) - set(CHANNELS)
+    if unknown:
+        raise ValueError(f"未知的通道: {', '.join(sorted(unknown))}")
+    if not channels or not any(weight > 0 for weight in channels.values()):
+        raise ValueError("至少需要一个权重大于 0 的通道")
+    return {name: weight for name, weight in channels.items() if weight > 0}
+
+
+def channel_spec(channels):
+    """parse_channels 的逆操作，用作缓存键与报告"""
+    return ','.join(f"{name}:{weight:g}" for name, weight in channels.items())
+
+
+def metric_mode(metric):
+    """'mdtw_dependent' -> 'dependent'"""
+    if metric not in MULTIVARIATE_METRICS:
+        raise ValueError(f"未知的多通道度量: {metric}")
+    return metric.split('_', 1)[1]
+
+
+def _column(series, name):
+    if hasattr(series, name):
+        return np.asarray(getattr(series, name), dtype=float)
+    return np.fromiter((c.get(name, np.nan) for c in series), dtype=float, count=len(series))
+
+
+def _standardized(values):
+    std = np.nanstd(values)
+    return (values - np.nanmean(values)) / (std if std > 0 else 1.0) * CHANNEL_SCALE
+
+
+def usable_channels(series, channels):
+    """去掉数据中不可用的通道：没有成交量（如从 JSON 导入的存储，volume 全为 NaN）时忽略 volume 通道"""
+    if 'volume' in channels and np.isnan(_column(series, 'volume')).all():
+        channels = {name: weight for name, weight in channels.items() if name != 'volume'}
+        if not channels:
+            raise ValueError("数据中没有成交量，volume 之外没有可用的通道")
+        print(f"⚠️ 数据中没有成交量，已忽略 volume 通道，使用 {channel_spec(channels)}")
+    return channels
+
+
+def bar_features(series, channels):
+    """逐根（不依赖窗口的）通道特征，{通道: (N,)}"""
+    close = _column(series, 'close')
+    features = {}
+    if 'returns' in channels:
+        returns = np.zeros_like(close)
+        returns[1:] = np.diff(np.log(close))
+        features['returns'] = _standardized(returns)
+    if 'range' in channels:
+        features['range'] = _standardized((_column(series, 'high') - _column(series, 'low')) / close)
+    if 'volume' in channels:
+        volume = _column(series, 'volume')
+        median = np.nanmedian(volume)
+        features['volume'] = _standardized(np.nan_to_num(np.log1p(volume / (median if median > 0 else 1.0))))
+    return features
+
+
+class WindowTensor:
+    """
+    按通道展开的窗口数组构造器：与窗口无关的部分（逐根特征、滚动高低点）只算一次
+
+    weights: 与最后一维对应的通道权重 (C,)
+    channels: 实际使用的通道（已去掉数据中不可用的，见 usable_channels）
+    """
+
+    def __init__(self, series, length, channels):
+        channels = usable_channels(series, channels)
+        self.length = length
+        self.channels = channels
+        self.features = bar_features(series, channels)
+        self.weights = []
+        self.names = []
+        if 'ohlc' in channels:
+            self.ohlc = [_column(series, name) for name in ('open', 'high', 'low', 'close')]
+            self.low, _ = rolling_min_max(self.ohlc[2], length)
+            _, self.high = rolling_min_max(self.ohlc[1], length)
+            self.names += ['open', 'high', 'low', 'close']
+            self.weights += [channels['ohlc'] / 4] * 4
+        if 'close' in channels:
+            self.close = _column(series, 'close')
+            self.names.append('close_norm')
+            self.weights.append(channels['close'])
+        for name in ('returns', 'range', 'volume'):
+            if name in channels:
+                self.names.append(name)
+                self.weights.append(channels[name])
+        self.weights = np.asarray(self.weights, dtype=float)
+        self.count = len(series) - length + 1
+        self._candidates = None
+
+    def windows(self, start=0, stop=None):
+        """第 start 到 stop-1 个窗口，(n, L, C)"""
+        stop = self.count if stop is None else min(stop, self.count)
+        out = np.empty((max(stop - start, 0), self.length, len(self.names)))
+        c = 0
+        if 'ohlc' in self.channels:
+            low = self.low[start:stop, None]
+            span = self.high[start:stop, None] - low
+            flat = span == 0
+            for values in self.ohlc:
+                view = sliding_windows(values, self.length)[start:stop]
+                out[:, :, c] = np.where(flat, 0.0, (view - low) / np.where(flat, 1.0, span))
+                c += 1
+        if 'close' in self.channels:
+            out[:, :, c] = normalized_windows(self.close, self.length, start, stop)
+            c += 1
+        for name in ('returns', 'range', 'volume'):
+            if name in self.channels:
+                out[:, :, c] = sliding_windows(self.features[name], self.length)[start:stop]
+                c += 1
+        return out
+
+    def candidate_windows(self):
+        """候选窗口 [0, N-L) 的数组，首次调用后缓存，反复搜索同一序列时共用"""
+        if self._candidates is None:
+            self._candidates = self.windows(0, self.count - 1)
+        return self._candidates
+
+
+def multivariate_distances(data, target_start, pattern_length, top_n, min_gap, channels=None, mode='dependent',
+                           band=None, progress=None, tensor=None):
+    """
+    多通道 DTW 下的目标与每个候选窗口的距离（候选规则与 compute_distances 相同），
+    用逐通道加权的 LB_Kim / LB_Keogh 剪枝，结果与全量计算一致
+
+    tensor: 可选，复用的 WindowTensor
+
+    返回: (distances, 统计 dict)；被剪枝的窗口距离为 inf
+    """
+    channels = parse_channels(channels)
+    if tensor is None:
+        tensor = WindowTensor(data, pattern_length, channels)
+    window_count = max(0, len(data) - pattern_length)
+    candidates = np.flatnonzero(np.abs(np.arange(window_count) - target_start) >= min_gap)
+    windows = tensor.candidate_windows()
+    target = tensor.windows(target_start, target_start + 1)[0]
+    distances = np.full(window_count, np.inf)
+    distances[candidates], stats = pruned_dtw(target, windows[candidates], candidates, top_n, min_gap, band=band,
+                                              progress=progress, weights=tensor.weights, mode=mode)
+    return distances, stats
+
+
+def benchmark(length=24, top_n=200, channels=DEFAULT_CHANNELS, samples=5, seed=0):
+    """
+    在本地 BTC 数据上对比单通道（收盘价）与多通道 dependent / independent 搜索的耗时，
+    并校验 close:1 单通道配置与原引擎结果一致
+    """
+    import io
+    import contextlib
+    import find_similar_patterns as fsp
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        data = fsp.load_data()
+    closes = np.asarray(data.close, dtype=float)
+    min_gap = fsp.search_min_gap(length)
+    rng = np.random.default_rng(seed)
+    targets = rng.integers(0, len(data) - length, samples).tolist()
+    channels = parse_channels(channels)
+
+    t0 = time.perf_counter()
+    windows = normalized_windows(closes, length, 0, len(closes) - length)
+    single_prep = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    tensor = WindowTensor(data, length, channels)
+    tensor.candidate_windows()
+    multi_prep = time.perf_counter() - t0
+    print(f"📏 长度 {length} | 通道 {channel_spec(channels)} ({len(tensor.names)} 维) | "
+          f"窗口矩阵 {single_prep * 1000:.0f} ms -> {multi_prep * 1000:.0f} ms")
+
+    # 批量 DTW 内核本身（不剪枝、不放弃）：同一批窗口的逐窗口耗时
+    sample = np.arange(0, len(windows), max(1, len(windows) // 8192))
+    kernel = {}
+    t0 = time.perf_counter()
+    dtw_batch(windows[targets[0]], windows[sample])
+    kernel['single'] = time.perf_counter() - t0
+    multi_windows = tensor.candidate_windows()[sample]
+    for mode in MODES:
+        t0 = time.perf_counter()
+        dtw_batch(tensor.windows(targets[0], targets[0] + 1)[0], multi_windows, weights=tensor.weights, mode=mode)
+        kernel[mode] = time.perf_counter() - t0
+    print(f"🧮 批量 DTW 内核 ({len(sample)} 个窗口): " + ' | '.join(
+        f"{name} {elapsed * 1000:.0f} ms ({elapsed / kernel['single']:.2f}x)" for name, elapsed in kernel.items()))
+
+    timings = {'single': 0.0, 'dependent': 0.0, 'independent': 0.0}
+    for target in targets:
+        t0 = time.perf_counter()
+        single, _, _ = fsp.compute_distances(closes, target, length, top_n, min_gap, 'pruned', windows=windows)
+        timings['single'] += time.perf_counter() - t0
+        for mode in MODES:
+            t0 = time.perf_counter()
+            multivariate_distances(data, target, length, top_n, min_gap, channels, mode, tensor=tensor)
+            timings[mode] += time.perf_counter() - t0
+        same, _ = multivariate_distances(data, target, length, top_n, min_gap, {'close': 1})
+        assert fsp.select_top(same, top_n, min_gap) == fsp.select_top(single, top_n, min_gap)
+    for name, elapsed in timings.items():
+        ratio = elapsed / timings['single']
+        print(f"⏱️ 剪枝搜索 {name:>11}: {elapsed / samples * 1000:7.1f} ms/次 ({ratio:.2f}x)")
+    return {'kernel': kernel, 'search': {name: elapsed / samples for name, elapsed in timings.items()}}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='多通道 DTW 基准测试')
+    parser.add_argument('--length', type=int, default=24, help='模式长度 (小时)')
+    parser.add_argument('--channels', default=DEFAULT_CHANNELS, help="通道与权重，如 'ohlc:1,returns:0.5'")
+    parser.add_argument('--samples', type=int, default=5, help='随机目标个数')
+    args = parser.parse_args()
+    benchmark(args.length, channels=args.channels, samples=args.samples)
+
+
+if __name__ == "__main__":
+    main()
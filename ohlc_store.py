@@ -0,0 +1,386 @@
+"""
+列式 OHLCV 存储
+每列一个定长二进制文件 + 一个小的 meta.json 头，读取时直接内存映射，
+多个进程打开同一份数据时共享操作系统页缓存
+"""
+import os
+import json
+import time
+import shutil
+import argparse
+import numpy as np
+
+STORE_ROOT = 'ohlc_store'
+DEFAULT_SYMBOL = 'BTCUSDT'
+DEFAULT_INTERVAL = '1h'
+DEFAULT_JSON = 'btc_1h_ohlc.json'
+FORMAT_VERSION = 1
+
+# 列名 -> 磁盘上的 dtype（小端）
+COLUMNS = {
+    'time': '<i8',
+    'open': '<f8',
+    'high': '<f8',
+    'low': '<f8',
+    'close': '<f8',
+    'volume': '<f8',
+}
+PRICE_FIELDS = ('open', 'high', 'low', 'close')
+
+# K 线周期 -> 秒
+INTERVAL_SECONDS = {
+    '1m': 60, '3m': 180, '5m': 300, '15m': 900, '30m': 1800,
+    '1h': 3600, '2h': 7200, '4h': 14400, '6h': 21600, '8h': 28800, '12h': 43200,
+    '1d': 86400, '3d': 259200, '1w': 604800,
+}
+
+
+def interval_seconds(interval):
+    """K 线周期字符串换算为秒"""
+    if interval not in INTERVAL_SECONDS:
+        raise ValueError(f"不支持的 K 线周期: {interval}")
+    return INTERVAL_SECONDS[interval]
+
+
+def store_path(symbol=DEFAULT_SYMBOL, interval=DEFAULT_INTERVAL, root=STORE_ROOT):
+    """(交易对, 周期) 的存储目录：<root>/<SYMBOL>_<interval>"""
+    interval_seconds(interval)
+    return os.path.join(root, f'{symbol.upper()}_{interval}')
+
+
+DEFAULT_STORE = store_path()
+
+
+class OHLCSeries:
+    """
+    内存映射的 OHLCV 序列
+
+    列以 numpy 数组暴露（series.close 等），同时兼容原来的 list-of-dict 用法：
+    series[i] 返回单根蜡烛 dict，series[a:b] 返回 dict 列表
+    """
+
+    def __init__(self, columns, meta, path=None):
+        self.columns = columns
+        self.meta = meta
+        # 存储目录（内存中构造的序列为 None），派生数据（金字塔、索引）保存在其下
+        self.path = path
+        for name, values in columns.items():
+            setattr(self, name, values)
+
+    def __len__(self):
+        return int(self.meta['count'])
+
+    def _record(self, i):
+        return {
+            'time': int(self.time[i]),
+            'open': float(self.open[i]),
+            'high': float(self.high[i]),
+            'low': float(self.low[i]),
+            'close': float(self.close[i]),
+        }
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [self._record(i) for i in range(*key.indices(len(self)))]
+        if key < 0:
+            key += len(self)
+        if not 0 <= key < len(self):
+            raise IndexError(key)
+        return self._record(key)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self._record(i)
+
+    def locate(self, start=None, end=None, limit=None):
+        """
+        按时间范围定位行号，语义与 Binance klines 接口一致：
+        - 给出 start：从 start 起向后取至多 limit 根
+        - 只给 end：取 end 及之前最近的 limit 根
+        - 都不给：取最新的 limit 根
+
+        返回: (lo, hi)，即 series[lo:hi]
+        """
+        count = len(self)
+        times = self.time[:count]
+        lo = 0 if start is None else int(np.searchsorted(times, start, 'left'))
+        hi = count if end is None else int(np.searchsorted(times, end, 'right'))
+        if limit is not None:
+            if start is not None:
+                hi = min(hi, lo + limit)
+            else:
+                lo = max(lo, hi - limit)
+        return lo, max(lo, hi)
+
+    def to_records(self):
+        """转换为 TradingView 格式的 dict 列表（与 btc_1h_ohlc.json 相同）"""
+        times = self.time.tolist()
+        fields = [getattr(self, name).tolist() for name in PRICE_FIELDS]
+        return [
+            {'time': t, 'open': o, 'high': h, 'low': l, 'close': c}
+            for t, o, h, l, c in zip(times, *fields)
+        ]
+
+
+def _meta_path(path):
+    return os.path.join(path, 'meta.json')
+
+
+def _column_path(path, name):
+    return os.path.join(path, f'{name}.bin')
+
+
+def read_meta(path=DEFAULT_STORE):
+    """读取存储头信息"""
+    with open(_meta_path(path), 'r') as f:
+        return json.load(f)
+
+
+def dataset_version(series):
+    """
+    数据版本标识：任何一次写入（追加、回补、重写）都会改变 revision，
+    再加上行数与最后一根时间，防止重新导入后 revision 重复
+    """
+    meta = series.meta
+    last = int(series.time[-1]) if len(series) else 0
+    return f"{meta['symbol']}_{meta['interval']}_r{meta.get('revision', 0)}_n{len(series)}_t{last}"
+
+
+def store_exists(path=DEFAULT_STORE):
+    return os.path.exists(_meta_path(path))
+
+
+def open_store(path=DEFAULT_STORE):
+    """以只读内存映射方式打开存储"""
+    meta = read_meta(path)
+    if meta.get('version') != FORMAT_VERSION:
+        raise ValueError(f"不支持的存储版本: {meta.get('version')}")
+    count = int(meta['count'])
+    columns = {}
+    for name, dtype in COLUMNS.items():
+        if count == 0:
+            columns[name] = np.empty(0, dtype=dtype)
+        else:
+            columns[name] = np.memmap(_column_path(path, name), dtype=dtype, mode='r', shape=(count,))
+    return OHLCSeries(columns, meta, path)
+
+
+def _write_meta(path, meta):
+    """先写临时文件再原子替换，读者看到的 meta 总是完整的"""
+    tmp = _meta_path(path) + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(meta, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, _meta_path(path))
+
+
+def write_store(path, columns, symbol='BTCUSDT', interval='1h', extra_meta=None, keep_derived=False):
+    """
+    整体写入（覆盖）一个存储
+
+    columns: 包含 COLUMNS 中各列的 dict，缺失的 volume 以 NaN 填充
+    extra_meta: 额外写入 meta 的字段；未给出时沿用旧存储中的 known_gaps
+    keep_derived: 把旧目录下的派生数据子目录（pyramid/、index/、outcomes/）移到新目录，
+                  它们按 source_revision 自行判断增量更新还是重建
+    先写到临时目录，完成后再替换旧目录
+    """
+    count = len(columns['time'])
+    previous = read_meta(path) if store_exists(path) else {}
+    extra = {'known_gaps': previous.get('known_gaps', [])}
+    extra.update(extra_meta or {})
+    tmp_dir = f'{path}.tmp-{os.getpid()}'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    for name, dtype in COLUMNS.items():
+        values = columns.get(name)
+        if values is None:
+            values = np.full(count, np.nan)
+        np.asarray(values, dtype=dtype).tofile(_column_path(tmp_dir, name))
+
+    _write_meta(tmp_dir, {
+        'symbol': symbol,
+        'interval': interval,
+        'version': FORMAT_VERSION,
+        'count': count,
+        'revision': previous.get('revision', 0) + 1,
+        'updated': int(time.time()),
+        'columns': COLUMNS,
+        **extra,
+    })
+
+    old_dir = f'{path}.old-{os.getpid()}'
+    if os.path.exists(path):
+        os.replace(path, old_dir)
+    os.replace(tmp_dir, path)
+    if keep_derived and os.path.isdir(old_dir):
+        for entry in os.listdir(old_dir):
+            if os.path.isdir(os.path.join(old_dir, entry)):
+                os.replace(os.path.join(old_dir, entry), os.path.join(path, entry))
+    shutil.rmtree(old_dir, ignore_errors=True)
+    return open_store(path)
+
+
+def append_rows(path, columns):
+    """
+    追加新的 K 线（按时间升序）
+
+    - 时间早于最后一根的行忽略（历史缺口由 merge_rows 回补）
+    - 其余行追加到各列文件末尾，最后原子替换 meta.json 提交；
+      读者只按 meta 中的 count 映射数据，提交前写入的尾部字节对读者不可见
+    - 与最后一根时间相同且数值有变化的行要覆盖已提交的数据，不能原地改写
+      （已打开的内存映射会提前看到，中途崩溃会留下 revision 未变的新数据），
+      这种少见的情况改为经 write_store 整体重写，新数据与新 revision 一起提交
+
+    返回: (新增行数, 是否更新了最后一根)
+    """
+    meta = read_meta(path)
+    count = int(meta['count'])
+    times = np.asarray(columns['time'], dtype=COLUMNS['time'])
+    last = int(open_store(path).time[-1]) if count else None
+
+    keep = np.ones(len(times), dtype=bool) if last is None else times >= last
+    rows = {name: np.asarray(columns.get(name, np.full(len(times), np.nan)), dtype=dtype)[keep]
+            for name, dtype in COLUMNS.items()}
+    replaced = bool(last is not None and len(rows['time']) and rows['time'][0] == last)
+    if replaced:
+        stored = open_store(path)
+        if all(np.array_equal(stored.columns[name][-1:], rows[name][:1], equal_nan=True) for name in COLUMNS):
+            # 重叠的最后一根没有变化，直接去重
+            rows = {name: values[1:] for name, values in rows.items()}
+        else:
+            added = len(rows['time']) - 1
+            merged = {name: np.concatenate([stored.columns[name][:-1], rows[name]]) for name in COLUMNS}
+            extra = {key: value for key, value in meta.items()
+                     if key not in ('symbol', 'interval', 'version', 'count', 'revision', 'updated', 'columns')}
+            write_store(path, merged, meta['symbol'], meta['interval'], extra_meta=extra, keep_derived=True)
+            return added, True
+    added = len(rows['time'])
+    if added == 0:
+        return 0, False
+
+    for name, dtype in COLUMNS.items():
+        itemsize = np.dtype(dtype).itemsize
+        with open(_column_path(path, name), 'r+b') as f:
+            # 截掉上次中断留下的未提交字节
+            f.truncate(count * itemsize)
+            f.seek(count * itemsize)
+            f.write(rows[name].tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+
+    meta.update({
+        'count': count + added,
+        'revision': meta.get('revision', 0) + 1,
+        'updated': int(time.time()),
+    })
+    _write_meta(path, meta)
+    return added, replaced
+
+
+def merge_rows(path, columns):
+    """把若干行（例如回补的缺口）按时间合并进存储，重复时间以新数据为准，整体重写"""
+    series = open_store(path)
+    merged = {name: np.concatenate([series.columns[name],
+                                    np.asarray(columns.get(name, np.full(len(columns['time']), np.nan)),
+                                               dtype=dtype)])
+              for name, dtype in COLUMNS.items()}
+    # 倒序后 unique 取到的是每个时间最后出现（即新数据）的行
+    times = merged['time'][::-1]
+    _, first = np.unique(times, return_index=True)
+    order = len(times) - 1 - first
+    meta = series.meta
+    return write_store(path, {name: values[order] for name, values in merged.items()},
+                       meta['symbol'], meta['interval'])
+
+
+def find_gaps(times, step):
+    """返回缺失区间列表 [(第一根缺失时间, 最后一根缺失时间), ...]"""
+    times = np.asarray(times)
+    if len(times) < 2:
+        return []
+    holes = np.flatnonzero(np.diff(times) > step)
+    return [(int(times[i]) + step, int(times[i + 1]) - step) for i in holes]
+
+
+def update_meta(path, **fields):
+    """只更新 meta 中的附加字段（不改变数据）"""
+    meta = read_meta(path)
+    meta.update(fields)
+    _write_meta(path, meta)
+
+
+def import_json(json_path=DEFAULT_JSON, path=DEFAULT_STORE, symbol='BTCUSDT', interval='1h'):
+    """把 btc_1h_ohlc.json 导入列式存储"""
+    with open(json_path, 'r') as f:
+        candles = json.load(f)
+    columns = {
+        name: np.array([c.get(name, np.nan) for c in candles], dtype=dtype)
+        for name, dtype in COLUMNS.items()
+    }
+    series = write_store(path, columns, symbol, interval)
+    print(f"💾 已导入 {len(series)} 条数据到 {path}")
+    return series
+
+
+def export_json(path=DEFAULT_STORE, json_path=DEFAULT_JSON):
+    """把列式存储导出为原来的 JSON 格式"""
+    series = open_store(path)
+    with open(json_path, 'w') as f:
+        json.dump(series.to_records(), f)
+    print(f"💾 已导出 {len(series)} 条数据到 {json_path}")
+
+
+def load_series(path=DEFAULT_STORE, json_path=DEFAULT_JSON):
+    """打开存储；首次使用且只有 JSON 时自动导入"""
+    if not store_exists(path) and os.path.exists(json_path):
+        import_json(json_path, path)
+    return open_store(path)
+
+
+def benchmark(json_path=DEFAULT_JSON, path=DEFAULT_STORE, repeat=5):
+    """对比 json.load 与内存映射打开的加载耗时"""
+    if not store_exists(path):
+        import_json(json_path, path)
+
+    def best_of(fn):
+        timings = []
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            fn()
+            timings.append(time.perf_counter() - t0)
+        return min(timings)
+
+    def load_json():
+        with open(json_path, 'r') as f:
+            return [c['close'] for c in json.load(f)]
+
+    json_time = best_of(load_json)
+    store_time = best_of(lambda: float(open_store(path).close.sum()))
+    print(f"⏱️ json.load: {json_time * 1000:.2f} ms | 内存映射: {store_time * 1000:.2f} ms")
+    print(f"🚀 加速比: {json_time / store_time:.1f}x")
+    return {'json_ms': json_time * 1000, 'store_ms': store_time * 1000}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='列式 OHLCV 存储工具')
+    parser.add_argument('command', choices=['import', 'export', 'info', 'bench'])
+    parser.add_argument('--store', default=DEFAULT_STORE, help='存储目录')
+    parser.add_argument('--json', default=DEFAULT_JSON, help='JSON 文件路径')
+    parser.add_argument('--symbol', default='BTCUSDT')
+    parser.add_argument('--interval', default='1h')
+    args = parser.parse_args()
+
+    if args.command == 'import':
+        import_json(args.json, args.store, args.symbol, args.interval)
+    elif args.command == 'export':
+        export_json(args.store, args.json)
+    elif args.command == 'info':
+        print(json.dumps(read_meta(args.store), indent=2))
+    else:
+        benchmark(args.json, args.store)
+
+
+if __name__ == "__main__":
+    main()
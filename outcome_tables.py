@@ -0,0 +1,326 @@
+"""
+前瞻收益表
+对每根 K 线预先算好之后若干周期（默认 1h / 4h / 24h / 72h / 168h）的收益、最大有利波动（MFE）与最大不利波动（MAE），
+保存在基础存储目录下的 outcomes/ 中，每种一个 (行数, 周期数) 的 float64 矩阵文件，按行追加：
+- 收益: close[b + h] / close[b] - 1
+- MFE: max(high[b+1 .. b+h]) / close[b] - 1；MAE: min(low[b+1 .. b+h]) / close[b] - 1
+（均为 %，以第 b 根的收盘价为入场价；之后不足 h 根的为 NaN）
+
+相似走势的统计只需按各匹配最后一根的位置取行（向量化 gather），得到多周期的胜率、分位数与直方图，
+不再对每个匹配切片计算。新 K 线追加后只重算最后 max(h) + 1 行及新增的行；
+基础存储被整体重写时收益表随目录一起删除，下次访问时重建
+"""
+import os
+import json
+import time
+import shutil
+import argparse
+import threading
+import warnings
+import numpy as np
+
+import ohlc_store
+from window_matrix import rolling_min_max
+
+FORMAT_VERSION = 1
+DEFAULT_HORIZONS = ('1h', '4h', '24h', '72h', '168h')
+KINDS = ('returns', 'mfe', 'mae')
+QUANTILES = (0.1, 0.25, 0.5, 0.75, 0.9)
+HISTOGRAM_BINS = 20
+# 周期写法的单位
+UNIT_SECONDS = {'m': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+
+_update_lock = threading.Lock()
+
+
+def table_path(store_path):
+    return os.path.join(store_path, 'outcomes')
+
+
+def _file(path, kind):
+    return os.path.join(path, f'{kind}.bin')
+
+
+def horizon_seconds(spec):
+    """'24h' / '3d' -> 秒"""
+    unit = spec[-1:]
+    if unit not in UNIT_SECONDS or not spec[:-1].isdigit() or int(spec[:-1]) <= 0:
+        raise ValueError(f"无效的周期: {spec!r}")
+    return int(spec[:-1]) * UNIT_SECONDS[unit]
+
+
+def horizon_bars(horizons, step):
+    """各周期换算为根数；短于一根或不是整数根的周期跳过。返回 [(周期, 根数), ...]"""
+    pairs = []
+    for spec in horizons:
+        seconds = horizon_seconds(spec)
+        if seconds >= step and seconds % step == 0:
+            pairs.append((spec, seconds // step))
+    return pairs
+
+
+def compute_rows(high, low, close, bars, lo, hi):
+    """
+    第 lo 到 hi-1 根的前瞻收益 / MFE / MAE（%）
+
+    high / low / close: 完整的列（可为内存映射，只读取 [lo, hi + max(bars)) 的部分）
+    返回: {'returns' / 'mfe' / 'mae': (hi - lo, len(bars)) 数组}
+    """
+    count = len(close)
+    stop = min(count, hi + max(bars, default=0))
+    high = np.asarray(high[lo:stop], dtype=float)
+    low = np.asarray(low[lo:stop], dtype=float)
+    close = np.asarray(close[lo:stop], dtype=float)
+    rows = hi - lo
+    out = {kind: np.full((rows, len(bars)), np.nan) for kind in KINDS}
+    base = close[:rows]
+    for j, h in enumerate(bars):
+        # 之后有完整 h 根的行
+        ready = max(0, min(rows, len(close) - h))
+        if not ready:
+            continue
+        entry = base[:ready]
+        out['returns'][:ready, j] = (close[h:h + ready] / entry - 1) * 100
+        # 窗口 [b + 1, b + h] 的极值：从第 1 根起长度为 h 的滚动窗口
+        _, top = rolling_min_max(high[1:ready + h], h)
+        bottom, _ = rolling_min_max(low[1:ready + h], h)
+        out['mfe'][:ready, j] = (top[:ready] / entry - 1) * 100
+        out['mae'][:ready, j] = (bottom[:ready] / entry - 1) * 100
+    return out
+
+
+class OutcomeTable:
+    """各周期的前瞻收益 / MFE / MAE 矩阵（内存映射或内存数组），按行号取"""
+
+    def __init__(self, horizons, bars, arrays):
+        self.horizons = list(horizons)
+        self.bars = list(bars)
+        self.returns = arrays['returns']
+        self.mfe = arrays['mfe']
+        self.mae = arrays['mae']
+
+    def __len__(self):
+        return self.returns.shape[0]
+
+    @classmethod
+    def from_columns(cls, high, low, close, step, horizons=DEFAULT_HORIZONS):
+        """直接在内存中计算（数据不在存储中时使用）"""
+        pairs = horizon_bars(horizons, step)
+        bars = [h for _, h in pairs]
+        return cls([name for name, _ in pairs], bars, compute_rows(high, low, close, bars, 0, len(close)))
+
+
+def _source_meta(series):
+    return {
+        'source_revision': series.meta.get('revision', 0),
+        'source_count': len(series),
+        'source_last': int(series.time[-1]) if len(series) else None,
+    }
+
+
+def _write_meta(path, meta):
+    tmp = os.path.join(path, 'meta.json.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(meta, f, indent=2)
+    os.replace(tmp, os.path.join(path, 'meta.json'))
+
+
+def read_meta(path):
+    with open(os.path.join(path, 'meta.json'), 'r') as f:
+        return json.load(f)
+
+
+def build_table(store_path=ohlc_store.DEFAULT_STORE, horizons=DEFAULT_HORIZONS):
+    """整体计算并写入收益表（先写临时目录再替换）"""
+    series = ohlc_store.open_store(store_path)
+    pairs = horizon_bars(horizons, ohlc_store.interval_seconds(series.meta['interval']))
+    bars = [h for _, h in pairs]
+    rows = compute_rows(series.high, series.low, series.close, bars, 0, len(series))
+    path = table_path(store_path)
+    tmp = f'{path}.tmp-{os.getpid()}'
+    os.makedirs(tmp, exist_ok=True)
+    for kind in KINDS:
+        rows[kind].astype('<f8').tofile(_file(tmp, kind))
+    _write_meta(tmp, {'version': FORMAT_VERSION, 'horizons': [name for name, _ in pairs], 'bars': bars,
+                      'requested': list(horizons), 'count': len(series), 'updated': int(time.time()),
+                      **_source_meta(series)})
+    old = f'{path}.old-{os.getpid()}'
+    if os.path.exists(path):
+        os.replace(path, old)
+    os.replace(tmp, path)
+    shutil.rmtree(old, ignore_errors=True)
+    return 'rebuild'
+
+
+def _append(path, meta, series):
+    """数据从 source_count 行追加后：重算最后 max(h) + 1 行（之前不完整或最后一根被覆盖）及新增的行"""
+    bars = meta['bars']
+    old_count, count = meta['source_count'], len(series)
+    start = max(0, old_count - 1 - max(bars, default=0))
+    rows = compute_rows(series.high, series.low, series.close, bars, start, count)
+    width = len(bars) * 8
+    for kind in KINDS:
+        with open(_file(path, kind), 'r+b') as f:
+            f.truncate(start * width)
+            f.seek(start * width)
+            f.write(rows[kind].astype('<f8').tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+    meta.update({'count': count, 'updated': int(time.time()), **_source_meta(series)})
+    _write_meta(path, meta)
+
+
+def update_table(store_path=ohlc_store.DEFAULT_STORE, horizons=None):
+    """
+    让收益表与基础存储保持一致（供增量同步与实时数据在写入新 K 线后调用）
+    horizons: None 沿用已有的周期（不存在时用 DEFAULT_HORIZONS）；与已有的不同时重建
+
+    返回: 'fresh' / 'incremental' / 'rebuild'
+    """
+    path = table_path(store_path)
+    with _update_lock:
+        series = ohlc_store.open_store(store_path)
+        meta = read_meta(path) if os.path.exists(os.path.join(path, 'meta.json')) else None
+        if meta is None or (horizons is not None and list(horizons) != meta['requested']):
+            return build_table(store_path, horizons or DEFAULT_HORIZONS)
+        if meta['source_revision'] == series.meta.get('revision', 0):
+            return 'fresh'
+        # 只发生过追加（旧的最后一根之前行数不变）时增量更新，否则重建
+        if meta['source_count'] and series.locate(end=meta['source_last'])[1] == meta['source_count']:
+            _append(path, meta, series)
+            return 'incremental'
+        return build_table(store_path, meta['requested'])
+
+
+def open_table(store_path=ohlc_store.DEFAULT_STORE, horizons=None):
+    """打开收益表（必要时先更新），矩阵为只读内存映射"""
+    update_table(store_path, horizons)
+    path = table_path(store_path)
+    meta = read_meta(path)
+    shape = (meta['count'], len(meta['bars']))
+    arrays = {kind: (np.memmap(_file(path, kind), dtype='<f8', mode='r', shape=shape) if all(shape)
+                     else np.empty(shape)) for kind in KINDS}
+    return OutcomeTable(meta['horizons'], meta['bars'], arrays)
+
+
+def table_for(data, horizons=None):
+    """数据对应的收益表：来自存储的序列用（增量维护的）磁盘表，其他数据在内存中计算"""
+    path = getattr(data, 'path', None)
+    if path is not None:
+        return open_table(path, horizons)
+    if hasattr(data, 'close'):
+        high, low, close = data.high, data.low, data.close
+        step = ohlc_store.interval_seconds(data.meta['interval'])
+    else:
+        high, low, close = (np.array([c[name] for c in data], dtype=float) for name in ('high', 'low', 'close'))
+        step = int(data[1]['time'] - data[0]['time']) if len(data) > 1 else 3600
+    return OutcomeTable.from_columns(high, low, close, step, horizons or DEFAULT_HORIZONS)
+
+
+def _clean(values, digits=2):
+    """数组四舍五入并把 NaN 换成 None（JSON 中的 null）"""
+    return [None if np.isnan(v) else round(float(v), digits) for v in np.asarray(values, dtype=float).ravel()]
+
+
+def match_stats(table, anchors, bins=HISTOGRAM_BINS):
+    """
+    k 个匹配的多周期统计：按各匹配最后一根的行号一次取出 (k, 周期数) 的矩阵，逐列向量化统计
+
+    anchors: 各匹配最后一根的行号
+    返回: {周期: {'bars', 'count', 'win_rate', 'avg_return', 'quantiles', 'mfe', 'mae', 'histogram'}}
+    """
+    anchors = np.asarray(anchors, dtype=np.int64)
+    anchors = anchors[(anchors >= 0) & (anchors < len(table))]
+    returns, mfe, mae = table.returns[anchors], table.mfe[anchors], table.mae[anchors]
+    ready = ~np.isnan(returns)
+    count = ready.sum(axis=0)
+    labels = [f'p{round(q * 100)}' for q in QUANTILES]
+    with warnings.catch_warnings():
+        # 没有完整前瞻数据的周期整列为 NaN
+        warnings.simplefilter('ignore', RuntimeWarning)
+        win_rate = (returns > 0).sum(axis=0) / np.maximum(count, 1) * 100
+        mean = np.nanmean(returns, axis=0)
+        quantiles = np.nanquantile(returns, QUANTILES, axis=0)
+        mfe_mean, mae_mean = np.nanmean(mfe, axis=0), np.nanmean(mae, axis=0)
+        mfe_median, mae_median = np.nanmedian(mfe, axis=0), np.nanmedian(mae, axis=0)
+    stats = {}
+    for j, name in enumerate(table.horizons):
+        column = returns[ready[:, j], j]
+        counts, edges = np.histogram(column, bins=bins) if len(column) else (np.zeros(0, int), np.zeros(0))
+        stats[name] = {
+            'bars': int(table.bars[j]),
+            'count': int(count[j]),
+            'win_rate': round(float(win_rate[j]), 2),
+            'avg_return': _clean([mean[j]])[0],
+            'quantiles': dict(zip(labels, _clean(quantiles[:, j]))),
+            'mfe': {'avg': _clean([mfe_mean[j]])[0], 'median': _clean([mfe_median[j]])[0]},
+            'mae': {'avg': _clean([mae_mean[j]])[0], 'median': _clean([mae_median[j]])[0]},
+            'histogram': {'edges': _clean(edges, 4), 'counts': counts.tolist()},
+        }
+    return stats
+
+
+def benchmark(store_path=ohlc_store.DEFAULT_STORE, matches=200, repeat=20, seed=0):
+    """
+    对比原来的逐匹配切片（data[i:end] 转为 dict 再算单一周期的涨跌）与收益表的向量化统计
+    """
+    from find_similar_patterns import prediction_stats
+
+    series = ohlc_store.load_series(store_path)
+    t0 = time.perf_counter()
+    status = update_table(store_path)
+    print(f"📦 收益表: {status}，{(time.perf_counter() - t0) * 1000:.1f} ms")
+    table = open_table(store_path)
+    length = 24
+    rng = np.random.default_rng(seed)
+    indices = np.sort(rng.choice(len(series) - length, matches, replace=False))
+
+    def loop():
+        changes = []
+        for i in indices.tolist():
+            match_end = i + length
+            future_end = min(len(series), match_end + max(24, length))
+            segment = series[i:future_end]
+            if future_end > match_end:
+                changes.append((segment[-1]['close'] - segment[length - 1]['close'])
+                               / segment[length - 1]['close'] * 100)
+        return prediction_stats(changes)
+
+    def best_of(fn):
+        timings = []
+        for _ in range(repeat):
+            t = time.perf_counter()
+            fn()
+            timings.append(time.perf_counter() - t)
+        return min(timings) * 1000
+
+    loop_ms = best_of(loop)
+    gather_ms = best_of(lambda: match_stats(table, indices + length - 1))
+    print(f"⏱️ {matches} 个匹配 | 逐个切片（1 个周期）: {loop_ms:.2f} ms | "
+          f"收益表 gather（{len(table.horizons)} 个周期 + MFE/MAE）: {gather_ms:.2f} ms")
+    return {'loop_ms': loop_ms, 'gather_ms': gather_ms}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='前瞻收益表（多周期收益 / MFE / MAE）')
+    parser.add_argument('command', choices=['build', 'update', 'info', 'bench'])
+    parser.add_argument('--store', default=ohlc_store.DEFAULT_STORE, help='基础存储目录')
+    parser.add_argument('--horizons', default=None, help=f"周期，逗号分隔，默认 {','.join(DEFAULT_HORIZONS)}")
+    parser.add_argument('--matches', type=int, default=200, help='bench 的匹配数')
+    args = parser.parse_args()
+    horizons = args.horizons.split(',') if args.horizons else None
+
+    if args.command == 'build':
+        t0 = time.perf_counter()
+        build_table(args.store, horizons or DEFAULT_HORIZONS)
+        print(f"💾 收益表 {table_path(args.store)}，耗时 {time.perf_counter() - t0:.2f}s")
+    elif args.command == 'update':
+        print(f"🔄 收益表: {update_table(args.store, horizons)}")
+    elif args.command == 'info':
+        print(json.dumps(read_meta(table_path(args.store)), indent=2))
+    else:
+        benchmark(args.store, args.matches)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+"""
+PAA 特征索引：近似检索候选窗口，再用精确 DTW 重排
+每个归一化窗口按分段均值（Piecewise Aggregate Approximation）压缩成几维签名，放进 KD 树；
+搜索时取签名最近的 factor × top_n 个窗口，连同其前后 EXPAND 根的相邻窗口计算精确 DTW，
+候选数只取决于 factor 与 top_n，与历史长度无关。
+签名按段宽加权，签名间的欧氏距离不超过原窗口的欧氏距离（PAA 下界），
+但 DTW 允许时间弯曲、最优匹配常在欧氏近邻旁边错开几根，因此结果是近似的，召回率见 benchmark
+"""
+import time
+import hashlib
+import argparse
+import threading
+from collections import OrderedDict
+import numpy as np
+from scipy.spatial import cKDTree
+
+from dtw_engine import dtw_batch
+from window_matrix import normalized_windows, iter_normalized_windows, gather_normalized_windows
+
+# 签名维数（模式更短时取模式长度）
+PAA_SEGMENTS = 8
+# 默认候选数 = CANDIDATE_FACTOR × top_n
+CANDIDATE_FACTOR = 16
+# 每个近邻向前后扩展的窗口数
+EXPAND = 2
+# 进程内缓存的索引个数
+CACHE_SIZE = 8
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def segment_bounds(length, segments=PAA_SEGMENTS):
+    """各段的起点（最后一个元素为 length），段宽相差不超过 1"""
+    segments = min(segments, length)
+    return np.round(np.linspace(0, length, segments + 1)).astype(int)
+
+
+def paa_signatures(windows, bounds):
+    """
+    (n, L) 窗口矩阵 -> (n, 段数) 签名
+    每段取均值再乘 sqrt(段宽)，使签名的欧氏距离是原窗口欧氏距离的下界
+    """
+    widths = np.diff(bounds)
+    sums = np.add.reduceat(np.atleast_2d(windows), bounds[:-1], axis=1)
+    return sums / np.sqrt(widths)
+
+
+class PaaIndex:
+    """候选窗口 [0, N-L) 的 PAA 签名与 KD 树"""
+
+    def __init__(self, closes, length, segments=PAA_SEGMENTS):
+        closes = np.asarray(closes, dtype=float)
+        self.length = length
+        self.bounds = segment_bounds(length, segments)
+        self.count = max(0, len(closes) - length)
+        signatures = np.empty((self.count, len(self.bounds) - 1))
+        for offset, block in iter_normalized_windows(closes, length, stop=self.count):
+            signatures[offset:offset + len(block)] = paa_signatures(block, self.bounds)
+        self.tree = cKDTree(signatures)
+
+    def candidates(self, target_pattern, target_start, k, min_gap, expand=EXPAND):
+        """
+        签名最接近目标的 k 个窗口及其前后 expand 个相邻窗口（排除与目标间隔 < min_gap 的）
+
+        返回: 窗口索引数组（升序、去重）
+        """
+        if self.count == 0 or k <= 0:
+            return np.empty(0, dtype=int)
+        # 多取排除区内可能占掉的名额
+        query = min(self.count, k + 2 * min_gap)
+        _, found = self.tree.query(paa_signatures(target_pattern, self.bounds)[0], query)
+        found = np.atleast_1d(found)
+        found = found[np.abs(found - target_start) >= min_gap][:k]
+        found = np.unique((found[:, None] + np.arange(-expand, expand + 1)).ravel())
+        found = found[(found >= 0) & (found < self.count)]
+        return found[np.abs(found - target_start) >= min_gap]
+
+
+def _series_key(closes, length, segments):
+    digest = hashlib.blake2b(np.ascontiguousarray(closes).tobytes(), digest_size=16).hexdigest()
+    return (digest, len(closes), length, segments)
+
+
+def get_index(closes, length, segments=PAA_SEGMENTS):
+    """取（或构建）序列的 PAA 索引，按收盘价内容缓存，数据更新后自动失效"""
+    closes = np.asarray(closes, dtype=float)
+    key = _series_key(closes, length, segments)
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+    index = PaaIndex(closes, length, segments)
+    with _cache_lock:
+        _cache[key] = index
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return index
+
+
+def approximate_distances(closes, target_start, length, top_n, min_gap, band=None, factor=CANDIDATE_FACTOR,
+                          expand=EXPAND, index=None):
+    """
+    只对 PAA 近邻候选计算精确 DTW
+
+    返回: (distances, 统计 dict)；distances 覆盖 [0, N-L)，未入选候选的窗口为 inf
+    """
+    closes = np.asarray(closes, dtype=float)
+    if index is None:
+        index = get_index(closes, length)
+    target = normalized_windows(closes[target_start:target_start + length], length)[0]
+    picked = index.candidates(target, target_start, int(np.ceil(factor * top_n)), min_gap, expand)
+    distances = np.full(index.count, np.inf)
+    if len(picked):
+        distances[picked] = dtw_batch(target, gather_normalized_windows(closes, length, picked), band=band)
+    allowed = np.abs(np.arange(index.count) - target_start) >= min_gap
+    return distances, {'windows': int(allowed.sum()), 'reranked': len(picked)}
+
+
+def benchmark(lengths=(24, 72), top_ns=(10, 200), factors=(2, 4, 8, 16, 32), samples=20, expand=EXPAND, seed=0):
+    """
+    在本地 BTC 数据上对比 PAA 检索 + DTW 重排与全量精确搜索（pruned 引擎）
+
+    - 召回率: 精确结果中被近似结果原样找到的比例
+    - 邻域召回率: 精确结果中，近似结果在其前后 L/4 根内有匹配的比例
+    - 距离比: 近似结果与精确结果按名次对齐后的平均 DTW 距离之比（≥ 1，越接近 1 越好）
+    """
+    import io
+    import contextlib
+    import find_similar_patterns as fsp
+    from window_matrix import close_array
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        data = fsp.load_data()
+    closes = close_array(data)
+    rng = np.random.default_rng(seed)
+    rows = []
+    for length in lengths:
+        min_gap = fsp.search_min_gap(length)
+        t0 = time.perf_counter()
+        index = PaaIndex(closes, length)
+        build = time.perf_counter() - t0
+        windows = normalized_windows(closes, length, 0, max(0, len(closes) - length))
+        print(f"📏 长度 {length}: {index.count} 个窗口，建索引 {build * 1000:.0f} ms")
+        targets = rng.integers(0, len(closes) - length, samples).tolist()
+        for top_n in top_ns:
+            exact, exact_time = [], 0.0
+            for target in targets:
+                t0 = time.perf_counter()
+                distances, _, _ = fsp.compute_distances(closes, target, length, top_n, min_gap, 'pruned',
+                                                        windows=windows)
+                kept = fsp.select_top(distances, top_n, min_gap)
+                exact_time += time.perf_counter() - t0
+                exact.append((np.array(kept, dtype=int), distances[kept]))
+            exact_ms = exact_time / samples * 1000
+            print(f"   top {top_n}: 全量精确 {exact_ms:.1f} ms/次")
+            for factor in factors:
+                hits = near = total = reranked = 0
+                ratios, elapsed = [], 0.0
+                for target, (truth, truth_dist) in zip(targets, exact):
+                    t0 = time.perf_counter()
+                    distances, stats = approximate_distances(closes, target, length, top_n, min_gap,
+                                                             factor=factor, expand=expand, index=index)
+                    found = np.array(fsp.select_top(distances, top_n, min_gap), dtype=int)
+                    elapsed += time.perf_counter() - t0
+                    reranked += stats['reranked']
+                    total += len(truth)
+                    if len(found) and len(truth):
+                        hits += len(np.intersect1d(truth, found))
+                        near += int((np.abs(truth[:, None] - found[None, :]).min(axis=1) <= length // 4).sum())
+                        n = min(len(found), len(truth))
+                        ratios.append(distances[found[:n]].mean() / max(truth_dist[:n].mean(), 1e-12))
+                row = {'length': length, 'top_n': top_n, 'factor': factor,
+                       'recall': hits / max(total, 1), 'near_recall': near / max(total, 1),
+                       'distance_ratio': float(np.mean(ratios)) if ratios else None,
+                       'reranked': reranked / samples, 'latency_ms': elapsed / samples * 1000, 'exact_ms': exact_ms}
+                print(f"   top {top_n} | 候选 {factor:g} × top_n（重排 {row['reranked']:.0f} 个）: "
+                      f"召回率 {row['recall'] * 100:5.1f}% | 邻域召回率 {row['near_recall'] * 100:5.1f}% | "
+                      f"距离比 {row['distance_ratio'] or 0:.3f} | {row['latency_ms']:.1f} ms/次")
+                rows.append(row)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description='PAA 特征索引召回率 / 延迟基准测试')
+    parser.add_argument('--lengths', type=int, nargs='+', default=[24, 72], help='模式长度')
+    parser.add_argument('--top-n', type=int, nargs='+', default=[10, 200], help='结果个数')
+    parser.add_argument('--factors', type=float, nargs='+', default=[2, 4, 8, 16, 32], help='候选数 / top_n')
+    parser.add_argument('--samples', type=int, default=20, help='随机目标个数')
+    parser.add_argument('--expand', type=int, default=EXPAND, help='每个近邻向前后扩展的窗口数')
+    args = parser.parse_args()
+    benchmark(args.lengths, args.top_n, args.factors, args.samples, args.expand)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,381 @@
+"""
+多进程分片搜索
+把窗口索引范围切成若干分片，交给常驻的进程池并行扫描，再在父进程合并各分片的候选池：
+- 收盘价只放进共享内存一次（按数据版本），工作进程按名字附加并缓存；最多同时保留 SHARED_SERIES 份
+  （多个市场 / 周期的序列，见 cross_market），数据版本变化后旧的一块不再被使用，按最近最少使用淘汰
+- 分片只划分窗口的起点，每个分片读取到其最后一个窗口之后的 L-1 根（分片边界处的重叠），
+  欧氏距离的分片边界对齐到 FFT 分块，与整段计算逐位相同
+- 每个分片保留自己键最小的 pool_capacity 个窗口；全局最小的这么多个窗口一定都在各分片的池中，
+  合并后在池上做一次全局的 min_gap 贪心选取，结果与串行搜索完全一致（见 chunked_search）
+- DTW 的各分片通过共享内存中的一个浮点数交换剪枝门槛：任一分片池满后的门槛都不小于全局池的门槛，
+  取其中最小的用于下界剪枝与提前放弃，既不影响结果，又让后启动的分片一开始就能剪掉大部分窗口
+- 进程池在第一次使用时创建并常驻（forkserver 预先导入 NumPy 与搜索模块），之后的搜索不再付出启动与导入的开销
+"""
+import os
+import sys
+import time
+import atexit
+import hashlib
+import argparse
+import threading
+import contextlib
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+import numpy as np
+
+import chunked_search
+from chunked_search import CandidatePool, CHUNKED_METRICS, chunk_windows, pool_capacity, scan_range
+from mass_engine import METRICS
+
+# 每个工作进程分到的分片数（分片耗时不均时后面的分片可以补位）
+SHARDS_PER_WORKER = 2
+# 每个分片至少的窗口数，太小的搜索不值得分片
+MIN_SHARD_WINDOWS = 1 << 16
+# 工作进程预先导入的模块
+PRELOAD = ['numpy', 'chunked_search']
+# 同时保留在共享内存中的序列份数
+SHARED_SERIES = 8
+
+# 默认的工作进程数：1 表示不并行（configure 修改）
+default_workers = 1
+
+_lock = threading.Lock()
+_executor = None
+_executor_workers = 0
+# 数据版本 -> SharedSeries，按最近使用排序
+_series = OrderedDict()
+
+
+def configure(workers=None):
+    """设置默认的工作进程数（None 为 CPU 核数）；进程池在下一次搜索时按新的进程数重建"""
+    global default_workers
+    default_workers = max(1, workers or os.cpu_count() or 1)
+    return default_workers
+
+
+class SharedSeries:
+    """父进程中的一份共享内存收盘价；users 为正在使用它的搜索数"""
+
+    def __init__(self, closes, key):
+        closes = np.asarray(closes, dtype=float)
+        self.key = key
+        self.count = len(closes)
+        self.shm = shared_memory.SharedMemory(create=True, size=max(closes.nbytes, 1))
+        np.ndarray(self.count, dtype=float, buffer=self.shm.buf)[:] = closes
+        self.users = 0
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def release(self):
+        self.shm.close()
+        self.shm.unlink()
+
+
+class SharedCutoff:
+    """
+    分片之间共享的剪枝门槛（共享内存中的一个 float64）
+    offer 只在更小时写入，不加锁：并发写入时较大的值可能覆盖较小的值，只是门槛变松，不影响结果
+    """
+
+    def __init__(self, name=None):
+        self.shm = (shared_memory.SharedMemory(create=True, size=8) if name is None
+                    else shared_memory.SharedMemory(name=name))
+        self.value = np.ndarray(1, dtype=float, buffer=self.shm.buf)
+        if name is None:
+            self.value[0] = np.inf
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def get(self):
+        return float(self.value[0])
+
+    def offer(self, threshold):
+        if threshold < self.value[0]:
+            self.value[0] = threshold
+
+    def close(self, unlink=False):
+        del self.value
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+def series_key(closes):
+    """没有数据版本时用内容摘要区分不同的序列"""
+    data = np.ascontiguousarray(closes, dtype=float)
+    return f"n{len(data)}_{hashlib.blake2b(data.tobytes(), digest_size=16).hexdigest()}"
+
+
+def _evict():
+    """超过 SHARED_SERIES 份时释放最久未用、且没有搜索在使用的序列"""
+    for key in list(_series):
+        if len(_series) <= SHARED_SERIES:
+            break
+        if _series[key].users == 0:
+            _series.pop(key).release()
+
+
+@contextlib.contextmanager
+def shared_series(closes, key=None):
+    """
+    取得 closes 的共享内存副本：同一数据版本只复制一次，之后的搜索直接复用
+    key: 数据版本标识，None 时按内容摘要
+    """
+    key = key or series_key(closes)
+    with _lock:
+        series = _series.get(key)
+        if series is None:
+            series = _series[key] = SharedSeries(closes, key)
+        _series.move_to_end(key)
+        series.users += 1
+    try:
+        yield series
+    finally:
+        with _lock:
+            series.users -= 1
+            _evict()
+
+
+# ---------- 工作进程 ----------
+
+# 工作进程中已附加的共享内存：名字 -> (SharedMemory, 收盘价数组)
+_attached = {}
+
+
+def _attach(name, count):
+    """附加父进程的共享序列并缓存；缓存超过 SHARED_SERIES 份时关闭最早附加的（父进程已经或即将 unlink）"""
+    entry = _attached.get(name)
+    if entry is None:
+        while len(_attached) >= SHARED_SERIES:
+            shm, _ = _attached.pop(next(iter(_attached)))
+            shm.close()
+        shm = shared_memory.SharedMemory(name=name)
+        entry = _attached[name] = (shm, np.ndarray(count, dtype=float, buffer=shm.buf))
+    return entry[1]
+
+
+def _warm(delay=0.0):
+    """进程池预热：确保工作进程已启动并导入了搜索模块"""
+    time.sleep(delay)
+    return os.getpid()
+
+
+def _scan_shard(name, count, cutoff_name, target_start, length, top_n, min_gap, metric, band, chunk_size,
+                start, stop, pattern=None):
+    """扫描一个分片，返回该分片的候选池（索引、距离）与计数"""
+    closes = _attach(name, count)
+    cutoff = SharedCutoff(cutoff_name) if cutoff_name else None
+    try:
+        pool, counts = chunked_search.scan(closes, target_start, length, top_n, min_gap, metric, band,
+                                           chunk_size, start, stop, shared=cutoff, pattern=pattern)
+    finally:
+        if cutoff is not None:
+            cutoff.close()
+    return pool.indices, pool.distances, counts
+
+
+# ---------- 父进程 ----------
+
+def _context():
+    """forkserver（预先导入搜索模块，复制出的工作进程不再重复导入）；不支持的平台用 spawn"""
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        ctx = multiprocessing.get_context('forkserver')
+        ctx.set_forkserver_preload(PRELOAD)
+        return ctx
+    return multiprocessing.get_context('spawn')
+
+
+def executor(workers=None):
+    """常驻进程池，进程数变化时重建"""
+    global _executor, _executor_workers
+    workers = workers or default_workers
+    with _lock:
+        if _executor is None or _executor_workers != workers:
+            if _executor is not None:
+                _executor.shutdown(wait=True)
+            # 工作进程需要能导入本目录下的模块
+            here = os.path.dirname(os.path.abspath(__file__))
+            if here not in sys.path:
+                sys.path.insert(0, here)
+            _executor = ProcessPoolExecutor(workers, mp_context=_context())
+            _executor_workers = workers
+        return _executor
+
+
+def warm_up(workers=None):
+    """启动全部工作进程（第一次搜索不再等待进程启动）；返回工作进程的 pid"""
+    workers = workers or default_workers
+    pool = executor(workers)
+    # 每个任务稍作停留，让进程池为每个任务各启动一个进程
+    return sorted(set(pool.map(_warm, [0.05] * workers)))
+
+
+def shutdown():
+    """关闭进程池并释放共享内存"""
+    global _executor
+    with _lock:
+        if _executor is not None:
+            _executor.shutdown(wait=True)
+            _executor = None
+        for key in [key for key, series in _series.items() if series.users == 0]:
+            _series.pop(key).release()
+
+
+atexit.register(shutdown)
+
+
+def shards(start, stop, workers, metric, chunk_size, min_shard=MIN_SHARD_WINDOWS):
+    """
+    把窗口范围 [start, stop) 切成至多 workers × SHARDS_PER_WORKER 个分片，每片至少 min_shard 个窗口；
+    欧氏距离的边界对齐到块大小（FFT 分块与整段计算相同）
+    """
+    total = stop - start
+    count = max(1, min(workers * SHARDS_PER_WORKER, total // max(min_shard, 1)))
+    align = chunk_size if metric in METRICS else 1
+    bounds = sorted({start + (total * i // count) // align * align for i in range(count)} | {stop})
+    return [(lo, hi) for lo, hi in zip(bounds[:-1], bounds[1:]) if hi > lo]
+
+
+class ScanRequest:
+    """
+    一条序列上的一次扫描：target_start 为 None 时目标来自其他序列，由 pattern 给出（不排除任何窗口）
+    key: 数据版本标识（如 ohlc_store.dataset_version），同一版本复用共享内存；None 时按内容摘要
+    """
+
+    def __init__(self, closes, target_start, length, top_n, min_gap, metric='dtw', band=None, key=None,
+                 pattern=None):
+        if metric not in CHUNKED_METRICS:
+            raise ValueError(f"分片搜索不支持的距离度量: {metric}")
+        self.closes = closes
+        self.target_start = target_start
+        self.length = length
+        self.top_n = top_n
+        self.min_gap = min_gap
+        self.metric = metric
+        self.band = band
+        self.key = key
+        self.pattern = None if pattern is None else np.asarray(pattern, dtype=float)
+
+
+def scan_series(requests, workers=None, chunk_size=None, min_shard=MIN_SHARD_WINDOWS, progress=None):
+    """
+    把若干条序列的扫描切成分片，一起交给进程池并行执行（不同序列的分片互相穿插）
+
+    返回: 与 requests 对应的 [(合并后的 CandidatePool, 计数 dict, 分片数), ...]
+    """
+    workers = workers or default_workers
+    pool = executor(workers)
+    merged = [CandidatePool(pool_capacity(r.top_n, r.min_gap)) for r in requests]
+    counts = [{'windows': 0, 'pruned': 0, 'abandoned': 0, 'dtw': 0, 'chunks': 0} for _ in requests]
+    cutoffs = [SharedCutoff() if r.metric == 'dtw' else None for r in requests]
+    parts = []
+    try:
+        with contextlib.ExitStack() as stack:
+            futures = {}
+            for i, r in enumerate(requests):
+                series = stack.enter_context(shared_series(r.closes, r.key))
+                size = chunk_size or chunk_windows(r.length, r.metric)
+                window_count = max(0, series.count - r.length)
+                parts.append(shards(0, scan_range(r.metric, r.length, window_count), workers, r.metric, size,
+                                    min_shard))
+                for lo, hi in parts[-1]:
+                    future = pool.submit(_scan_shard, series.name, series.count, cutoffs[i] and cutoffs[i].name,
+                                         r.target_start, r.length, r.top_n, r.min_gap, r.metric, r.band, size,
+                                         lo, hi, r.pattern)
+                    futures[future] = i
+            for done, future in enumerate(as_completed(futures), 1):
+                i = futures[future]
+                indices, distances, shard_counts = future.result()
+                merged[i].add(indices, distances)
+                for name in counts[i]:
+                    counts[i][name] += shard_counts[name]
+                if progress is not None:
+                    progress(done / len(futures))
+    finally:
+        for cutoff in cutoffs:
+            if cutoff is not None:
+                cutoff.close(unlink=True)
+    return [(merged[i], counts[i], len(parts[i])) for i in range(len(requests))]
+
+
+def sharded_search(closes, target_start, length, top_n, min_gap, metric='dtw', band=None, workers=None, key=None,
+                   chunk_size=None, min_shard=MIN_SHARD_WINDOWS, progress=None):
+    """
+    多进程分片搜索，结果与 chunked_search / 内存搜索相同
+
+    closes: 收盘价（数组或存储的内存映射列），只复制进共享内存一次
+    key: 数据版本标识（如 ohlc_store.dataset_version），同一版本复用共享内存；None 时按内容摘要
+    返回: (入选窗口索引, 对应距离, 统计 dict)，按距离升序
+    """
+    workers = workers or default_workers
+    request = ScanRequest(closes, target_start, length, top_n, min_gap, metric, band, key)
+    [(merged, counts, count)] = scan_series([request], workers, chunk_size, min_shard, progress)
+    size = chunk_size or chunk_windows(length, metric)
+    return chunked_search.finish(merged, counts, top_n, min_gap, metric,
+                                 {'chunk_windows': size, 'workers': workers, 'shards': count})
+
+
+def benchmark(bars=1_000_000, length=24, metric='dtw', top_n=200, max_workers=None, repeat=3, min_shard=None):
+    """
+    随机游走数据上 1..max_workers 个工作进程的扩展性：与串行分块搜索比对结果，
+    记录冷启动（新建进程池 + 第一次搜索）与常驻进程池上的耗时
+    """
+    from benchmark_suite import random_walk_columns
+    from find_similar_patterns import search_min_gap
+
+    max_workers = max_workers or os.cpu_count() or 1
+    closes = random_walk_columns(bars)['close']
+    target = bars // 3
+    min_gap = search_min_gap(length)
+    min_shard = min_shard or MIN_SHARD_WINDOWS
+    print(f"📏 {bars:,} 根 | {metric} | L={length} | top {top_n} | CPU {os.cpu_count()} 核")
+    t0 = time.perf_counter()
+    expected = chunked_search.chunked_search(closes, target, length, top_n, min_gap, metric)
+    serial = time.perf_counter() - t0
+    print(f"🧵 串行: {serial:.2f}s")
+    rows = []
+    for workers in range(1, max_workers + 1):
+        shutdown()
+        t0 = time.perf_counter()
+        indices, distances, stats = sharded_search(closes, target, length, top_n, min_gap, metric, workers=workers,
+                                                   min_shard=min_shard)
+        cold = time.perf_counter() - t0
+        assert (np.array_equal(indices, expected[0]) and np.array_equal(distances, expected[1])), \
+            "分片搜索结果与串行搜索不一致"
+        timings = []
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            sharded_search(closes, target, length, top_n, min_gap, metric, workers=workers, min_shard=min_shard)
+            timings.append(time.perf_counter() - t0)
+        warm = min(timings)
+        rows.append({'workers': workers, 'shards': stats['shards'], 'cold_s': cold, 'warm_s': warm,
+                     'speedup': serial / warm})
+        print(f"⚙️ {workers} 进程 | {stats['shards']} 片 | 冷启动 {cold:.2f}s | 常驻 {warm:.2f}s | "
+              f"相对串行 {serial / warm:.2f}x | 结果一致")
+    shutdown()
+    return {'serial_s': serial, 'rows': rows}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='多进程分片搜索的扩展性基准')
+    sub = parser.add_subparsers(dest='command', required=True)
+    bench = sub.add_parser('bench', help='1..N 个工作进程的耗时与结果比对')
+    bench.add_argument('--bars', type=int, default=1_000_000, help='合成数据的根数')
+    bench.add_argument('--length', type=int, default=24)
+    bench.add_argument('--metric', default='dtw', choices=CHUNKED_METRICS)
+    bench.add_argument('--max-workers', type=int, default=None, help='最多的工作进程数，默认 CPU 核数')
+    bench.add_argument('--repeat', type=int, default=3, help='常驻进程池上每种进程数重复的次数（取最快）')
+    bench.add_argument('--min-shard', type=int, default=MIN_SHARD_WINDOWS, help='每个分片至少的窗口数')
+    args = parser.parse_args()
+    benchmark(args.bars, args.length, args.metric, max_workers=args.max_workers, repeat=args.repeat,
+              min_shard=args.min_shard)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,405 @@
+"""
+相似走势预计算索引
+对每个可能的目标窗口预先算好 do_search 的答案（前 top_n 个互相间隔 ≥ min_gap 的最近邻窗口），
+按距离度量与模式长度分别保存在基础存储目录下的 index/<度量>_<长度>/ 中，点击图表时直接查表。
+
+追加新 K 线后，只需以每个新窗口为目标各算一次距离剖面（距离是对称的），就能判断哪些已有条目
+可能改变：新窗口排在某条目的最后一名之后、或被该条目中更近的结果挡掉时，贪心结果不变；
+其余条目标记为待更新，由 update 或下一次实际搜索到它时重新计算。
+基础存储被整体重写时索引随目录一起删除，需要重新构建
+"""
+import os
+import json
+import time
+import shutil
+import argparse
+import threading
+import numpy as np
+
+import ohlc_store
+from mass_engine import METRICS, DistanceProfiler
+from window_matrix import close_array, normalized_windows
+from find_similar_patterns import compute_distances, select_top, search_min_gap
+
+FORMAT_VERSION = 1
+# 默认建立索引的模式长度
+INDEX_LENGTHS = (12, 24, 48, 72, 168)
+# 默认度量：DTW 全量建索引需要对每个窗口做一次完整搜索（本数据上 168 长度约 7 秒 / 窗口），
+# 欧氏度量每个窗口只需毫秒级
+DEFAULT_METRIC = 'minmax_euclidean'
+TOP_N = 200
+# DTW 中结果完全一致、可以共用索引的引擎
+EXACT_ENGINES = ('pruned', 'batch')
+
+# 同一进程内对索引文件的写入串行化
+_write_lock = threading.Lock()
+
+
+def index_path(store_path, length, metric=DEFAULT_METRIC):
+    return os.path.join(store_path, 'index', f'{metric}_{length}')
+
+
+def _file(path, name):
+    return os.path.join(path, f'{name}.bin')
+
+
+def read_meta(path):
+    with open(os.path.join(path, 'meta.json'), 'r') as f:
+        return json.load(f)
+
+
+def _write_meta(path, meta):
+    tmp = os.path.join(path, 'meta.json.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(meta, f, indent=2)
+    os.replace(tmp, os.path.join(path, 'meta.json'))
+
+
+def open_index(path, mode='r'):
+    """
+    打开索引
+
+    返回: (meta, neighbors, distances, fresh)；neighbors / distances 为 (目标数, top_n) 的内存映射，
+    不足 top_n 个结果的位置为 -1 / inf，fresh[t] 为 0 表示该条目待更新
+    """
+    meta = read_meta(path)
+    shape = (meta['targets'], meta['top_n'])
+    neighbors = np.memmap(_file(path, 'neighbors'), dtype='<i4', mode=mode, shape=shape)
+    distances = np.memmap(_file(path, 'distances'), dtype='<f8', mode=mode, shape=shape)
+    fresh = np.memmap(_file(path, 'fresh'), dtype='u1', mode=mode, shape=(meta['targets'],))
+    return meta, neighbors, distances, fresh
+
+
+def _source_meta(series):
+    return {
+        'source_revision': series.meta.get('revision', 0),
+        'source_count': len(series),
+        'source_last': int(series.time[-1]) if len(series) else None,
+    }
+
+
+class _Searcher:
+    """对同一序列反复搜索不同目标，复用归一化窗口矩阵或距离剖面的预处理"""
+
+    def __init__(self, closes, length, metric, engine, band, top_n, min_gap):
+        self.closes = closes
+        self.length = length
+        self.metric = metric
+        self.engine = engine
+        self.band = band
+        self.top_n = top_n
+        self.min_gap = min_gap
+        self.windows = None
+        self.profiler = None
+        if metric in METRICS:
+            self.profiler = DistanceProfiler(closes, length, metric)
+        elif engine == 'pruned':
+            self.windows = normalized_windows(closes, length, 0, max(0, len(closes) - length))
+
+    def distances(self, target, engine=None):
+        distances, _, _ = compute_distances(self.closes, target, self.length, self.top_n, self.min_gap,
+                                            engine or self.engine, self.band, self.metric,
+                                            windows=self.windows, profiler=self.profiler)
+        return distances
+
+    def row(self, target):
+        """目标的搜索结果，补齐到 top_n 的 (索引, 距离)"""
+        distances = self.distances(target)
+        kept = select_top(distances, self.top_n, self.min_gap)
+        neighbors = np.full(self.top_n, -1, dtype='<i4')
+        values = np.full(self.top_n, np.inf)
+        neighbors[:len(kept)] = kept
+        values[:len(kept)] = distances[kept]
+        return neighbors, values
+
+    def exact_profile(self, target):
+        """以 target 为目标对所有窗口的精确距离（DTW 不剪枝）"""
+        return self.distances(target, engine='batch' if self.metric == 'dtw' else None)
+
+
+def build_index(store_path=ohlc_store.DEFAULT_STORE, length=24, metric=DEFAULT_METRIC, engine='pruned',
+                band=None, top_n=TOP_N, verbose=True):
+    """为所有目标窗口计算搜索结果并写入索引（先写临时目录再替换）"""
+    series = ohlc_store.open_store(store_path)
+    closes = close_array(series)
+    min_gap = search_min_gap(length)
+    targets = max(0, len(series) - length + 1)
+    searcher = _Searcher(closes, length, metric, engine, band, top_n, min_gap)
+
+    path = index_path(store_path, length, metric)
+    tmp = f'{path}.tmp-{os.getpid()}'
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    neighbors = np.memmap(_file(tmp, 'neighbors'), dtype='<i4', mode='w+', shape=(max(targets, 1), top_n))
+    distances = np.memmap(_file(tmp, 'distances'), dtype='<f8', mode='w+', shape=(max(targets, 1), top_n))
+    t0 = time.perf_counter()
+    step = max(1, targets // 10)
+    for target in range(targets):
+        neighbors[target], distances[target] = searcher.row(target)
+        if verbose and (target + 1) % step == 0:
+            print(f"⏳ {metric} L={length}: {target + 1}/{targets} ({time.perf_counter() - t0:.0f}s)")
+    neighbors.flush()
+    distances.flush()
+    del neighbors, distances
+    np.ones(targets, dtype='u1').tofile(_file(tmp, 'fresh'))
+    _write_meta(tmp, {
+        'version': FORMAT_VERSION,
+        'length': length,
+        'metric': metric,
+        'engine': engine if metric == 'dtw' else 'mass',
+        'band': band,
+        'top_n': top_n,
+        'min_gap': min_gap,
+        'targets': targets,
+        'updated': int(time.time()),
+        **_source_meta(series),
+    })
+
+    old = f'{path}.old-{os.getpid()}'
+    if os.path.exists(path):
+        os.replace(path, old)
+    os.replace(tmp, path)
+    shutil.rmtree(old, ignore_errors=True)
+    if verbose:
+        print(f"💾 索引 {path}: {targets} 个目标, 耗时 {time.perf_counter() - t0:.1f}s")
+    return path
+
+
+def _extend(path, meta, targets):
+    """把索引扩展到 targets 个目标，新条目为空且待更新"""
+    top_n = meta['top_n']
+    extra = targets - meta['targets']
+    with open(_file(path, 'neighbors'), 'ab') as f:
+        f.write(np.full((extra, top_n), -1, dtype='<i4').tobytes())
+    with open(_file(path, 'distances'), 'ab') as f:
+        f.write(np.full((extra, top_n), np.inf).tobytes())
+    with open(_file(path, 'fresh'), 'ab') as f:
+        f.write(np.zeros(extra, dtype='u1').tobytes())
+    meta['targets'] = targets
+
+
+def update_index(store_path=ohlc_store.DEFAULT_STORE, length=24, metric=DEFAULT_METRIC, refresh=True,
+                 rebuild=True, verbose=True):
+    """
+    把索引同步到当前数据
+
+    - 只发生过追加：新窗口各算一次距离剖面，标记可能改变的条目，新目标加入为待更新
+    - 其他改变（或索引不存在）：整体重建；rebuild=False 时保持原样（查询不会命中过期的索引）
+    refresh: 是否立即重新计算所有待更新的条目
+
+    返回: {'mode': 'fresh' / 'incremental' / 'rebuild' / 'stale', 'dirty': 待更新条目数, 'refreshed': 重新计算数}
+    """
+    path = index_path(store_path, length, metric)
+    series = ohlc_store.open_store(store_path)
+    if not os.path.exists(path):
+        build_index(store_path, length, metric, verbose=verbose)
+        return {'mode': 'rebuild', 'dirty': 0, 'refreshed': 0}
+
+    meta = read_meta(path)
+    mode = 'fresh'
+    if meta['source_revision'] != series.meta.get('revision', 0):
+        old_count = meta['source_count']
+        if old_count < length or series.locate(end=meta['source_last'])[1] != old_count:
+            if not rebuild:
+                return {'mode': 'stale', 'dirty': meta['targets'], 'refreshed': 0}
+            build_index(store_path, length, metric, meta['engine'], meta['band'], meta['top_n'], verbose)
+            return {'mode': 'rebuild', 'dirty': 0, 'refreshed': 0}
+        mode = 'incremental'
+        with _write_lock:
+            _mark_appended(path, meta, series)
+
+    refreshed = refresh_index(store_path, length, metric, verbose=verbose) if refresh else 0
+    _, _, _, fresh = open_index(path)
+    return {'mode': mode, 'dirty': int((fresh == 0).sum()), 'refreshed': refreshed}
+
+
+def _mark_appended(path, meta, series):
+    """数据从 source_count 行追加到当前行数后，标记受影响的条目并加入新目标"""
+    length, min_gap = meta['length'], meta['min_gap']
+    old_count, new_count = meta['source_count'], len(series)
+    old_targets = meta['targets']
+    new_targets = max(0, new_count - length + 1)
+    if new_targets > old_targets:
+        _extend(path, meta, new_targets)
+    meta.update(_source_meta(series), updated=int(time.time()))
+
+    closes = close_array(series)
+    searcher = _Searcher(closes, length, meta['metric'], meta['engine'], meta['band'], meta['top_n'], min_gap)
+    _, neighbors, distances, fresh = open_index(path, mode='r+')
+    # 原来的最后一个目标包含原来的最后一根 K 线，它可能被覆盖更新过
+    if old_targets:
+        fresh[old_targets - 1] = 0
+    last = distances[:old_targets, -1]
+    full = neighbors[:old_targets, -1] >= 0
+    valid = neighbors[:old_targets] >= 0
+    # 原来的候选窗口是 [0, old_count - L)，新增的候选窗口是 [old_count - L, new_count - L)
+    for candidate in range(max(0, old_count - length), max(0, new_count - length)):
+        profile = searcher.exact_profile(candidate)[:old_targets]
+        eligible = np.isfinite(profile)
+        # 排在已满条目的最后一名之后：贪心在遇到它之前已经结束
+        after_last = full & (profile >= last)
+        # 被条目中间隔不足 min_gap、距离不大于它的结果挡掉
+        blocked = (valid & (np.abs(neighbors[:old_targets] - candidate) < min_gap)
+                   & (distances[:old_targets] <= profile[:, None])).any(axis=1)
+        fresh[:old_targets][eligible & ~after_last & ~blocked] = 0
+    fresh.flush()
+    _write_meta(path, meta)
+
+
+def refresh_index(store_path=ohlc_store.DEFAULT_STORE, length=24, metric=DEFAULT_METRIC, verbose=True):
+    """重新计算所有待更新的条目，返回条目数"""
+    path = index_path(store_path, length, metric)
+    series = ohlc_store.open_store(store_path)
+    with _write_lock:
+        meta, neighbors, distances, fresh = open_index(path, mode='r+')
+        if meta['source_revision'] != series.meta.get('revision', 0):
+            return 0
+        dirty = np.flatnonzero(fresh == 0)
+        if len(dirty) == 0:
+            return 0
+        searcher = _Searcher(close_array(series), length, metric, meta['engine'], meta['band'],
+                             meta['top_n'], meta['min_gap'])
+        for target in dirty.tolist():
+            neighbors[target], distances[target] = searcher.row(target)
+            fresh[target] = 1
+        neighbors.flush()
+        distances.flush()
+        fresh.flush()
+    if verbose:
+        print(f"🔄 {metric} L={length}: 重新计算 {len(dirty)} 个条目")
+    return len(dirty)
+
+
+def _compatible(meta, series, top_n, min_gap, engine, metric, band):
+    if meta['metric'] != metric or meta['min_gap'] != min_gap or meta['source_revision'] != series.meta.get('revision', 0):
+        return False
+    if meta['source_count'] != len(series):
+        return False
+    if metric == 'dtw' and (engine not in EXACT_ENGINES or meta['engine'] not in EXACT_ENGINES or meta['band'] != band):
+        return False
+    return True
+
+
+def lookup(series, target_start, length, top_n, min_gap, engine='pruned', metric='dtw', band=None):
+    """
+    查索引
+
+    返回: (索引列表, 距离列表)；没有可用索引、条目待更新或 top_n 超出索引容量时返回 None
+    """
+    if getattr(series, 'path', None) is None:
+        return None
+    path = index_path(series.path, length, metric)
+    if not os.path.exists(os.path.join(path, 'meta.json')):
+        return None
+    meta, neighbors, distances, fresh = open_index(path)
+    if not _compatible(meta, series, top_n, min_gap, engine, metric, band) or not 0 <= target_start < meta['targets']:
+        return None
+    if not fresh[target_start]:
+        return None
+    row = np.asarray(neighbors[target_start])
+    count = int((row >= 0).sum())
+    # 贪心结果的前缀性质：前 k 个就是 top_n=k 时的答案；索引条目不足 top_n 个说明已经取尽
+    if top_n > meta['top_n'] and count == meta['top_n']:
+        return None
+    count = min(count, top_n)
+    return row[:count].tolist(), np.asarray(distances[target_start][:count]).tolist()
+
+
+def remember(series, target_start, length, top_n, min_gap, engine, metric, band, indices, values):
+    """把一次实际搜索的结果写回索引中待更新的条目"""
+    if getattr(series, 'path', None) is None:
+        return False
+    path = index_path(series.path, length, metric)
+    if not os.path.exists(os.path.join(path, 'meta.json')):
+        return False
+    with _write_lock:
+        meta, neighbors, distances, fresh = open_index(path, mode='r+')
+        if not _compatible(meta, series, top_n, min_gap, engine, metric, band) or not 0 <= target_start < meta['targets']:
+            return False
+        if fresh[target_start]:
+            return False
+        # 结果不少于索引容量，或不足 top_n 个（已经取尽）时才是完整的条目
+        if top_n < meta['top_n'] and len(indices) == top_n:
+            return False
+        keep = min(len(indices), meta['top_n'])
+        neighbors[target_start] = -1
+        distances[target_start] = np.inf
+        neighbors[target_start, :keep] = indices[:keep]
+        distances[target_start, :keep] = values[:keep]
+        neighbors.flush()
+        distances.flush()
+        fresh[target_start] = 1
+        fresh.flush()
+    return True
+
+
+def update_all(store_path=ohlc_store.DEFAULT_STORE, refresh=False):
+    """
+    同步基础存储下所有已建立的索引（供增量同步在写入新 K 线后调用）
+    只处理追加；数据被改写时不在同步流程中重建，需要手动执行 build
+    """
+    root = os.path.join(store_path, 'index')
+    if not os.path.isdir(root):
+        return {}
+    status = {}
+    for name in sorted(os.listdir(root)):
+        if not os.path.exists(os.path.join(root, name, 'meta.json')):
+            continue
+        meta = read_meta(os.path.join(root, name))
+        status[name] = update_index(store_path, meta['length'], meta['metric'], refresh, rebuild=False,
+                                    verbose=False)
+    return status
+
+
+def benchmark(store_path=ohlc_store.DEFAULT_STORE, length=24, metric=DEFAULT_METRIC, samples=20, seed=0):
+    """查索引与实时搜索的耗时对比（索引需已建立）"""
+    import io
+    import contextlib
+    from find_similar_patterns import build_search_output
+
+    series = ohlc_store.open_store(store_path)
+    rng = np.random.default_rng(seed)
+    targets = rng.integers(0, len(series) - length, samples).tolist()
+    timings = {'index': [], 'live': []}
+    for target in targets:
+        for mode in ('index', 'live'):
+            report = {}
+            t0 = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                build_search_output(series, target, length, TOP_N, metric=metric, report=report,
+                                    use_index=(mode == 'index'))
+            timings[mode].append(time.perf_counter() - t0)
+    for mode, values in timings.items():
+        print(f"⏱️ {mode}: 中位 {np.median(values) * 1000:.1f} ms | 最慢 {max(values) * 1000:.1f} ms")
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description='相似走势预计算索引')
+    parser.add_argument('command', choices=['build', 'update', 'info', 'bench'])
+    parser.add_argument('--store', default=ohlc_store.DEFAULT_STORE, help='基础存储目录')
+    parser.add_argument('--lengths', type=int, nargs='+', default=list(INDEX_LENGTHS), help='建立索引的模式长度')
+    parser.add_argument('--metric', default=DEFAULT_METRIC, choices=('dtw',) + METRICS, help='距离度量')
+    parser.add_argument('--no-refresh', action='store_true', help='update 时只标记待更新条目，不立即重算')
+    args = parser.parse_args()
+
+    for length in args.lengths:
+        if args.command == 'build':
+            build_index(args.store, length, args.metric)
+        elif args.command == 'update':
+            status = update_index(args.store, length, args.metric, refresh=not args.no_refresh)
+            print(f"🔄 {args.metric} L={length}: {json.dumps(status, ensure_ascii=False)}")
+        elif args.command == 'info':
+            path = index_path(args.store, length, args.metric)
+            if not os.path.exists(path):
+                print(f"{args.metric} L={length}: 未建立")
+                continue
+            meta, _, _, fresh = open_index(path)
+            print(f"{args.metric} L={length}: {meta['targets']} 个目标, 待更新 {int((fresh == 0).sum())}, "
+                  f"数据 revision {meta['source_revision']}")
+        else:
+            benchmark(args.store, length, args.metric)
+
+
+if __name__ == "__main__":
+    main()
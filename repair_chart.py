@@ -1,53 +1,11 @@
 import json
 import os
+import ohlc_store
 
-def regenerate_html():
-    """
-    重新从数据文件生成整个 HTML 页面。
-    智能看板版：根据涨跌胜率大小，自动显示占优的情绪概率。
-    """
-    data_path = 'btc_1h_ohlc.json'
-    sim_path = 'similarity_results.json'
-    
-    if not os.path.exists(data_path):
-        print(f"❌ 找不到数据文件: {data_path}")
-        return
-        
-    with open(data_path, 'r') as f:
-        ohlc_data = json.load(f)
-        
-    sim_meta = {'target_time': 0, 'target_date': '实时数据', 'pattern_length': 24, 'stats': {}, 'results': []}
-    if os.path.exists(sim_path):
-        with open(sim_path, 'r') as f:
-            sim_meta = json.load(f)
-
-    stats = sim_meta.get('stats', {})
-    win_rate = stats.get('win_rate', 0)
-    avg_return = stats.get('avg_return', 0)
-    max_up = stats.get('max_up', 0)
-    max_down = stats.get('max_down', 0)
-    
-    target_date = sim_meta.get('target_date', '实时数据')
-    pattern_length = sim_meta.get('pattern_length', 24)
-
-    # --- 智能情绪逻辑 ---
-    loss_rate = round(100 - win_rate, 2)
-    if win_rate >= 50:
-        sentiment_label = "历史上涨概率 (看多趋势)"
-        sentiment_value = win_rate
-        sentiment_color = "#f7931a" # 橙色
-        sentiment_gradient = "linear-gradient(90deg, #f7931a, #ffb347)"
-    else:
-        sentiment_label = "历史下跌概率 (看空趋势)"
-        sentiment_value = loss_rate
-        sentiment_color = "#ef5350" # 红色
-        sentiment_gradient = "linear-gradient(90deg, #ef5350, #ff5252)"
-
-    avg_return_str = f"{'+' if avg_return > 0 else ''}{avg_return}%"
-    avg_color = "green" if avg_return >= 0 else "red"
-
-    # 生成 HTML
-    html = f'''<!DOCTYPE html>
+# 页面模板：K 线与搜索结果都由前端渲染。
+# 服务器模式下 BOOT 为 null，页面通过 /api/ohlc 分段加载 K 线、通过 /api/results 获取结果；
+# 离线模式（Streamlit / 直接打开文件）下 BOOT 内嵌全部数据，行为与以前一致
+PAGE_TEMPLATE = '''<!DOCTYPE html>
 <html lang="zh-CN">
 <head>
     <meta charset="UTF-8">
@@ -55,113 +13,120 @@ def regenerate_html():
     <title>Bitcoin 智能对比系统 - 占优情绪版</title>
     <script src="https://unpkg.com/lightweight-charts@4.1.0/dist/lightweight-charts.standalone.production.js"></script>
     <style>
-        * {{ margin: 0; padding: 0; box-sizing: border-box; }}
-        body {{
+        * { margin: 0; padding: 0; box-sizing: border-box; }
+        body {
             font-family: 'Segoe UI', Tahoma, sans-serif;
             background: linear-gradient(135deg, #1a1a2e, #16213e, #0f3460);
             min-height: 100vh;
             color: #fff;
-        }}
-        .container {{ max-width: 1400px; margin: 0 auto; padding: 20px; }}
-        header {{ text-align: center; padding: 10px 0; display: flex; justify-content: space-between; align-items: center; border-bottom: 1px solid rgba(255,255,255,0.1); margin-bottom: 20px; }}
-        h1 {{ font-size: 1.8rem; background: linear-gradient(90deg, #f7931a, #ffb347); -webkit-background-clip: text; -webkit-text-fill-color: transparent; background-clip: text; }}
+        }
+        .container { max-width: 1400px; margin: 0 auto; padding: 20px; }
+        header { text-align: center; padding: 10px 0; display: flex; justify-content: space-between; align-items: center; border-bottom: 1px solid rgba(255,255,255,0.1); margin-bottom: 20px; }
+        h1 { font-size: 1.8rem; background: linear-gradient(90deg, #f7931a, #ffb347); -webkit-background-clip: text; -webkit-text-fill-color: transparent; background-clip: text; }
         
-        .toolbar {{ display: flex; gap: 10px; align-items: center; }}
-        .btn {{ 
+        .toolbar { display: flex; gap: 10px; align-items: center; }
+        .btn { 
             padding: 8px 16px; border-radius: 8px; border: 1px solid #f7931a; background: transparent; 
             color: #f7931a; font-weight: bold; cursor: pointer; transition: 0.3s; font-size: 0.9rem;
-        }}
-        .btn:hover {{ background: rgba(247, 147, 26, 0.1); }}
-        .btn.active {{ background: #f7931a; color: #000; }}
+        }
+        .btn:hover { background: rgba(247, 147, 26, 0.1); }
+        .btn.active { background: #f7931a; color: #000; }
+        select.btn option { background: #16213e; color: #fff; }
         
-        .info-box {{ 
+        .info-box { 
             background: rgba(38, 166, 154, 0.1); 
             border: 1px solid rgba(38, 166, 154, 0.3); 
             border-radius: 8px; padding: 10px; margin-bottom: 20px; text-align: center; font-size: 0.85rem;
-        }}
+        }
 
         /* 统计看板 */
-        .dashboard {{
+        .dashboard {
             display: grid;
             grid-template-columns: repeat(auto-fit, minmax(200px, 1fr));
             gap: 15px;
             margin-bottom: 20px;
-        }}
-        .dash-card {{
+        }
+        .dash-card {
             background: rgba(255, 255, 255, 0.05); border-radius: 12px; padding: 15px; border: 1px solid rgba(255, 255, 255, 0.1); text-align: center;
-        }}
-        .dash-label {{ color: #aaa; font-size: 0.8rem; margin-bottom: 5px; }}
-        .dash-value {{ font-size: 1.5rem; font-weight: bold; }}
+        }
+        .dash-label { color: #aaa; font-size: 0.8rem; margin-bottom: 5px; }
+        .dash-value { font-size: 1.5rem; font-weight: bold; }
         
-        .progress-container {{ width: 100%; background: rgba(255,255,255,0.1); border-radius: 10px; height: 8px; margin-top: 8px; overflow: hidden; }}
-        .progress-bar {{ height: 100%; background: {sentiment_gradient}; transition: 1s ease-out; }}
+        .progress-container { width: 100%; background: rgba(255,255,255,0.1); border-radius: 10px; height: 8px; margin-top: 8px; overflow: hidden; }
+        .progress-bar { height: 100%; background: linear-gradient(90deg, #f7931a, #ffb347); transition: 1s ease-out; }
 
-        .chart-container {{ background: rgba(22, 33, 62, 0.8); border-radius: 16px; padding: 20px; box-shadow: 0 8px 32px rgba(0, 0, 0, 0.3); border: 1px solid rgba(255, 255, 255, 0.1); margin-bottom: 20px; position: relative; }}
-        #chart {{ width: 100%; height: 500px; }}
+        .chart-container { background: rgba(22, 33, 62, 0.8); border-radius: 16px; padding: 20px; box-shadow: 0 8px 32px rgba(0, 0, 0, 0.3); border: 1px solid rgba(255, 255, 255, 0.1); margin-bottom: 20px; position: relative; }
+        #chart { width: 100%; height: 500px; }
         
-        #selection-tip {{
+        #selection-tip {
             position: absolute; top: 10px; right: 10px; z-index: 20;
             background: rgba(247, 147, 26, 0.9); color: #000; padding: 8px 15px; border-radius: 5px;
             font-weight: bold; font-size: 0.85rem; display: none; pointer-events: none;
-        }}
+        }
 
-        .legend {{ position: absolute; top: 30px; left: 30px; z-index: 10; background: rgba(0, 0, 0, 0.6); padding: 10px; border-radius: 8px; font-size: 0.75rem; }}
-        .legend-item {{ display: flex; align-items: center; margin-bottom: 4px; }}
-        .legend-color {{ width: 10px; height: 10px; border-radius: 2px; margin-right: 8px; }}
+        .legend { position: absolute; top: 30px; left: 30px; z-index: 10; background: rgba(0, 0, 0, 0.6); padding: 10px; border-radius: 8px; font-size: 0.75rem; }
+        .legend-item { display: flex; align-items: center; margin-bottom: 4px; }
+        .legend-color { width: 10px; height: 10px; border-radius: 2px; margin-right: 8px; }
 
-        .similarity-panel {{ background: rgba(22, 33, 62, 0.8); border-radius: 16px; padding: 20px; border: 1px solid rgba(255, 255, 255, 0.1); }}
-        .similarity-list {{ 
+        .similarity-panel { background: rgba(22, 33, 62, 0.8); border-radius: 16px; padding: 20px; border: 1px solid rgba(255, 255, 255, 0.1); }
+        .similarity-list { 
             display: grid; grid-template-columns: repeat(auto-fill, minmax(180px, 1fr)); gap: 12px; margin-top: 15px; max-height: 400px; overflow-y: auto; padding-right: 5px;
-        }}
-        .similarity-item {{ background: rgba(255, 255, 255, 0.03); border-radius: 10px; padding: 10px; border: 1px solid rgba(255, 255, 255, 0.1); cursor: pointer; transition: 0.2s; position: relative; }}
-        .similarity-item:hover {{ border-color: #f7931a; background: rgba(247, 147, 26, 0.1); }}
-        .similarity-item.active {{ border-color: #f7931a; background: rgba(247, 147, 26, 0.2); }}
-        .sim-date {{ color: #f7931a; font-weight: bold; font-size: 0.75rem; }}
+        }
+        .similarity-item { background: rgba(255, 255, 255, 0.03); border-radius: 10px; padding: 10px; border: 1px solid rgba(255, 255, 255, 0.1); cursor: pointer; transition: 0.2s; position: relative; }
+        .similarity-item:hover { border-color: #f7931a; background: rgba(247, 147, 26, 0.1); }
+        .similarity-item.active { border-color: #f7931a; background: rgba(247, 147, 26, 0.2); }
+        .sim-date { color: #f7931a; font-weight: bold; font-size: 0.75rem; }
         
-        .loading-overlay {{ 
+        .loading-overlay { 
             position: fixed; top: 0; left: 0; width: 100%; height: 100%; 
             background: rgba(0,0,0,0.7); display: none; justify-content: center; align-items: center; z-index: 999;
             flex-direction: column; gap: 15px;
-        }}
-        .spinner {{ width: 50px; height: 50px; border: 5px solid #f7931a55; border-top: 5px solid #f7931a; border-radius: 50%; animation: spin 1s linear infinite; }}
-        @keyframes spin {{ 0% {{ transform: rotate(0deg); }} 100% {{ transform: rotate(360deg); }} }}
+        }
+        .spinner { width: 50px; height: 50px; border: 5px solid #f7931a55; border-top: 5px solid #f7931a; border-radius: 50%; animation: spin 1s linear infinite; }
+        @keyframes spin { 0% { transform: rotate(0deg); } 100% { transform: rotate(360deg); } }
 
-        .green {{ color: #26a69a; }} .red {{ color: #ef5350; }} .orange {{ color: #f7931a; }}
+        .green { color: #26a69a; } .red { color: #ef5350; } .orange { color: #f7931a; }
     </style>
 </head>
 <body>
     <div class="loading-overlay" id="loading">
         <div class="spinner"></div>
-        <div style="font-weight:bold; color:#f7931a">🧠 正在进行 DTW 全量历史搜索...</div>
+        <div style="font-weight:bold; color:#f7931a" id="loading-text">🧠 正在进行 DTW 全量历史搜索...</div>
     </div>
 
     <div class="container">
         <header>
             <h1>₿ Bitcoin 智能对比系统</h1>
             <div class="toolbar">
+                <select class="btn" id="metric" title="距离度量">
+                    <option value="dtw">DTW (时间弯曲)</option>
+                    <option value="minmax_euclidean">欧氏距离 (min-max)</option>
+                    <option value="znorm_euclidean">欧氏距离 (z-score)</option>
+                    <option value="mdtw_dependent">多通道 DTW (收盘价 + 收益率 + 振幅)</option>
+                </select>
                 <button class="btn" id="btn-select">🖱️ 画面点选范围</button>
                 <button class="btn" onclick="location.reload()">🔄 刷新数据</button>
             </div>
         </header>
-        
+
         <div class="info-box">
-            🎯 当前基准：<strong>{target_date}</strong> | 周期：<strong>{pattern_length}h</strong>
+            🎯 当前基准：<strong id="target-date">实时数据</strong> | 周期：<strong id="target-length">24h</strong>
         </div>
 
         <div class="dashboard">
             <div class="dash-card">
-                <div class="dash-label">{sentiment_label}</div>
-                <div class="dash-value" style="color: {sentiment_color}">{sentiment_value}%</div>
-                <div class="progress-container"><div class="progress-bar" style="width: {sentiment_value}%"></div></div>
+                <div class="dash-label" id="sentiment-label">历史上涨概率 (看多趋势)</div>
+                <div class="dash-value" id="sentiment-value">0%</div>
+                <div class="progress-container"><div class="progress-bar" id="sentiment-bar" style="width: 0%"></div></div>
             </div>
             <div class="dash-card">
                 <div class="dash-label">平均预期回报</div>
-                <div class="dash-value {avg_color}">{avg_return_str}</div>
+                <div class="dash-value" id="avg-return">0%</div>
             </div>
             <div class="dash-card">
                 <div class="dash-label">波动极限 (跌~涨)</div>
                 <div style="display: flex; justify-content: space-around; font-size: 1.1rem; font-weight:bold; margin-top:5px">
-                    <span class="red">{max_down}%</span> ··· <span class="green">{max_up}%</span>
+                    <span class="red" id="max-down">0%</span> ··· <span class="green" id="max-up">0%</span>
                 </div>
             </div>
         </div>
@@ -170,93 +135,321 @@ def regenerate_html():
             <div id="selection-tip">请选择一个起点蜡烛...</div>
             <div id="chart"></div>
         </div>
-        
+
         <div class="similarity-panel">
-            <h3>🔍 相似剧本列表 ({len(sim_meta['results'])} 项)</h3>
+            <h3 id="sim-title">🔍 相似剧本列表 (0 项)</h3>
             <div class="similarity-list" id="sim-list"></div>
         </div>
     </div>
-    
+
     <script>
-        const ohlcData = {json.dumps(ohlc_data)};
-        const simMeta = {json.dumps(sim_meta)};
-        const similarityData = simMeta.results;
-        const targetTime = simMeta.target_time;
-        const patternLength = simMeta.pattern_length || 24;
-
-        const chart = LightweightCharts.createChart(document.getElementById('chart'), {{
-            layout: {{ background: {{ color: 'transparent' }}, textColor: '#DDD' }},
-            grid: {{ vertLines: {{ color: 'rgba(255,255,255,0.05)' }}, horzLines: {{ color: 'rgba(255,255,255,0.05)' }} }},
-            timeScale: {{ timeVisible: true, borderColor: '#444' }},
-            rightPriceScale: {{ borderColor: '#444' }}
-        }});
-
-        const candleSeries = chart.addCandlestickSeries({{
+        const BOOT = @@BOOT@@;
+        const API = BOOT === null;
+        // 首屏请求的 K 线根数，以及之后每次按可见范围取数的点数预算
+        const PAGE_SIZE = 2000;
+        const POINTS = 3000;
+        // 基础周期（秒）：服务器模式下取 /api/ohlc 各级分辨率中最细的一级，离线模式按前两根的时间差
+        let STEP = 3600;
+
+        let ohlcData = [];
+        let simMeta = {target_time: 0, target_date: '实时数据', pattern_length: 24, stats: {}, results: []};
+        let targetOpen = null;
+        // 已加载的范围与分辨率 {from, to, span, first, last, interval}
+        let view = null;
+        let viewTimer = null;
+
+        const chart = LightweightCharts.createChart(document.getElementById('chart'), {
+            layout: { background: { color: 'transparent' }, textColor: '#DDD' },
+            grid: { vertLines: { color: 'rgba(255,255,255,0.05)' }, horzLines: { color: 'rgba(255,255,255,0.05)' } },
+            timeScale: { timeVisible: true, borderColor: '#444' },
+            rightPriceScale: { borderColor: '#444' }
+        });
+
+        const candleSeries = chart.addCandlestickSeries({
             upColor: '#26a69a', downColor: '#ef5350', borderVisible: false,
             wickUpColor: '#26a69a', wickDownColor: '#ef5350'
-        }});
-        candleSeries.setData(ohlcData);
+        });
 
-        const ghostSeries = chart.addCandlestickSeries({{
+        const ghostSeries = chart.addCandlestickSeries({
             upColor: 'rgba(247, 147, 26, 0.6)', downColor: 'rgba(255, 255, 255, 0.2)',
             borderVisible: true, borderColor: '#f7931a', wickUpColor: '#f7931a', wickDownColor: '#f7931a',
             priceLineVisible: false, lastValueVisible: false,
-        }});
-        const futureLineSeries = chart.addLineSeries({{ color: '#2196F3', lineWidth: 3, lineStyle: 2, priceLineVisible: false }});
+        });
+        const futureLineSeries = chart.addLineSeries({ color: '#2196F3', lineWidth: 3, lineStyle: 2, priceLineVisible: false });
 
         let selectionMode = false;
         let selectStartTime = null;
         const tipEl = document.getElementById('selection-tip');
         const loadEl = document.getElementById('loading');
+        const progressEl = document.getElementById('loading-text');
+
+        // ---- 数据获取 ----
+        // /api/ohlc 返回列式数据 {t, o, h, l, c}，这里还原成图表需要的蜡烛对象
+        function fetchOhlc(params) {
+            return fetch('/api/ohlc?' + new URLSearchParams(params)).then(r => r.json());
+        }
+
+        function toCandles(p) {
+            return p.t.map((t, i) => ({ time: t, open: p.o[i], high: p.h[i], low: p.l[i], close: p.c[i] }));
+        }
+
+        function fetchCandles(params) {
+            return fetchOhlc(params).then(toCandles);
+        }
+
+        // 以可见范围为中心、两侧各多取一个跨度；分辨率（1h / 4h / 1d / 1w）由服务器按点数预算选择
+        function loadView(range) {
+            const span = Math.max(range.to - range.from, STEP);
+            const from = Math.floor(range.from - span), to = Math.ceil(range.to + span);
+            fetchOhlc({ from: from, to: to, points: POINTS }).then(p => {
+                view = { from: from, to: to, span: span, first: p.first, last: p.last, interval: p.interval };
+                ohlcData = toCandles(p);
+                candleSeries.setData(ohlcData);
+                chart.timeScale().setVisibleRange(range);
+            });
+        }
+
+        // 缩放超过 2 倍或接近已加载数据的边缘时重新取数
+        function onVisibleRangeChange(range) {
+            if (!range || !view) return;
+            clearTimeout(viewTimer);
+            viewTimer = setTimeout(() => {
+                const span = range.to - range.from;
+                if (view.span === null) view.span = span;
+                const zoomed = span > view.span * 2 || span < view.span / 2;
+                const nearLeft = range.from - span / 4 < view.from && view.from > view.first;
+                const nearRight = range.to + span / 4 > view.to && view.to < view.last;
+                if (zoomed || nearLeft || nearRight) loadView(range);
+            }, 150);
+        }
+
+        // 相似片段：离线模式下结果自带 ohlc，服务器模式下按需从 /api/ohlc 获取
+        function loadSegment(item) {
+            if (item.ohlc) return Promise.resolve(item.ohlc);
+            const length = simMeta.pattern_length || 24;
+            return fetchCandles({ from: item.time, limit: length + Math.max(24, length) });
+        }
+
+        function loadTargetOpen() {
+            const local = ohlcData.find(d => d.time === simMeta.target_time);
+            if (local || !API) return Promise.resolve(local ? local.open : null);
+            return fetchCandles({ from: simMeta.target_time, limit: 1 }).then(c => c.length ? c[0].open : null);
+        }
+
+        // ---- 看板与列表 ----
+        function renderMeta(meta) {
+            simMeta = meta;
+            const stats = meta.stats || {};
+            const winRate = stats.win_rate || 0;
+            const avgReturn = stats.avg_return || 0;
+            const patternLength = meta.pattern_length || 24;
+
+            document.getElementById('target-date').innerText = meta.target_date || '实时数据';
+            document.getElementById('target-length').innerText = patternLength + 'h';
+
+            // --- 智能情绪逻辑 ---
+            const bullish = winRate >= 50;
+            const sentimentValue = bullish ? winRate : Math.round((100 - winRate) * 100) / 100;
+            const sentimentColor = bullish ? '#f7931a' : '#ef5350';
+            document.getElementById('sentiment-label').innerText = bullish ? '历史上涨概率 (看多趋势)' : '历史下跌概率 (看空趋势)';
+            const valueEl = document.getElementById('sentiment-value');
+            valueEl.innerText = sentimentValue + '%';
+            valueEl.style.color = sentimentColor;
+            const barEl = document.getElementById('sentiment-bar');
+            barEl.style.width = sentimentValue + '%';
+            barEl.style.background = bullish ? 'linear-gradient(90deg, #f7931a, #ffb347)' : 'linear-gradient(90deg, #ef5350, #ff5252)';
+
+            const avgEl = document.getElementById('avg-return');
+            avgEl.innerText = `${avgReturn > 0 ? '+' : ''}${avgReturn}%`;
+            avgEl.className = 'dash-value ' + (avgReturn >= 0 ? 'green' : 'red');
+            document.getElementById('max-down').innerText = (stats.max_down || 0) + '%';
+            document.getElementById('max-up').innerText = (stats.max_up || 0) + '%';
+
+            const results = meta.results || [];
+            document.getElementById('sim-title').innerText = `🔍 相似剧本列表 (${results.length} 项)`;
+            const listEl = document.getElementById('sim-list');
+            listEl.innerHTML = '';
+            ghostSeries.setData([]);
+            futureLineSeries.setData([]);
+            targetOpen = null;
+
+            results.forEach(item => {
+                const div = document.createElement('div');
+                div.className = 'similarity-item';
+                div.innerHTML = `<div class="sim-date">${item.date}</div><div style="font-size:0.65rem">相似度: ${Math.max(0, 100-item.distance*10).toFixed(1)}% | 后果: ${item.future_change>0?'+':''}${item.future_change.toFixed(2)}%</div>`;
+                div.onclick = () => showGhost(item);
+                listEl.appendChild(div);
+            });
+        }
 
-        document.getElementById('btn-select').onclick = () => {{
+        function showGhost(item) {
+            const patternLength = simMeta.pattern_length || 24;
+            const ready = targetOpen === null ? loadTargetOpen().then(v => { targetOpen = v; }) : Promise.resolve();
+            Promise.all([loadSegment(item), ready]).then(([segment]) => {
+                if (targetOpen === null || !segment.length) return;
+                const offset = targetOpen - segment[0].open;
+                const ghostData = segment.map((h, i) => ({
+                    time: simMeta.target_time + i * STEP,
+                    open: h.open + offset, high: h.high + offset, low: h.low + offset, close: h.close + offset
+                }));
+                ghostSeries.setData(ghostData.slice(0, patternLength));
+                futureLineSeries.setData(ghostData.map(d => ({ time: d.time, value: d.close })));
+            });
+        }
+
+        // ---- 选区与搜索 ----
+        document.getElementById('btn-select').onclick = () => {
             selectionMode = !selectionMode;
             document.getElementById('btn-select').classList.toggle('active', selectionMode);
             tipEl.style.display = selectionMode ? 'block' : 'none';
             selectStartTime = null;
             tipEl.innerText = "请点击图表上的一根蜡烛作为【起点】";
-        }};
+        };
 
-        chart.subscribeClick(param => {{
+        chart.subscribeClick(param => {
             if (!selectionMode || !param.time) return;
-            if (!selectStartTime) {{
+            if (!selectStartTime) {
                 selectStartTime = param.time;
                 tipEl.innerText = "起点已选。请点击【结束点】蜡烛...";
-            }} else {{
+            } else {
                 const selectEndTime = param.time;
-                const length = Math.round((selectEndTime - selectStartTime) / 3600);
-                if (length <= 0) {{ alert("选区无效！"); return; }}
-                
+                const length = Math.round((selectEndTime - selectStartTime) / STEP);
+                if (length <= 0) { alert("选区无效！"); return; }
+
                 loadEl.style.display = 'flex';
-                fetch('/api/search', {{
+                fetch('/api/search', {
                     method: 'POST',
-                    body: JSON.stringify({{ startTime: selectStartTime, length: length }})
-                }}).then(() => location.reload());
-            }}
-        }});
-
-        similarityData.forEach((item, idx) => {{
-            const div = document.createElement('div');
-            div.className = 'similarity-item';
-            div.innerHTML = `<div class="sim-date">${{item.date}}</div><div style="font-size:0.65rem">相似度: ${{Math.max(0, 100-item.distance*10).toFixed(1)}}% | 后果: ${{item.future_change>0?'+':''}}${{item.future_change.toFixed(2)}}%</div>`;
-            div.onclick = () => {{
-                const curIdx = ohlcData.findIndex(d => d.time === targetTime);
-                const offset = ohlcData[curIdx].open - item.ohlc[0].open;
-                const ghostData = item.ohlc.map((h, i) => ({{
-                    time: ohlcData[curIdx].time + i * 3600, 
-                    open: h.open + offset, high: h.high + offset, low: h.low + offset, close: h.close + offset
-                }}));
-                ghostSeries.setData(ghostData.slice(0, patternLength));
-                futureLineSeries.setData(ghostData.map(d => ({{ time: d.time, value: d.close }})));
-            }};
-            document.getElementById('sim-list').appendChild(div);
-        }});
+                    body: JSON.stringify({ startTime: selectStartTime, length: length, metric: document.getElementById('metric').value })
+                }).then(r => r.json()).then(job => pollJob(job.job_id));
+            }
+        });
+
+        // 轮询搜索任务进度；服务器模式下完成后只取结果 JSON，不再整页刷新
+        function pollJob(jobId) {
+            fetch('/api/jobs/' + jobId).then(r => r.json()).then(job => {
+                if (job.status === 'done') {
+                    if (!API) return location.reload();
+                    return fetch('/api/results/' + jobId).then(r => r.json()).then(meta => {
+                        renderMeta(meta);
+                        loadEl.style.display = 'none';
+                        selectStartTime = null;
+                        tipEl.innerText = "请点击图表上的一根蜡烛作为【起点】";
+                    });
+                }
+                if (job.status === 'error') {
+                    loadEl.style.display = 'none';
+                    alert('搜索失败: ' + job.error);
+                    return;
+                }
+                progressEl.innerText = `🧠 正在进行 DTW 全量历史搜索... ${(job.progress * 100).toFixed(0)}%`;
+                setTimeout(() => pollJob(jobId), 300);
+            });
+        }
+
+        // ---- 实时 K 线 ----
+        // 服务器开启实时数据时经 SSE 推送新增或变化的 K 线（列式，与 /api/ohlc 相同）；
+        // 只有正在看基础分辨率的最新数据时才直接画到图上，否则只更新 view.last，平移到右侧时按需取数
+        function applyLive(p) {
+            if (!view) return;
+            const bars = toCandles(p);
+            if (!bars.length) return;
+            const tail = bars[bars.length - 1].time;
+            const atLatest = view.interval === p.interval && view.to >= view.last;
+            view.last = Math.max(view.last || 0, tail);
+            if (!atLatest) return;
+            view.to = view.last;
+            if (p.reset) {
+                // 断线太久，补发的只是最新一段：与已有数据之间有缺口，丢掉旧的末尾直接换成补发内容
+                ohlcData = bars;
+                candleSeries.setData(ohlcData);
+                return;
+            }
+            const lastTime = ohlcData.length ? ohlcData[ohlcData.length - 1].time : 0;
+            bars.filter(b => b.time >= lastTime).forEach(b => {
+                if (ohlcData.length && ohlcData[ohlcData.length - 1].time === b.time) ohlcData[ohlcData.length - 1] = b;
+                else ohlcData.push(b);
+                candleSeries.update(b);
+            });
+        }
+
+        function subscribeLive(since) {
+            if (!window.EventSource) return;
+            // 断线后浏览器自动重连并带上 Last-Event-ID，服务器据此补发；未开启实时数据时服务器返回 204，不再重连
+            const source = new EventSource('/api/stream' + (since ? '?since=' + since : ''));
+            source.addEventListener('candles', e => applyLive(JSON.parse(e.data)));
+            // 常驻查询命中：在提示栏显示
+            source.addEventListener('match', e => {
+                const m = JSON.parse(e.data);
+                const when = new Date(m.time * 1000).toLocaleString();
+                tipEl.innerText = `🔔 ${when} 最近 ${m.length} 根与「${m.name || m.query_id}」相似（${m.metric} 距离 ${m.distance.toFixed(3)}）`;
+            });
+        }
+
+        // ---- 初始化 ----
+        if (API) {
+            chart.timeScale().subscribeVisibleTimeRangeChange(onVisibleRangeChange);
+            Promise.all([
+                fetchOhlc({ limit: PAGE_SIZE }),
+                fetch('/api/results/latest').then(r => r.ok ? r.json() : simMeta),
+            ]).then(([p, meta]) => {
+                const steps = Object.values(p.levels || {});
+                if (steps.length) STEP = Math.min(...steps);
+                ohlcData = toCandles(p);
+                view = { from: p.t.length ? p.t[0] : p.first, to: p.last, span: null, first: p.first, last: p.last, interval: p.interval };
+                candleSeries.setData(ohlcData);
+                renderMeta(meta);
+                subscribeLive(p.last);
+            });
+        } else {
+            ohlcData = BOOT.ohlc;
+            if (ohlcData.length > 1) STEP = ohlcData[1].time - ohlcData[0].time;
+            candleSeries.setData(ohlcData);
+            renderMeta(BOOT.meta);
+        }
     </script>
 </body>
 </html>
 '''
-    with open('tradingview_1h_chart.html', 'w', encoding='utf-8') as f:
+
+
+def render_page(boot=None):
+    """
+    填充页面模板
+
+    boot: None 表示服务器模式（数据走 API）；否则为 {'ohlc': [...], 'meta': {...}} 内嵌到页面
+    """
+    return PAGE_TEMPLATE.replace('@@BOOT@@', json.dumps(boot))
+
+
+def render_app_page():
+    """服务器模式的静态页面：不含任何数据，与搜索结果无关，可长期缓存"""
+    return render_page(None)
+
+
+def regenerate_html():
+    """
+    重新从数据文件生成内嵌数据的离线 HTML 页面（供 Streamlit 与直接打开文件使用）。
+    智能看板版：根据涨跌胜率大小，自动显示占优的情绪概率。
+    """
+    sim_path = 'similarity_results.json'
+
+    if not ohlc_store.store_exists() and not os.path.exists(ohlc_store.DEFAULT_JSON):
+        print(f"❌ 找不到数据文件: {ohlc_store.DEFAULT_STORE}")
+        return
+
+    ohlc_data = ohlc_store.load_series().to_records()
+
+    sim_meta = {'target_time': 0, 'target_date': '实时数据', 'pattern_length': 24, 'stats': {}, 'results': []}
+    if os.path.exists(sim_path):
+        with open(sim_path, 'r') as f:
+            sim_meta = json.load(f)
+
+    html = render_page({'ohlc': ohlc_data, 'meta': sim_meta})
+    # 先写临时文件再替换，正在被服务器读取的页面不会读到半截内容
+    tmp_path = 'tradingview_1h_chart.html.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
         f.write(html)
+    os.replace(tmp_path, 'tradingview_1h_chart.html')
     print(f"✅ 智能情绪版已生成：自动显示主导概率（上涨/下跌）")
 
 if __name__ == "__main__":
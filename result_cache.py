@@ -0,0 +1,167 @@
+"""
+相似走势搜索结果缓存
+以 (数据版本, 目标起点, 模式长度, top_n, 引擎参数) 为键：
+内存 LRU 一层（按字节数淘汰）+ 可选的磁盘一层（重启后仍然有效）。
+数据版本来自存储的 revision，同步新 K 线后旧条目自动失效并被清理
+"""
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+# 内存层与磁盘层的默认容量（字节）
+MEMORY_BYTES = 64 * 1024 * 1024
+DISK_BYTES = 512 * 1024 * 1024
+
+
+def make_key(version, **query):
+    """键 = 数据版本 + 查询参数的摘要；版本作为前缀便于按版本清理"""
+    digest = hashlib.sha1(json.dumps(query, sort_keys=True).encode()).hexdigest()[:20]
+    return f"{version}-{digest}"
+
+
+def _version_of(key):
+    return key.rsplit('-', 1)[0]
+
+
+class ResultCache:
+    """
+    两层结果缓存，值为搜索输出的 JSON 字节串（可直接写入 similarity_results.json）
+    """
+
+    def __init__(self, memory_bytes=MEMORY_BYTES, disk_dir=None, disk_bytes=DISK_BYTES):
+        self.memory_bytes = memory_bytes
+        self.disk_dir = disk_dir
+        self.disk_bytes = disk_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.version = None
+        self.lock = threading.Lock()
+        self.hits = {'memory': 0, 'disk': 0}
+        self.misses = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    # ---- 版本失效 ----
+    def check_version(self, version):
+        """发现数据版本变化时清掉旧版本的所有条目（内存与磁盘）"""
+        with self.lock:
+            if version == self.version:
+                return
+            self.version = version
+            for key in [k for k in self.entries if _version_of(k) != version]:
+                self.size -= len(self.entries.pop(key))
+        if self.disk_dir:
+            for name in os.listdir(self.disk_dir):
+                if name.endswith('.json') and _version_of(name[:-5]) != version:
+                    _remove(os.path.join(self.disk_dir, name))
+
+    # ---- 读写 ----
+    def get(self, key):
+        """
+        返回: (值或 None, 信息 dict)，信息包含 hit / tier / lookup_ms
+        """
+        t0 = time.perf_counter()
+        self.check_version(_version_of(key))
+        tier = None
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+                tier = 'memory'
+        if value is None and self.disk_dir:
+            path = self._disk_path(key)
+            try:
+                with open(path, 'rb') as f:
+                    value = f.read()
+                os.utime(path)
+                tier = 'disk'
+                self._put_memory(key, value)
+            except FileNotFoundError:
+                pass
+        with self.lock:
+            if tier:
+                self.hits[tier] += 1
+            else:
+                self.misses += 1
+        info = {'hit': tier is not None, 'tier': tier, 'lookup_ms': round((time.perf_counter() - t0) * 1000, 3)}
+        return value, info
+
+    def put(self, key, value):
+        self.check_version(_version_of(key))
+        self._put_memory(key, value)
+        if self.disk_dir:
+            path = self._disk_path(key)
+            tmp = f'{path}.{threading.get_ident()}.tmp'
+            with open(tmp, 'wb') as f:
+                f.write(value)
+            os.replace(tmp, path)
+            self._evict_disk()
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+        if self.disk_dir:
+            for name in os.listdir(self.disk_dir):
+                _remove(os.path.join(self.disk_dir, name))
+
+    def stats(self):
+        with self.lock:
+            return {'entries': len(self.entries), 'bytes': self.size,
+                    'hits': dict(self.hits), 'misses': self.misses}
+
+    # ---- 内部 ----
+    def _put_memory(self, key, value):
+        if len(value) > self.memory_bytes:
+            return
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self.entries[key] = value
+            self.size += len(value)
+            while self.size > self.memory_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, f'{key}.json')
+
+    def _evict_disk(self):
+        """磁盘层超出容量时按最近访问时间淘汰"""
+        files = []
+        for name in os.listdir(self.disk_dir):
+            if name.endswith('.json'):
+                path = os.path.join(self.disk_dir, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                files.append((st.st_mtime, st.st_size, path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.disk_bytes:
+                break
+            _remove(path)
+            total -= size
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+# 进程内共享的默认缓存；app_server 可通过 configure 打开磁盘层
+default_cache = ResultCache()
+
+
+def configure(memory_bytes=MEMORY_BYTES, disk_dir=None, disk_bytes=DISK_BYTES):
+    """替换默认缓存的配置"""
+    global default_cache
+    default_cache = ResultCache(memory_bytes, disk_dir, disk_bytes)
+    return default_cache
@@ -0,0 +1,123 @@
+"""
+相似走势搜索任务队列
+POST 只负责登记任务并立即返回 job id，由后台线程池执行搜索，
+前端轮询进度（已扫描窗口比例）并在完成后通过 /api/results/<id> 取结果 JSON
+"""
+import time
+import uuid
+import threading
+import traceback
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import find_similar_patterns
+import search_metrics
+
+# 默认并发执行的搜索数与保留的历史任务数
+MAX_WORKERS = 2
+MAX_JOBS = 200
+
+
+class SearchJob:
+    """单个搜索任务的状态"""
+
+    def __init__(self, params):
+        self.id = uuid.uuid4().hex[:12]
+        self.params = params
+        self.status = 'queued'
+        self.progress = 0.0
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.result = None
+        self.payload = None
+        self.error = None
+        # 各阶段耗时与内存（search_metrics），任务结束后可用
+        self.trace = None
+
+    def set_progress(self, fraction):
+        # 剪枝引擎的比例可能回退，对外只报单调递增的进度
+        self.progress = max(self.progress, min(1.0, float(fraction)))
+
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'status': self.status,
+            'progress': round(self.progress, 4),
+            'params': self.params,
+            'submitted': self.submitted,
+            'started': self.started,
+            'finished': self.finished,
+            'error': self.error,
+            'trace': self.trace,
+        }
+
+
+class JobManager:
+    """用线程池执行搜索任务，按提交顺序保留最近 MAX_JOBS 个任务"""
+
+    def __init__(self, max_workers=MAX_WORKERS, max_jobs=MAX_JOBS, search_fn=None):
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='search')
+        self.max_jobs = max_jobs
+        # search_fn 返回 (输出 JSON 字节串, 统计 dict)
+        self.search_fn = search_fn or find_similar_patterns.run_search
+        self.jobs = OrderedDict()
+        self.lock = threading.Lock()
+
+    def submit(self, start_str, length=24, top_n=200, metric='dtw', channels=None):
+        params = {'start': start_str, 'length': length, 'top_n': top_n, 'metric': metric, 'channels': channels}
+
+        def task(report, progress):
+            payload, stats = self.search_fn(start_str=start_str, length=length, top_n=top_n, report=report,
+                                            progress=progress, metric=metric, channels=channels)
+            # 结果文件照常更新，但不再重新生成整页 HTML
+            find_similar_patterns.save_results(payload, render_html=False)
+            with search_metrics.stage('serialize'):
+                return find_similar_patterns.strip_segments(payload), stats
+
+        return self.submit_task(params, task)
+
+    def submit_task(self, params, task):
+        """
+        登记任意搜索任务（如跨市场搜索）：task(report, progress) 返回 (结果 JSON 字节串, 统计 dict)，
+        结果同样通过 /api/results/<id> 获取
+        """
+        job = SearchJob(params)
+        with self.lock:
+            self.jobs[job.id] = job
+            # 丢弃最旧的已结束任务
+            while len(self.jobs) > self.max_jobs:
+                oldest = next(iter(self.jobs.values()))
+                if oldest.status in ('queued', 'running'):
+                    break
+                self.jobs.popitem(last=False)
+        self.pool.submit(self._run, job, task)
+        return job
+
+    def _run(self, job, task):
+        job.status = 'running'
+        job.started = time.time()
+        report = {}
+        trace = None
+        try:
+            with search_metrics.trace(job_id=job.id) as trace:
+                job.payload, stats = task(report, job.set_progress)
+            job.trace = report['trace'] = trace.summary()
+            job.result = {'stats': stats, 'search': report}
+            job.progress = 1.0
+            job.status = 'done'
+        except Exception as e:
+            traceback.print_exc()
+            if trace is not None:
+                job.trace = trace.summary()
+            job.error = str(e)
+            job.status = 'error'
+        finally:
+            job.finished = time.time()
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def shutdown(self, wait=True):
+        self.pool.shutdown(wait=wait)
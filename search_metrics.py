@@ -0,0 +1,248 @@
+"""
+搜索的分阶段计时与内存统计
+每次搜索记录各阶段（load_data、窗口提取、距离计算、top-k 过滤、统计、写结果文件、生成页面）的
+耗时、窗口数与内存，一行 JSON 追加到日志文件，并累计到 /metrics 输出的直方图中。
+
+开销很小，可以常开：每个阶段只读两次时钟、一次 /proc/self/statm 与一次 getrusage（约 10 µs）；
+没有正在记录的搜索时（如 backtest、search_many 直接调用搜索函数）stage() 只做一次 ContextVar 查询。
+内存是进程级的：rss_mb 为阶段结束时的常驻内存，peak_growth_mb 为该阶段把进程的历史峰值抬高了多少
+（多个搜索并发时互相叠加）；设置环境变量 SEARCH_TRACEMALLOC=1 时额外用 tracemalloc 记录
+每个阶段 Python / NumPy 分配的峰值（开销明显，用于排查）
+"""
+import os
+import sys
+import json
+import time
+import bisect
+import threading
+import contextlib
+import contextvars
+import tracemalloc
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# 常见阶段，按执行顺序（其他名字同样可以记录）
+STAGES = ('load_data', 'target', 'cache', 'index', 'windows', 'distances', 'select_top', 'stats', 'serialize',
+          'save', 'render')
+# 耗时直方图的桶上界（秒）
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# 窗口数直方图的桶上界
+WINDOW_BUCKETS = (1e3, 1e4, 3e4, 1e5, 3e5, 1e6, 3e6, 1e7)
+# JSON Lines 日志路径，设为空字符串则不写日志
+LOG_PATH = os.environ.get('SEARCH_METRICS_LOG', 'search_metrics.jsonl')
+TRACEMALLOC = os.environ.get('SEARCH_TRACEMALLOC') == '1'
+
+_current = contextvars.ContextVar('search_trace', default=None)
+_log_lock = threading.Lock()
+_PAGE_MB = os.sysconf('SC_PAGE_SIZE') / 2 ** 20 if hasattr(os, 'sysconf') else 0.0
+# ru_maxrss 在 Linux 上以 KB、macOS 上以字节为单位
+_MAXRSS_MB = 1 / 2 ** 20 if sys.platform == 'darwin' else 1 / 1024
+
+
+def rss_mb():
+    """当前常驻内存 (MB)，取不到时为 0"""
+    try:
+        with open('/proc/self/statm', 'rb') as f:
+            return int(f.read().split()[1]) * _PAGE_MB
+    except (OSError, IndexError, ValueError):
+        return 0.0
+
+
+def max_rss_mb():
+    """进程常驻内存的历史峰值 (MB)"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * _MAXRSS_MB if resource else 0.0
+
+
+class SearchTrace:
+    """一次搜索的各阶段记录；同名阶段多次进入时累加"""
+
+    def __init__(self, **labels):
+        self.labels = labels
+        self.stages = {}
+        self.counts = {}
+        self.status = 'ok'
+        self.started = time.time()
+        self._t0 = time.perf_counter()
+        self.total = None
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        peak_before = max_rss_mb()
+        if TRACEMALLOC and tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+        t0 = time.perf_counter()
+        try:
+            yield self
+        finally:
+            elapsed = time.perf_counter() - t0
+            record = self.stages.setdefault(name, {'seconds': 0.0, 'calls': 0, 'rss_mb': 0.0,
+                                                   'peak_growth_mb': 0.0})
+            record['seconds'] += elapsed
+            record['calls'] += 1
+            record['rss_mb'] = rss_mb()
+            record['peak_growth_mb'] += max(0.0, max_rss_mb() - peak_before)
+            if TRACEMALLOC and tracemalloc.is_tracing():
+                peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+                record['alloc_peak_mb'] = max(record.get('alloc_peak_mb', 0.0), peak)
+
+    def count(self, name, value):
+        self.counts[name] = self.counts.get(name, 0) + int(value)
+
+    def finish(self, status='ok'):
+        self.status = status
+        self.total = time.perf_counter() - self._t0
+
+    def summary(self):
+        """可 JSON 序列化的摘要：各阶段毫秒数与内存，以及计数"""
+        total = self.total if self.total is not None else time.perf_counter() - self._t0
+        stages = {}
+        for name, record in self.stages.items():
+            stages[name] = {
+                'ms': round(record['seconds'] * 1000, 3),
+                'calls': record['calls'],
+                'rss_mb': round(record['rss_mb'], 1),
+                'peak_growth_mb': round(record['peak_growth_mb'], 1),
+            }
+            if 'alloc_peak_mb' in record:
+                stages[name]['alloc_peak_mb'] = round(record['alloc_peak_mb'], 1)
+        return {
+            'status': self.status,
+            'total_ms': round(total * 1000, 3),
+            'stages': stages,
+            'counts': dict(self.counts),
+            'max_rss_mb': round(max_rss_mb(), 1),
+            **self.labels,
+        }
+
+
+def current():
+    """当前上下文中正在记录的搜索（没有时为 None）"""
+    return _current.get()
+
+
+def stage(name):
+    """记录一个阶段；没有正在记录的搜索时什么都不做"""
+    active = _current.get()
+    return active.stage(name) if active is not None else contextlib.nullcontext()
+
+
+def count(name, value):
+    active = _current.get()
+    if active is not None:
+        active.count(name, value)
+
+
+@contextlib.contextmanager
+def trace(**labels):
+    """
+    记录一次搜索：进入时开始，退出时写日志并计入直方图。
+    已经在记录中时（do_search -> run_search 这样的嵌套调用）沿用外层的记录，只补充标签
+    """
+    active = _current.get()
+    if active is not None:
+        active.labels.update(labels)
+        yield active
+        return
+    active = SearchTrace(**labels)
+    token = _current.set(active)
+    if TRACEMALLOC and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    status = 'error'
+    try:
+        yield active
+        status = 'ok'
+    finally:
+        _current.reset(token)
+        active.finish(status)
+        registry.observe(active)
+        _write_log(active)
+
+
+def _write_log(active):
+    if not LOG_PATH:
+        return
+    line = json.dumps({'time': datetime.fromtimestamp(active.started).isoformat(timespec='seconds'),
+                       **active.summary()}, ensure_ascii=False)
+    try:
+        with _log_lock, open(LOG_PATH, 'a', encoding='utf-8') as f:
+            f.write(line + '\n')
+    except OSError as e:
+        print(f"⚠️ 写入搜索日志失败: {e}")
+
+
+class Histogram:
+    """累计直方图（Prometheus 语义：每个桶统计 ≤ 上界的观测数）"""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def lines(self, name, labels=''):
+        sep = ',' if labels else ''
+        cumulative = 0
+        out = []
+        for bound, n in zip(self.buckets + (float('inf'),), self.counts):
+            cumulative += n
+            le = '+Inf' if bound == float('inf') else f'{bound:g}'
+            out.append(f'{name}_bucket{{{labels}{sep}le="{le}"}} {cumulative}')
+        braces = f'{{{labels}}}' if labels else ''
+        out.append(f'{name}_sum{braces} {self.sum:.6f}')
+        out.append(f'{name}_count{braces} {self.count}')
+        return out
+
+
+class MetricsRegistry:
+    """进程内汇总：各阶段耗时、总耗时与窗口数的直方图，以及按状态计数"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stages = {}
+        self.total = Histogram(DURATION_BUCKETS)
+        self.windows = Histogram(WINDOW_BUCKETS)
+        self.searches = {}
+
+    def observe(self, active):
+        with self.lock:
+            self.searches[active.status] = self.searches.get(active.status, 0) + 1
+            self.total.observe(active.total)
+            for name, record in active.stages.items():
+                self.stages.setdefault(name, Histogram(DURATION_BUCKETS)).observe(record['seconds'])
+            if 'windows' in active.counts:
+                self.windows.observe(active.counts['windows'])
+
+    def render(self):
+        """Prometheus 文本格式"""
+        with self.lock:
+            lines = ['# HELP searches_total 已完成的搜索数（按状态）', '# TYPE searches_total counter']
+            lines += [f'searches_total{{status="{status}"}} {n}' for status, n in sorted(self.searches.items())]
+            lines += ['# HELP search_seconds 单次搜索的总耗时', '# TYPE search_seconds histogram']
+            lines += self.total.lines('search_seconds')
+            lines += ['# HELP search_stage_seconds 各阶段耗时', '# TYPE search_stage_seconds histogram']
+            order = sorted(self.stages, key=lambda s: (STAGES.index(s) if s in STAGES else len(STAGES), s))
+            for name in order:
+                lines += self.stages[name].lines('search_stage_seconds', f'stage="{name}"')
+            lines += ['# HELP search_windows 每次搜索的候选窗口数', '# TYPE search_windows histogram']
+            lines += self.windows.lines('search_windows')
+            lines += ['# HELP process_max_rss_bytes 进程常驻内存的历史峰值', '# TYPE process_max_rss_bytes gauge',
+                      f'process_max_rss_bytes {int(max_rss_mb() * 2 ** 20)}']
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+
+def format_summary(summary):
+    """一行文字的阶段耗时，供命令行输出"""
+    parts = [f"{name} {record['ms']:.1f}ms" for name, record in summary['stages'].items()]
+    return f"总计 {summary['total_ms']:.1f}ms | " + ' | '.join(parts)
@@ -0,0 +1,576 @@
+"""
+常驻查询：登记若干目标形态（长度 + 阈值），每根新收盘的 K 线只评估最新的窗口
+不再为每个形态每小时从头跑一遍 do_search
+
+- 每个长度维护一个滚动窗口：环形缓冲 + 单调队列（最小 / 最大值）+ 滚动和（均值 / 方差），
+  新 K 线 O(1) 更新，归一化所需的统计量不必重扫窗口
+- 同一 (长度, 度量, band) 的形态预先归一化成一个矩阵，欧氏距离一次矩阵向量乘法算出全部形态；
+  DTW 先用 LB_Keogh 排除，剩下的按下界从小到大批量计算并提前放弃
+- 命中（距离 ≤ 阈值）的形态交给 sink；同一形态 cooldown 根内只提醒一次
+- 单根 K 线的评估有耗时预算：超出预算时剩余的 DTW 候选记为 skipped 并给出警告
+"""
+import os
+import json
+import time
+import uuid
+import argparse
+import threading
+import collections
+import numpy as np
+
+import ohlc_store
+from dtw_engine import dtw_batch, keogh_envelope, lb_keogh, resolve_band
+from mass_engine import METRICS, DistanceProfiler
+from window_matrix import normalized_windows
+
+QUERIES_PATH = 'standing_queries.json'
+MATCHES_PATH = 'standing_matches.jsonl'
+QUERY_METRICS = ('dtw',) + METRICS
+# 单根 K 线评估全部形态的耗时预算（毫秒）
+BUDGET_MS = 50.0
+# DTW 每批计算的候选形态数（批与批之间检查预算）
+DTW_CHUNK = 512
+# 未给出阈值时，按历史上所有窗口距离的该分位数设定
+DEFAULT_QUANTILE = 0.001
+
+
+class RollingWindow:
+    """
+    最近 length 个收盘价的滚动窗口
+
+    环形缓冲写两份（位置 i 与 i + length），任意时刻 buffer[pos:pos + length] 即按时间顺序的窗口，不需要拷贝；
+    最小 / 最大值用单调队列，均值 / 离差平方和用平移到锚点后的滚动和
+    """
+
+    def __init__(self, length):
+        self.length = length
+        self.buffer = np.zeros(2 * length)
+        self.pos = 0
+        self.count = 0
+        self.mins = collections.deque()
+        self.maxs = collections.deque()
+        self.anchor = None
+        self.s1 = 0.0
+        self.s2 = 0.0
+
+    @property
+    def ready(self):
+        return self.count >= self.length
+
+    def push(self, value):
+        value = float(value)
+        length = self.length
+        if self.anchor is None:
+            self.anchor = value
+        if self.count >= length:
+            old = self.buffer[self.pos] - self.anchor
+            self.s1 -= old
+            self.s2 -= old * old
+        shifted = value - self.anchor
+        self.s1 += shifted
+        self.s2 += shifted * shifted
+        self.buffer[self.pos] = value
+        self.buffer[self.pos + length] = value
+        self.pos = (self.pos + 1) % length
+        n = self.count
+        self.count += 1
+        # 单调队列保存 (序号, 值)，队首即窗口内的最小 / 最大值
+        while self.mins and self.mins[-1][1] >= value:
+            self.mins.pop()
+        self.mins.append((n, value))
+        while self.maxs and self.maxs[-1][1] <= value:
+            self.maxs.pop()
+        self.maxs.append((n, value))
+        first = self.count - length
+        while self.mins[0][0] < first:
+            self.mins.popleft()
+        while self.maxs[0][0] < first:
+            self.maxs.popleft()
+        # 每 length 根把锚点移到当前均值并精确重算（均摊 O(1)），价格远离锚点后滚动和的抵消误差不会累积
+        if self.count % length == 0:
+            self._resync()
+
+    def _resync(self):
+        window = self.window()
+        self.anchor = float(window.mean())
+        shifted = window - self.anchor
+        self.s1 = float(shifted.sum())
+        self.s2 = float((shifted * shifted).sum())
+
+    def window(self):
+        return self.buffer[self.pos:self.pos + self.length]
+
+    def low(self):
+        return self.mins[0][1]
+
+    def high(self):
+        return self.maxs[0][1]
+
+    def mean(self):
+        return self.anchor + self.s1 / self.length
+
+    def m2(self):
+        """离差平方和 Σ(x - mean)^2"""
+        return max(self.s2 - self.s1 * self.s1 / self.length, 0.0)
+
+    def minmax(self):
+        """min-max 归一化的窗口（区间为 0 时全为 0，与 normalize 一致）"""
+        low, span = self.low(), self.high() - self.low()
+        if span == 0:
+            return np.zeros(self.length)
+        return (self.window() - low) / span
+
+    def znorm(self):
+        """z-score 归一化的窗口；常数窗口返回 None"""
+        m2 = self.m2()
+        mean = self.mean()
+        if m2 <= 1e-12 * max(mean * mean, 1.0) * self.length:
+            return None
+        return (self.window() - mean) / np.sqrt(m2 / self.length)
+
+
+def normalize_pattern(pattern, metric):
+    """形态按度量归一化：dtw / minmax_euclidean 为 min-max，znorm_euclidean 为 z-score（常数形态为 None）"""
+    pattern = np.asarray(pattern, dtype=float)
+    if metric == 'znorm_euclidean':
+        std = pattern.std()
+        return None if std == 0 else (pattern - pattern.mean()) / std
+    return normalized_windows(pattern, len(pattern))[0]
+
+
+class _Group:
+    """同一 (长度, 度量, band) 的全部形态：归一化后的矩阵与各自的阈值、冷却状态"""
+
+    def __init__(self, length, metric, band, queries):
+        self.length = length
+        self.metric = metric
+        self.band = band
+        self.queries = queries
+        self.ids = [q['id'] for q in queries]
+        self.threshold = np.array([q['threshold'] for q in queries], dtype=float)
+        self.cooldown = np.array([q.get('cooldown') or length for q in queries], dtype=np.int64)
+        self.last_hit = np.full(len(queries), -np.iinfo(np.int64).max // 2, dtype=np.int64)
+        normalized = [normalize_pattern(q['pattern'], metric) for q in queries]
+        # z-score 下常数形态只与常数窗口距离为 0，这里按 0 向量处理，由 flat 标记单独计算
+        self.flat = np.array([p is None for p in normalized])
+        self.matrix = np.array([np.zeros(length) if p is None else p for p in normalized]).reshape(-1, length)
+        self.square = (self.matrix * self.matrix).sum(axis=1)
+        if metric == 'dtw':
+            # 各形态自身的包络，与窗口包络得到的 LB_Keogh 取较大者
+            self.radius = resolve_band(length, band)
+            upper, lower = keogh_envelope(self.matrix.T, self.radius)
+            self.upper, self.lower = upper.T, lower.T
+
+    def distances(self, window, deadline, stats):
+        """
+        最新窗口与全部形态的距离；返回 (距离, 是否已计算)
+        未计算的只有 DTW 超出预算时剩下的候选
+        """
+        count = len(self.ids)
+        done = np.ones(count, dtype=bool)
+        if self.metric == 'znorm_euclidean':
+            z = window.znorm()
+            length = self.length
+            if z is None:
+                return np.where(self.flat, 0.0, np.sqrt(length)), done
+            corr = self.matrix @ z / length
+            dist = np.sqrt(np.maximum(2.0 * length * (1.0 - corr), 0.0))
+            return np.where(self.flat, np.sqrt(length), dist), done
+        w = window.minmax()
+        if self.metric == 'minmax_euclidean':
+            return np.sqrt(np.maximum(self.square - 2.0 * (self.matrix @ w) + w @ w, 0.0)), done
+        # DTW 对称，LB_Keogh 两个方向（窗口包络 / 形态包络）都是下界
+        values = np.full(count, np.inf)
+        upper, lower = keogh_envelope(w, self.radius)
+        bound = np.maximum(lb_keogh(self.matrix, upper, lower), lb_keogh(w, self.upper, self.lower))
+        candidates = np.flatnonzero(bound <= self.threshold)
+        candidates = candidates[np.argsort(bound[candidates], kind='stable')]
+        stats['pruned'] += count - len(candidates)
+        for start in range(0, len(candidates), DTW_CHUNK):
+            if time.perf_counter() > deadline:
+                rest = candidates[start:]
+                done[rest] = False
+                stats['skipped'] += len(rest)
+                break
+            chunk = candidates[start:start + DTW_CHUNK]
+            values[chunk] = dtw_batch(w, self.matrix[chunk], self.band,
+                                      abandon_above=float(self.threshold[chunk].max()))
+        return values, done
+
+
+class StandingQueryEngine:
+    """
+    逐根评估登记的形态
+
+    sink: 接收命中记录 dict 的函数（可为 None，只返回命中）
+    budget_ms: 单根 K 线的耗时预算
+    step: K 线周期（秒），用于给出命中窗口的起点时间
+    """
+
+    def __init__(self, queries=(), sink=None, budget_ms=BUDGET_MS, step=3600):
+        self.sink = sink
+        self.budget_ms = budget_ms
+        self.step = step
+        self.windows = {}
+        self.groups = []
+        self.bars = 0
+        self.last_time = None
+        self.latencies = collections.deque(maxlen=1000)
+        self.stats = {'bars': 0, 'matches': 0, 'pruned': 0, 'skipped': 0, 'over_budget': 0}
+        # 服务器中登记 / 删除形态与逐根评估在不同线程
+        self.lock = threading.Lock()
+        self.load(queries)
+
+    def load(self, queries):
+        """
+        替换全部形态；已有长度的滚动窗口与各形态的冷却状态保留，
+        新长度的窗口需要 warm 补齐历史
+        """
+        grouped = collections.defaultdict(list)
+        for query in queries:
+            grouped[(query['length'], query['metric'], query.get('band'))].append(query)
+        # 欧氏距离的组先算，DTW 放在最后，超出预算时只影响 DTW 候选
+        keys = sorted(grouped, key=lambda k: (k[1] == 'dtw', k[0]))
+        groups = [_Group(length, metric, band, grouped[(length, metric, band)]) for length, metric, band in keys]
+        with self.lock:
+            last_hit = {qid: hit for g in self.groups for qid, hit in zip(g.ids, g.last_hit.tolist())}
+            for group in groups:
+                for i, qid in enumerate(group.ids):
+                    if qid in last_hit:
+                        group.last_hit[i] = last_hit[qid]
+            self.groups = groups
+            lengths = {g.length for g in groups}
+            self.windows = {length: self.windows.get(length) or RollingWindow(length) for length in lengths}
+
+    @property
+    def max_length(self):
+        return max(self.windows, default=0)
+
+    def warm(self, times, closes):
+        """用历史 K 线填满尚未就绪的滚动窗口（不评估、不提醒）"""
+        closes = np.asarray(closes, dtype=float)
+        with self.lock:
+            for length, window in self.windows.items():
+                if window.count == 0:
+                    for value in closes[-length:]:
+                        window.push(value)
+            if len(times) and self.last_time is None:
+                self.last_time = int(times[-1])
+
+    def on_bar(self, bar_time, close):
+        """处理一根新收盘的 K 线，返回命中记录列表"""
+        with self.lock:
+            matches = self._evaluate(int(bar_time), close)
+        if self.sink is not None:
+            for match in matches:
+                self.sink(match)
+        return matches
+
+    def _evaluate(self, bar_time, close):
+        if self.last_time is not None and bar_time <= self.last_time:
+            return []
+        self.last_time = bar_time
+        t0 = time.perf_counter()
+        deadline = t0 + self.budget_ms / 1000
+        for window in self.windows.values():
+            window.push(close)
+        self.bars += 1
+        matches = []
+        for group in self.groups:
+            window = self.windows[group.length]
+            if not window.ready:
+                continue
+            distances, done = group.distances(window, deadline, self.stats)
+            hit = done & (distances <= group.threshold) & (self.bars - group.last_hit >= group.cooldown)
+            for i in np.flatnonzero(hit):
+                group.last_hit[i] = self.bars
+                query = group.queries[i]
+                matches.append({
+                    'query_id': query['id'],
+                    'name': query.get('name'),
+                    'time': bar_time,
+                    'window_start': bar_time - (group.length - 1) * self.step,
+                    'length': group.length,
+                    'metric': group.metric,
+                    'distance': float(distances[i]),
+                    'threshold': float(group.threshold[i]),
+                })
+        elapsed = (time.perf_counter() - t0) * 1000
+        self.latencies.append(elapsed)
+        self.stats['bars'] += 1
+        self.stats['matches'] += len(matches)
+        if elapsed > self.budget_ms:
+            self.stats['over_budget'] += 1
+            print(f"⚠️ 常驻查询评估耗时 {elapsed:.1f} ms，超出预算 {self.budget_ms:g} ms"
+                  f"（累计跳过 {self.stats['skipped']} 个 DTW 候选）")
+        return matches
+
+    def on_bars(self, columns):
+        """LiveFeed 的监听接口：一批新收盘的 K 线（列式）"""
+        matches = []
+        for t, c in zip(np.asarray(columns['time']).tolist(), np.asarray(columns['close']).tolist()):
+            matches += self.on_bar(t, c)
+        return matches
+
+    def latency_summary(self):
+        """最近 1000 根的评估耗时 p50 / p99 / 最大值（毫秒）"""
+        if not self.latencies:
+            return {'p50_ms': 0.0, 'p99_ms': 0.0, 'max_ms': 0.0}
+        values = np.array(self.latencies)
+        return {'p50_ms': float(np.percentile(values, 50)), 'p99_ms': float(np.percentile(values, 99)),
+                'max_ms': float(values.max())}
+
+
+def engine_for_store(queries, sink=None, store_path=ohlc_store.DEFAULT_STORE, budget_ms=BUDGET_MS):
+    """按存储的周期建立引擎，并用存储末尾的 K 线预热"""
+    series = ohlc_store.open_store(store_path)
+    engine = StandingQueryEngine(queries, sink, budget_ms, ohlc_store.interval_seconds(series.meta['interval']))
+    tail = slice(max(0, len(series) - engine.max_length), len(series))
+    engine.warm(series.time[tail], series.close[tail])
+    return engine
+
+
+# ---- 登记与持久化 ----
+def load_queries(path=QUERIES_PATH):
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)['queries']
+
+
+def save_queries(queries, path=QUERIES_PATH):
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump({'version': 1, 'queries': queries}, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def calibrate_threshold(closes, pattern, metric='dtw', band=None, quantile=DEFAULT_QUANTILE):
+    """按形态与历史上所有窗口距离的分位数给出阈值（分位数越小提醒越少）"""
+    closes = np.asarray(closes, dtype=float)
+    length = len(pattern)
+    if metric in METRICS:
+        distances = DistanceProfiler(closes, length, metric).profile(np.asarray(pattern, dtype=float))
+    else:
+        distances = dtw_batch(normalize_pattern(pattern, metric), normalized_windows(closes, length), band)
+    return float(np.quantile(distances, quantile))
+
+
+def _check_band(band, length):
+    """band 只能是 None、0-1 之间的比例或 0 ~ length-1 的整数半径（见 resolve_band）"""
+    if band is None:
+        return None
+    if isinstance(band, bool) or not isinstance(band, (int, float)) or not np.isfinite(band):
+        raise ValueError(f"无效的 band: {band!r}")
+    if 0 < band < 1:
+        return float(band)
+    if band != int(band) or not 0 <= band <= length - 1:
+        raise ValueError(f"band 应为 0-1 之间的比例或 0 ~ {length - 1} 的整数半径: {band!r}")
+    return int(band)
+
+
+def _check_cooldown(cooldown):
+    """cooldown 只能是 None 或正整数（根数）"""
+    if cooldown is None:
+        return None
+    if (isinstance(cooldown, bool) or not isinstance(cooldown, (int, float)) or not np.isfinite(cooldown)
+            or cooldown != int(cooldown) or cooldown < 1):
+        raise ValueError(f"cooldown 应为正整数（根数）: {cooldown!r}")
+    return int(cooldown)
+
+
+def make_query(pattern, metric='dtw', threshold=None, name=None, band=None, cooldown=None, closes=None,
+               quantile=DEFAULT_QUANTILE, source_time=None):
+    """
+    构造一个常驻查询
+    pattern: 目标形态的收盘价序列（长度即模式长度）
+    threshold: 距离阈值；为 None 时用 closes（历史收盘价）按 quantile 校准
+    band / cooldown 在写入查询文件前校验，非法值抛出 ValueError（否则之后每次加载都会失败）
+    """
+    if metric not in QUERY_METRICS:
+        raise ValueError(f"未知的距离度量: {metric}")
+    pattern = [float(x) for x in pattern]
+    if len(pattern) < 2:
+        raise ValueError("形态至少需要 2 根 K 线")
+    band = _check_band(band, len(pattern))
+    cooldown = _check_cooldown(cooldown)
+    if threshold is None:
+        if closes is None:
+            raise ValueError("未给出阈值时需要历史数据来校准")
+        threshold = calibrate_threshold(closes, pattern, metric, band, quantile)
+    return {
+        'id': uuid.uuid4().hex[:12],
+        'name': name,
+        'length': len(pattern),
+        'metric': metric,
+        'band': band,
+        'threshold': float(threshold),
+        'cooldown': cooldown,
+        'source_time': source_time,
+        'pattern': pattern,
+    }
+
+
+def register(pattern, path=QUERIES_PATH, **options):
+    """登记一个形态并写入查询文件，返回查询"""
+    query = make_query(pattern, **options)
+    queries = load_queries(path)
+    queries.append(query)
+    save_queries(queries, path)
+    return query
+
+
+def unregister(query_id, path=QUERIES_PATH):
+    """删除一个形态，返回是否存在"""
+    queries = load_queries(path)
+    kept = [q for q in queries if q['id'] != query_id]
+    if len(kept) == len(queries):
+        return False
+    save_queries(kept, path)
+    return True
+
+
+def pattern_at(series, start_time, length):
+    """存储中从 start_time（Unix 秒）起 length 根的收盘价"""
+    lo, hi = series.locate(start_time, None, length)
+    if hi - lo < length:
+        raise ValueError("起点之后的 K 线不足一个模式长度")
+    return series.close[lo:hi].tolist()
+
+
+class JsonlSink:
+    """命中记录逐行追加到 JSON Lines 文件"""
+
+    def __init__(self, path=MATCHES_PATH):
+        self.path = path
+
+    def __call__(self, match):
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(match, ensure_ascii=False) + '\n')
+
+
+def print_sink(match):
+    label = match['name'] or match['query_id']
+    when = time.strftime('%Y-%m-%d %H:%M', time.localtime(match['time']))
+    print(f"🔔 {when} 最近 {match['length']} 根与「{label}」相似: "
+          f"{match['metric']} 距离 {match['distance']:.4f} ≤ {match['threshold']:.4f}")
+
+
+# ---- 回放与基准 ----
+def replay(queries, bars=2000, store_path=ohlc_store.DEFAULT_STORE, sink=None, budget_ms=BUDGET_MS):
+    """
+    用存储最后 bars 根逐根回放：引擎用之前的 K 线预热，再逐根评估
+    返回 (命中列表, 引擎)
+    """
+    series = ohlc_store.open_store(store_path)
+    engine = StandingQueryEngine(queries, sink, budget_ms, ohlc_store.interval_seconds(series.meta['interval']))
+    split = len(series) - bars
+    history = slice(max(0, split - engine.max_length), split)
+    engine.warm(series.time[history], series.close[history])
+    matches = []
+    for t, c in zip(series.time[split:].tolist(), series.close[split:].tolist()):
+        matches += engine.on_bar(t, c)
+    return matches, engine
+
+
+def _brute_force(closes, group, end):
+    """最新窗口（以 end 结尾）与组内全部形态的距离，逐个直接计算（用于校验）"""
+    window = np.asarray(closes[end - group.length + 1:end + 1], dtype=float)
+    if group.metric in METRICS:
+        return np.array([DistanceProfiler(window, group.length, group.metric).profile(np.asarray(q['pattern']))[0]
+                         for q in group.queries])
+    w = normalize_pattern(window, 'dtw')
+    return dtw_batch(w, group.matrix, group.band)
+
+
+# 基准测试的阈值：dtw 为 系数 × L，欧氏距离为 系数 × sqrt(L)
+THRESHOLD_SCALE = {'dtw': 0.05, 'znorm_euclidean': 0.35, 'minmax_euclidean': 0.15}
+
+
+def benchmark(patterns=3000, bars=500, lengths=(24, 72, 168), store_path=ohlc_store.DEFAULT_STORE, seed=0,
+              budget_ms=BUDGET_MS):
+    """
+    从历史中随机取 patterns 个形态（各长度与度量轮流分配）登记后逐根回放 bars 根，
+    报告每根的评估耗时，并抽查最后一根的距离与逐个直接计算一致
+    """
+    series = ohlc_store.open_store(store_path)
+    closes = np.asarray(series.close, dtype=float)
+    rng = np.random.default_rng(seed)
+    combos = [(length, metric) for length in lengths for metric in QUERY_METRICS]
+    queries = []
+    for i in range(patterns):
+        length, metric = combos[i % len(combos)]
+        start = int(rng.integers(0, len(closes) - bars - length))
+        pattern = closes[start:start + length]
+        # 阈值约为各度量下历史距离的 0.1% 分位数（逐个校准太慢，这里按长度换算）
+        threshold = THRESHOLD_SCALE[metric] * (length if metric == 'dtw' else np.sqrt(length))
+        queries.append(make_query(pattern, metric, threshold=threshold, band=0.1 if metric == 'dtw' else None))
+    matches, engine = replay(queries, bars, store_path, budget_ms=budget_ms)
+    summary = engine.latency_summary()
+    print(f"📏 {patterns} 个形态（长度 {'/'.join(map(str, lengths))}，度量 {'/'.join(QUERY_METRICS)}），回放 {bars} 根")
+    print(f"⏱️ 每根 p50 {summary['p50_ms']:.2f} ms | p99 {summary['p99_ms']:.2f} ms | "
+          f"最大 {summary['max_ms']:.2f} ms（预算 {budget_ms:g} ms）")
+    print(f"🔔 命中 {len(matches)} 次 | LB_Keogh 排除 {engine.stats['pruned']} | "
+          f"超预算 {engine.stats['over_budget']} 根 | 跳过 {engine.stats['skipped']}")
+    error = 0.0
+    for group in engine.groups:
+        expected = _brute_force(closes, group, len(closes) - 1)
+        window = engine.windows[group.length]
+        actual, done = group.distances(window, np.inf, collections.Counter())
+        finite = done & np.isfinite(actual) & (actual <= group.threshold)
+        error = max(error, float(np.abs(actual[finite] - expected[finite]).max(initial=0.0)))
+        skipped = ~np.isfinite(actual)
+        assert np.all(expected[skipped] > group.threshold[skipped] - 1e-9), "DTW 剪枝排除了阈值内的形态"
+    print(f"✅ 与逐个直接计算的最大误差 {error:.2e}")
+    return {**summary, 'matches': len(matches), **engine.stats, 'max_error': error}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='常驻查询：登记形态，每根新 K 线评估最新窗口')
+    parser.add_argument('--queries', default=QUERIES_PATH, help='查询文件')
+    sub = parser.add_subparsers(dest='command', required=True)
+    add = sub.add_parser('add', help='登记一个形态（取存储中某段 K 线）')
+    add.add_argument('--start', required=True, help='形态起点 (YYYY-MM-DD HH:MM)')
+    add.add_argument('--length', type=int, default=24, help='模式长度')
+    add.add_argument('--metric', default='dtw', choices=QUERY_METRICS)
+    add.add_argument('--threshold', type=float, default=None, help='距离阈值（默认按历史分位数校准）')
+    add.add_argument('--quantile', type=float, default=DEFAULT_QUANTILE, help='未给出阈值时使用的历史分位数')
+    add.add_argument('--band', type=float, default=None, help='DTW 的 Sakoe-Chiba 约束')
+    add.add_argument('--cooldown', type=int, default=None, help='同一形态两次提醒至少间隔的根数（默认模式长度）')
+    add.add_argument('--name', default=None)
+    remove = sub.add_parser('remove', help='删除一个形态')
+    remove.add_argument('query_id')
+    sub.add_parser('list', help='列出已登记的形态')
+    run = sub.add_parser('replay', help='用存储最后 N 根回放并输出命中')
+    run.add_argument('--bars', type=int, default=720)
+    bench = sub.add_parser('bench', help='大量形态下每根 K 线的评估耗时')
+    bench.add_argument('--patterns', type=int, default=3000)
+    bench.add_argument('--bars', type=int, default=500)
+    bench.add_argument('--budget-ms', type=float, default=BUDGET_MS)
+    args = parser.parse_args()
+
+    if args.command == 'add':
+        from datetime import datetime
+
+        series = ohlc_store.open_store()
+        start = int(datetime.strptime(args.start, '%Y-%m-%d %H:%M').timestamp())
+        pattern = pattern_at(series, start, args.length)
+        query = register(pattern, args.queries, metric=args.metric, threshold=args.threshold, name=args.name,
+                         band=args.band, cooldown=args.cooldown, closes=series.close, quantile=args.quantile,
+                         source_time=start)
+        print(f"✅ 已登记 {query['id']}: 长度 {query['length']}, {query['metric']} 阈值 {query['threshold']:.4f}")
+    elif args.command == 'remove':
+        print("✅ 已删除" if unregister(args.query_id, args.queries) else "❌ 找不到该形态")
+    elif args.command == 'list':
+        for q in load_queries(args.queries):
+            print(f"{q['id']}  {q.get('name') or '-'}  长度 {q['length']}  {q['metric']}  阈值 {q['threshold']:.4f}")
+    elif args.command == 'replay':
+        matches, engine = replay(load_queries(args.queries), args.bars, sink=print_sink)
+        summary = engine.latency_summary()
+        print(f"📊 回放 {args.bars} 根，命中 {len(matches)} 次，每根 p99 {summary['p99_ms']:.2f} ms")
+    else:
+        benchmark(args.patterns, args.bars, budget_ms=args.budget_ms)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,6 +5,7 @@ import json
 from datetime import datetime, timedelta
 import find_similar_patterns
 import repair_chart
+import ohlc_store
 
 # 设置页面配置
 st.set_page_config(
@@ -40,16 +41,16 @@ st.markdown("---")
 with st.sidebar:
     st.header("🔍 搜索参数设置")
     
-    # 获取当前最后数据的时间
-    data_file = 'btc_1h_ohlc.json'
+    # 获取当前最后数据的时间（只读存储头与最后一根蜡烛）
     last_date = datetime.now()
-    if os.path.exists(data_file):
-        with open(data_file, 'r') as f:
-            data = json.load(f)
-            if data:
-                last_date = datetime.fromtimestamp(data[-1]['time'])
+    data_count = 0
+    if ohlc_store.store_exists() or os.path.exists(ohlc_store.DEFAULT_JSON):
+        data = ohlc_store.load_series()
+        data_count = len(data)
+        if data_count:
+            last_date = datetime.fromtimestamp(int(data.time[-1]))
 
-    st.info(f"💾 当前本地数据量: {len(data) if os.path.exists(data_file) else 0} 小时")
+    st.info(f"💾 当前本地数据量: {data_count} 小时")
     
     # 模式选择
     search_mode = st.radio("选择搜索起点", ["今日凌晨 (默认)", "自定义历史日期"])
@@ -62,6 +63,15 @@ with st.sidebar:
         selected_time = st.time_input("选择起始具体小时", value=datetime.strptime("00:00", "%H:%M").time())
     
     pattern_length = st.slider("模式长度 (K 线数量/小时)", min_value=6, max_value=168, value=24)
+
+    metric_labels = {
+        'dtw': 'DTW (允许时间弯曲)',
+        'minmax_euclidean': '欧氏距离 (min-max 归一化)',
+        'znorm_euclidean': '欧氏距离 (z-score 归一化)',
+        'mdtw_dependent': '多通道 DTW (收盘价 + 收益率 + 振幅)',
+        'mdtw_independent': '多通道 DTW (各通道独立弯曲)',
+    }
+    metric = st.selectbox("距离度量", list(metric_labels), format_func=metric_labels.get)
     
     search_btn = st.button("🚀 开始历史深度搜索")
 
@@ -73,7 +83,7 @@ if search_btn:
             start_str = f"{selected_date.strftime('%Y-%m-%d')} {selected_time.strftime('%H:%M')}"
             
             # 执行核心搜索逻辑
-            stats = find_similar_patterns.do_search(start_str=start_str, length=pattern_length)
+            stats = find_similar_patterns.do_search(start_str=start_str, length=pattern_length, metric=metric)
             
             st.success(f"✅ 搜索完成！胜率: {stats['win_rate']}% | 平均回报: {stats['avg_return']}%")
             
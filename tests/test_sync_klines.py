@@ -0,0 +1,176 @@
+"""
+sync_klines 的增量同步，针对本地 K 线接口替身（mock_binance）运行
+"""
+import pytest
+
+import ohlc_store
+from fetch_binance_ohlc import FULL_HISTORY_SECONDS, klines_to_columns, sync_klines
+from mock_binance import random_walk_klines, start_mock_server
+
+HOUR_MS = 3_600_000
+START_MS = 1_600_000_000_000
+
+
+def closed_at(index):
+    """第 index 根（从 0 起）收盘之后、下一根收盘之前的时刻"""
+    return START_MS + (index + 1) * HOUR_MS + 1
+
+
+@pytest.fixture
+def exchange():
+    """启动替身服务器；返回一个函数，按给定 K 线开服，测试结束时统一关闭"""
+    servers = []
+
+    def serve(klines):
+        server, base_url, store = start_mock_server(klines)
+        servers.append(server)
+        return base_url, store
+
+    yield serve
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def sync(path, base_url, now_ms, **kwargs):
+    return sync_klines(str(path), 'BTCUSDT', '1h', base_url=base_url, now_ms=now_ms, **kwargs)
+
+
+def test_cold_start_downloads_recent_history(tmp_path, exchange):
+    count = FULL_HISTORY_SECONDS // 3600 + 500
+    klines = random_walk_klines(count, start_ms=START_MS)
+    base_url, _ = exchange(klines)
+    # 恰在最后一根收盘时同步：窗口正好容纳 FULL_HISTORY_SECONDS 内的全部 K 线
+    now_ms = START_MS + count * HOUR_MS
+
+    summary = sync(tmp_path / 'store', base_url, now_ms)
+
+    series = ohlc_store.open_store(str(tmp_path / 'store'))
+    assert len(series) == FULL_HISTORY_SECONDS // 3600
+    assert summary['appended'] == len(series)
+    # 与 --full 一致：只取最近约 3 年，更早的 K 线不下载
+    assert int(series.time[0]) * 1000 >= now_ms - FULL_HISTORY_SECONDS * 1000
+    assert int(series.time[-1]) * 1000 == klines[-1][0]
+
+
+def test_no_closed_candles_leaves_no_empty_store(tmp_path, exchange):
+    klines = random_walk_klines(3, start_ms=START_MS)
+    base_url, _ = exchange(klines)
+    path = str(tmp_path / 'store')
+
+    # 第一根还没收盘：不建立存储，之后的同步照常按首次同步进行
+    summary = sync(path, base_url, START_MS + HOUR_MS // 2)
+    assert summary['appended'] == 0
+    assert not ohlc_store.store_exists(path)
+
+    summary = sync(path, base_url, closed_at(1))
+    assert summary['appended'] == 2
+    assert len(ohlc_store.open_store(path)) == 2
+
+
+def test_empty_store_is_synced_like_a_cold_start(tmp_path, exchange):
+    klines = random_walk_klines(50, start_ms=START_MS)
+    base_url, _ = exchange(klines)
+    path = str(tmp_path / 'store')
+    ohlc_store.write_store(path, klines_to_columns([]), 'BTCUSDT', '1h')
+
+    summary = sync(path, base_url, closed_at(49))
+
+    assert summary['appended'] == 50
+    assert int(ohlc_store.open_store(path).time[-1]) * 1000 == klines[-1][0]
+
+
+def test_routine_refresh_makes_one_request(tmp_path, exchange):
+    klines = random_walk_klines(1500, start_ms=START_MS)
+    base_url, store = exchange(klines)
+    sync(tmp_path / 'store', base_url, closed_at(1200))
+
+    before = store.requests
+    summary = sync(tmp_path / 'store', base_url, closed_at(1201))
+
+    assert store.requests - before == 1
+    assert summary['requests'] == 1
+    assert summary['appended'] == 1
+    series = ohlc_store.open_store(str(tmp_path / 'store'))
+    assert len(series) == 1202
+    assert int(series.time[-1]) * 1000 == klines[1201][0]
+
+
+def test_overlapping_last_candle_is_deduped_or_replaced(tmp_path, exchange):
+    klines = random_walk_klines(300, start_ms=START_MS)
+    base_url, _ = exchange(klines)
+    path = tmp_path / 'store'
+    sync(path, base_url, closed_at(199))
+
+    # 没有新 K 线时，重叠的最后一根不会重复追加
+    summary = sync(path, base_url, closed_at(199))
+    assert summary['appended'] == 0
+    assert not summary['replaced']
+    series = ohlc_store.open_store(str(path))
+    assert len(series) == 200
+    assert len(set(series.time.tolist())) == 200
+
+    # 交易所修正了最后一根：覆盖而不是追加
+    klines[199][4] = '12345.67'
+    summary = sync(path, base_url, closed_at(199))
+    assert summary['appended'] == 0
+    assert summary['replaced']
+    series = ohlc_store.open_store(str(path))
+    assert len(series) == 200
+    assert series.close[-1] == pytest.approx(12345.67)
+
+
+def test_unclosed_candle_is_left_out(tmp_path, exchange):
+    klines = random_walk_klines(300, start_ms=START_MS)
+    base_url, _ = exchange(klines)
+    path = tmp_path / 'store'
+
+    # 第 250 根刚开盘一半：不写入存储
+    sync(path, base_url, START_MS + 250 * HOUR_MS + HOUR_MS // 2)
+    series = ohlc_store.open_store(str(path))
+    assert int(series.time[-1]) * 1000 == klines[249][0]
+
+    # 收盘之后的下一次同步才追加
+    summary = sync(path, base_url, closed_at(250))
+    assert summary['appended'] == 1
+    assert int(ohlc_store.open_store(str(path)).time[-1]) * 1000 == klines[250][0]
+
+
+def test_gap_is_backfilled(tmp_path, exchange):
+    klines = random_walk_klines(400, start_ms=START_MS)
+    base_url, _ = exchange(klines)
+    path = str(tmp_path / 'store')
+    # 本地存储缺少第 100..119 根，交易所有这段数据
+    local = klines[:100] + klines[120:300]
+    ohlc_store.write_store(path, klines_to_columns(local), 'BTCUSDT', '1h')
+
+    summary = sync(path, base_url, closed_at(299))
+
+    assert summary['gaps'] == 1
+    assert summary['backfilled'] == 20
+    series = ohlc_store.open_store(path)
+    assert len(series) == 300
+    assert ohlc_store.find_gaps(series.time, 3600) == []
+    assert series.close[110] == pytest.approx(float(klines[110][4]))
+
+
+def test_empty_gap_is_recorded_and_not_requested_again(tmp_path, exchange):
+    klines = random_walk_klines(400, start_ms=START_MS)
+    # 交易所在第 100..119 根确实没有数据（例如停机维护）
+    served = klines[:100] + klines[120:]
+    base_url, store = exchange(served)
+    path = str(tmp_path / 'store')
+    ohlc_store.write_store(path, klines_to_columns(served[:280]), 'BTCUSDT', '1h')
+
+    summary = sync(path, base_url, closed_at(299))
+    assert summary['gaps'] == 1
+    assert summary['backfilled'] == 0
+    gap = [(klines[100][0] // 1000, klines[119][0] // 1000)]
+    assert [tuple(g) for g in ohlc_store.read_meta(path)['known_gaps']] == gap
+
+    before = store.requests
+    summary = sync(path, base_url, closed_at(300))
+    assert summary['gaps'] == 0
+    assert summary['requests'] == 1
+    assert store.requests - before == 1
+    assert [tuple(g) for g in ohlc_store.read_meta(path)['known_gaps']] == gap
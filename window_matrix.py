@@ -0,0 +1,92 @@
+"""
+滑动窗口矩阵构建
+把收盘价序列变成零拷贝的窗口视图，并一次性完成每个窗口的 min-max 归一化
+"""
+import numpy as np
+
+# 惰性生成时每块的窗口数
+CHUNK_SIZE = 8192
+
+
+def close_array(data):
+    """从 OHLC 数据中取出收盘价数组（只转换一次）"""
+    if hasattr(data, 'close'):
+        return np.asarray(data.close, dtype=float)
+    return np.fromiter((c['close'] for c in data), dtype=float, count=len(data))
+
+
+def sliding_windows(series, length):
+    """所有长度为 length 的窗口，(N-L+1, L) 的跨步视图，不复制数据"""
+    return np.lib.stride_tricks.sliding_window_view(np.asarray(series, dtype=float), length)
+
+
+def _rolling_extreme(series, length, accumulate, fill):
+    """
+    van Herk / Gil-Werman 滚动极值，O(N)
+
+    按 length 分块，块内前缀极值 g 与后缀极值 h，
+    窗口 [i, i+L-1] 的极值 = op(h[i], g[i+L-1])
+    """
+    n = series.shape[0]
+    blocks = -(-n // length)
+    padded = np.full(blocks * length, fill)
+    padded[:n] = series
+    grid = padded.reshape(blocks, length)
+    prefix = accumulate(grid, axis=1).ravel()
+    suffix = accumulate(grid[:, ::-1], axis=1)[:, ::-1].ravel()
+    count = n - length + 1
+    return suffix[:count], prefix[length - 1:length - 1 + count]
+
+
+def rolling_min_max(series, length):
+    """每个窗口的最小值与最大值"""
+    series = np.asarray(series, dtype=float)
+    if length > series.shape[0]:
+        empty = np.empty(0)
+        return empty, empty
+    low_h, low_g = _rolling_extreme(series, length, np.minimum.accumulate, np.inf)
+    high_h, high_g = _rolling_extreme(series, length, np.maximum.accumulate, -np.inf)
+    return np.minimum(low_h, low_g), np.maximum(high_h, high_g)
+
+
+def _normalize_block(view, low, high):
+    """对一块窗口做 min-max 归一化，区间为 0 的窗口置 0（与 normalize 一致）"""
+    span = high - low
+    flat = span == 0
+    out = (view - low[:, None]) / np.where(flat, 1.0, span)[:, None]
+    out[flat] = 0.0
+    return out
+
+
+def normalized_windows(series, length, start=0, stop=None):
+    """
+    返回第 start 到 stop-1 个窗口的归一化矩阵
+
+    series: 收盘价数组
+    length: 窗口长度
+    """
+    series = np.asarray(series, dtype=float)
+    view = sliding_windows(series, length)
+    stop = view.shape[0] if stop is None else min(stop, view.shape[0])
+    low, high = rolling_min_max(series, length)
+    return _normalize_block(view[start:stop], low[start:stop], high[start:stop])
+
+
+def gather_normalized_windows(series, length, indices):
+    """只取指定下标的窗口并归一化，(len(indices), L)，不需要构建整个窗口矩阵"""
+    block = sliding_windows(series, length)[np.asarray(indices, dtype=int)]
+    return _normalize_block(block, block.min(axis=1), block.max(axis=1))
+
+
+def iter_normalized_windows(series, length, chunk_size=CHUNK_SIZE, start=0, stop=None):
+    """
+    惰性地按块生成归一化窗口，每次 yield (起始窗口下标, 块矩阵)
+    滚动 min/max 只计算一次，峰值内存与块大小成正比
+    """
+    series = np.asarray(series, dtype=float)
+    view = sliding_windows(series, length)
+    stop = view.shape[0] if stop is None else min(stop, view.shape[0])
+    low, high = rolling_min_max(series, length)
+    for offset in range(start, stop, chunk_size):
+        end = min(offset + chunk_size, stop)
+        yield offset, _normalize_block(view[offset:end], low[offset:end], high[offset:end])